@@ -1,20 +1,98 @@
 import flask
 
 from data_layer import path_utils
-from presentation_layer import ehr_routes, demographic_routes, prov_routes, timing_routes
-from app_settings import SERVER_PORT, PLAIN_HTTP, INCLUDE_USAGE_STATISTICS
+from data_layer.compression import CompressionPolicy, CompressionMiddleware
+from presentation_layer import ehr_routes, demographic_routes, prov_routes, patient_record_routes, batch_routes, query_export_routes, timing_routes, metrics_routes
+from app_settings import SERVER_PORT, PLAIN_HTTP, INCLUDE_USAGE_STATISTICS, INCLUDE_METRICS, PROXY_ENGINE, ASGI_MAX_UPSTREAM_CONNECTIONS, SERVER_MODE, SERVER_WORKERS, SERVER_THREADS, SERVER_KEEPALIVE, SERVER_BACKLOG, SERVER_GRACEFUL_TIMEOUT, SERVER_MAX_REQUESTS, SERVER_MAX_REQUESTS_JITTER, COMPRESS_RESPONSES, COMPRESSION_ENCODINGS, COMPRESSION_MIN_SIZE, EHR_ID_CACHE_WARM_UP
 
 server = flask.Flask(__name__)
 
 server.register_blueprint(ehr_routes.blueprint)
 server.register_blueprint(demographic_routes.blueprint)
 server.register_blueprint(prov_routes.blueprint)
+server.register_blueprint(patient_record_routes.blueprint)
+server.register_blueprint(batch_routes.blueprint)
+server.register_blueprint(query_export_routes.blueprint)
 
 if INCLUDE_USAGE_STATISTICS:
     server.register_blueprint(timing_routes.blueprint)
 
-if __name__ == "__main__":
+if INCLUDE_METRICS:
+    server.register_blueprint(metrics_routes.blueprint)
+
+if INCLUDE_USAGE_STATISTICS:
+    from business_layer.timing import timed
+    from data_layer.shared_statistics import SharedTimed
+
+    # Size the shared measurements for the routes registered above, in all worker processes and this one, before any is recorded.
+    if isinstance(timed, SharedTimed):
+        timed.reserve(SERVER_WORKERS + 1)
+
+if COMPRESS_RESPONSES:
+    compression_policy = CompressionPolicy(COMPRESSION_ENCODINGS, COMPRESSION_MIN_SIZE)
+    server.wsgi_app = CompressionMiddleware(server.wsgi_app, compression_policy)
+
+if EHR_ID_CACHE_WARM_UP:
+    from business_layer.caches import ehr_id_cache
+    from business_layer.ehr_id_warm_up import warm_up_ehr_id_cache
+
+    # Fill the EHR id cache before the worker processes are forked.
+    if ehr_id_cache is not None:
+        warm_up_ehr_id_cache(server)
+
+if PROXY_ENGINE == "asgi":
+    from data_layer.asgi_proxy import AsgiProxyApp
+    from data_layer.compression import AsgiCompressionMiddleware
+
+    # Serve the proxied routes asynchronously, and everything else with the Flask application.
+    asgi_server = AsgiProxyApp(server, [ehr_routes.proxy, demographic_routes.proxy, prov_routes.proxy], max_connections=ASGI_MAX_UPSTREAM_CONNECTIONS)
+
+    if COMPRESS_RESPONSES:
+        # responses of the Flask application are already compressed, so they are left as they are.
+        asgi_server = AsgiCompressionMiddleware(asgi_server, compression_policy)
+
+def run_production_server():
+    from data_layer import production_server
+
+    application = asgi_server if PROXY_ENGINE == "asgi" else server
+    options = {
+        "port": SERVER_PORT,
+        "workers": SERVER_WORKERS,
+        "threads": SERVER_THREADS,
+        "keepalive": SERVER_KEEPALIVE,
+        "backlog": SERVER_BACKLOG,
+        "graceful_timeout": SERVER_GRACEFUL_TIMEOUT,
+        "max_requests": SERVER_MAX_REQUESTS,
+        "max_requests_jitter": SERVER_MAX_REQUESTS_JITTER,
+        "asgi": PROXY_ENGINE == "asgi"
+    }
+
     if PLAIN_HTTP:
+        # Simply run the server.
+        production_server.run(application, **options)
+    else:
+        # Get the path to the SSL files.
+        certificate_path = path_utils.relative_path("certificate", "api-cert.pem")
+        key_path = path_utils.relative_path("certificate", "api-key.pem")
+
+        # Run the server with the SSL files.
+        production_server.run(application, certificate_path=certificate_path, key_path=key_path, **options)
+
+def run_development_server():
+    if PROXY_ENGINE == "asgi":
+        import uvicorn
+
+        if PLAIN_HTTP:
+            # Simply run the server.
+            uvicorn.run(asgi_server, host="0.0.0.0", port=SERVER_PORT)
+        else:
+            # Get the path to the SSL files.
+            certificate_path = path_utils.relative_path("certificate", "api-cert.pem")
+            key_path = path_utils.relative_path("certificate", "api-key.pem")
+
+            # Run the server with the SSL files.
+            uvicorn.run(asgi_server, host="0.0.0.0", port=SERVER_PORT, ssl_certfile=certificate_path, ssl_keyfile=key_path)
+    elif PLAIN_HTTP:
         # Simply run the server.
         server.run(host="0.0.0.0", port=SERVER_PORT)
     else:
@@ -24,3 +102,9 @@ if __name__ == "__main__":
 
         # Run the server with the SSL files.
         server.run(host="0.0.0.0", port=SERVER_PORT, ssl_context=(certificate_path, key_path))
+
+if __name__ == "__main__":
+    if SERVER_MODE == "development":
+        run_development_server()
+    else:
+        run_production_server()
@@ -1,18 +1,122 @@
 import os
+import json
+import multiprocessing
 
 PLAIN_HTTP = (os.environ.get("PLAIN_HTTP", "no").lower() == "yes")
 SERVER_PORT = int(os.environ.get("SERVER_PORT", "12000"))
+PROXY_ENGINE = os.environ.get("PROXY_ENGINE", "flask").lower()
+ASGI_MAX_UPSTREAM_CONNECTIONS = int(os.environ.get("ASGI_MAX_UPSTREAM_CONNECTIONS", "1000"))
+SERVER_MODE = os.environ.get("SERVER_MODE", "production").lower()
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", str(multiprocessing.cpu_count())))
+SERVER_THREADS = int(os.environ.get("SERVER_THREADS", "8"))
+SERVER_KEEPALIVE = int(os.environ.get("SERVER_KEEPALIVE", "5"))
+SERVER_BACKLOG = int(os.environ.get("SERVER_BACKLOG", "2048"))
+SERVER_GRACEFUL_TIMEOUT = int(os.environ.get("SERVER_GRACEFUL_TIMEOUT", "30"))
+SERVER_MAX_REQUESTS = int(os.environ.get("SERVER_MAX_REQUESTS", "0"))
+SERVER_MAX_REQUESTS_JITTER = int(os.environ.get("SERVER_MAX_REQUESTS_JITTER", "0"))
 INCLUDE_USAGE_STATISTICS = (os.environ.get("INCLUDE_USAGE_STATISTICS", "no").lower() == "yes")
 USAGE_STATISTICS_MAX_SAMPLES = int(os.environ.get("USAGE_STATISTICS_MAX_SAMPLES", "1000"))
+INCLUDE_METRICS = (os.environ.get("INCLUDE_METRICS", "no").lower() == "yes")
+SHARE_METRICS = (os.environ.get("SHARE_METRICS", "yes").lower() == "yes")
+METRICS_MAX_SERIES = int(os.environ.get("METRICS_MAX_SERIES", "4096"))
+USAGE_STATISTICS_WINDOW = float(os.environ.get("USAGE_STATISTICS_WINDOW", "60"))
+SHARE_USAGE_STATISTICS = (os.environ.get("SHARE_USAGE_STATISTICS", "yes").lower() == "yes")
+USAGE_STATISTICS_SHARED_MEMORY = int(os.environ.get("USAGE_STATISTICS_SHARED_MEMORY", str(128 * 1024 * 1024)))
+STREAMING_CHUNK_SIZE = int(os.environ.get("STREAMING_CHUNK_SIZE", "65536"))
+COMPRESS_RESPONSES = (os.environ.get("COMPRESS_RESPONSES", "no").lower() == "yes")
+COMPRESSION_ENCODINGS = [encoding.strip().lower() for encoding in os.environ.get("COMPRESSION_ENCODINGS", "gzip").split(",") if encoding.strip() != ""]
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+REQUEST_COMPRESSED_UPSTREAM_BODIES = (os.environ.get("REQUEST_COMPRESSED_UPSTREAM_BODIES", "yes").lower() == "yes")
+PASS_THROUGH_COMPRESSED_BODIES = (os.environ.get("PASS_THROUGH_COMPRESSED_BODIES", "no").lower() == "yes")
+GUARD_UPSTREAMS = (os.environ.get("GUARD_UPSTREAMS", "no").lower() == "yes")
+UPSTREAM_CONCURRENCY_LIMIT = int(os.environ.get("UPSTREAM_CONCURRENCY_LIMIT", "20"))
+UPSTREAM_MIN_CONCURRENCY_LIMIT = int(os.environ.get("UPSTREAM_MIN_CONCURRENCY_LIMIT", "2"))
+UPSTREAM_MAX_CONCURRENCY_LIMIT = int(os.environ.get("UPSTREAM_MAX_CONCURRENCY_LIMIT", "200"))
+UPSTREAM_LATENCY_TOLERANCE = float(os.environ.get("UPSTREAM_LATENCY_TOLERANCE", "3"))
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_BREAKER_FAILURE_THRESHOLD", "5"))
+CIRCUIT_BREAKER_RESET_TIMEOUT = float(os.environ.get("CIRCUIT_BREAKER_RESET_TIMEOUT", "30"))
+HEDGE_REQUESTS = (os.environ.get("HEDGE_REQUESTS", "no").lower() == "yes")
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", "0.05"))
+HEDGE_MAX_WORKERS = int(os.environ.get("HEDGE_MAX_WORKERS", "64"))
+UPSTREAM_MAX_RETRIES = int(os.environ.get("UPSTREAM_MAX_RETRIES", "0"))
+RETRY_BACKOFF = float(os.environ.get("RETRY_BACKOFF", "0.05"))
+RETRY_BUDGET_RATIO = float(os.environ.get("RETRY_BUDGET_RATIO", "0.1"))
+RETRY_BUDGET_MIN_PER_SECOND = float(os.environ.get("RETRY_BUDGET_MIN_PER_SECOND", "1"))
+LOAD_BALANCING = os.environ.get("LOAD_BALANCING", "least_outstanding").lower()
+ENDPOINT_EJECTION_FAILURES = int(os.environ.get("ENDPOINT_EJECTION_FAILURES", "5"))
+ENDPOINT_EJECTION_TIME = float(os.environ.get("ENDPOINT_EJECTION_TIME", "30"))
+CACHE_VERSIONED_RESOURCES = (os.environ.get("CACHE_VERSIONED_RESOURCES", "no").lower() == "yes")
+VERSIONED_RESOURCE_CACHE_MAX_ENTRIES = int(os.environ.get("VERSIONED_RESOURCE_CACHE_MAX_ENTRIES", "10000"))
+VERSIONED_RESOURCE_CACHE_MAX_BYTES = int(os.environ.get("VERSIONED_RESOURCE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+VERSIONED_RESOURCE_CACHE_MAX_ENTRY_BYTES = int(os.environ.get("VERSIONED_RESOURCE_CACHE_MAX_ENTRY_BYTES", str(1024 * 1024)))
+COALESCE_REQUESTS = (os.environ.get("COALESCE_REQUESTS", "no").lower() == "yes")
+PATIENT_RECORD_TIMEOUT = float(os.environ.get("PATIENT_RECORD_TIMEOUT", "10"))
+PATIENT_RECORD_MAX_WORKERS = int(os.environ.get("PATIENT_RECORD_MAX_WORKERS", "16"))
+BATCH_MAX_REQUESTS = int(os.environ.get("BATCH_MAX_REQUESTS", "10000"))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "16"))
+BATCH_MAX_WORKERS = int(os.environ.get("BATCH_MAX_WORKERS", "32"))
+AQL_EXPORT_PAGE_SIZE = int(os.environ.get("AQL_EXPORT_PAGE_SIZE", "1000"))
+AQL_EXPORT_MAX_WORKERS = int(os.environ.get("AQL_EXPORT_MAX_WORKERS", "8"))
+CACHE_DEFINITIONS = (os.environ.get("CACHE_DEFINITIONS", "no").lower() == "yes")
+DEFINITION_CACHE_MAX_ENTRIES = int(os.environ.get("DEFINITION_CACHE_MAX_ENTRIES", "1000"))
+DEFINITION_CACHE_MAX_BYTES = int(os.environ.get("DEFINITION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+DEFINITION_CACHE_MAX_ENTRY_BYTES = int(os.environ.get("DEFINITION_CACHE_MAX_ENTRY_BYTES", str(8 * 1024 * 1024)))
+DEFINITION_CACHE_TTL = float(os.environ.get("DEFINITION_CACHE_TTL", "300"))
+DISK_CACHE = (os.environ.get("DISK_CACHE", "no").lower() == "yes")
+DISK_CACHE_PATH = os.environ.get("DISK_CACHE_PATH", "disk_cache")
+DISK_CACHE_MAX_ENTRIES = int(os.environ.get("DISK_CACHE_MAX_ENTRIES", "100000"))
+DISK_CACHE_MAX_BYTES = int(os.environ.get("DISK_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+DISK_CACHE_SEGMENT_BYTES = int(os.environ.get("DISK_CACHE_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+CACHE_EHR_IDS = (os.environ.get("CACHE_EHR_IDS", "no").lower() == "yes")
+EHR_ID_CACHE_MAX_ENTRIES = int(os.environ.get("EHR_ID_CACHE_MAX_ENTRIES", "100000"))
+EHR_ID_CACHE_MAX_BYTES = int(os.environ.get("EHR_ID_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+EHR_ID_CACHE_MAX_ENTRY_BYTES = int(os.environ.get("EHR_ID_CACHE_MAX_ENTRY_BYTES", str(64 * 1024)))
+EHR_ID_CACHE_TTL = float(os.environ.get("EHR_ID_CACHE_TTL", "300"))
+EHR_ID_CACHE_WARM_UP = (os.environ.get("EHR_ID_CACHE_WARM_UP", "no").lower() == "yes")
+EHR_ID_CACHE_WARM_UP_MAX_PATIENTS = int(os.environ.get("EHR_ID_CACHE_WARM_UP_MAX_PATIENTS", "10000"))
+EHR_ID_CACHE_WARM_UP_HEADERS = json.loads(os.environ.get("EHR_ID_CACHE_WARM_UP_HEADERS", "{}"))
+CACHE_QUERY_RESULTS = (os.environ.get("CACHE_QUERY_RESULTS", "no").lower() == "yes")
+QUERY_RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("QUERY_RESULT_CACHE_MAX_ENTRIES", "1000"))
+QUERY_RESULT_CACHE_MAX_BYTES = int(os.environ.get("QUERY_RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+QUERY_RESULT_CACHE_MAX_ENTRY_BYTES = int(os.environ.get("QUERY_RESULT_CACHE_MAX_ENTRY_BYTES", str(16 * 1024 * 1024)))
+QUERY_RESULT_CACHE_TTL = float(os.environ.get("QUERY_RESULT_CACHE_TTL", "30"))
 
-OPENEHR_API_BASE_URI = os.environ.get("OPENEHR_API_BASE_URI", "http://127.0.0.1:12003/ehrbase/rest/openehr")
+OPENEHR_API_BASE_URIS = [uri.strip() for uri in os.environ.get("OPENEHR_API_BASE_URI", "http://127.0.0.1:12003/ehrbase/rest/openehr").split(",") if uri.strip() != ""]
+OPENEHR_API_BASE_URI = OPENEHR_API_BASE_URIS[0]
 VALIDATE_OPENEHR_API_CERTIFICATE = (os.environ.get("VALIDATE_OPENEHR_API_CERTIFICATE", "no") == "yes")
 USE_CUSTOM_OPENEHR_API_CA_CERTIFICATE = (os.environ.get("USE_CUSTOM_OPENEHR_API_CA_CERTIFICATE", "no") == "yes")
+STREAM_OPENEHR_API_BODIES = (os.environ.get("STREAM_OPENEHR_API_BODIES", "no") == "yes")
+OPENEHR_API_POOL_CONNECTIONS = int(os.environ.get("OPENEHR_API_POOL_CONNECTIONS", "10"))
+OPENEHR_API_POOL_MAXSIZE = int(os.environ.get("OPENEHR_API_POOL_MAXSIZE", "32"))
+OPENEHR_API_POOL_BLOCK = (os.environ.get("OPENEHR_API_POOL_BLOCK", "no") == "yes")
+OPENEHR_API_POOL_IDLE_TIMEOUT = float(os.environ.get("OPENEHR_API_POOL_IDLE_TIMEOUT", "15"))
+OPENEHR_API_TLS_SESSION_RESUMPTION = (os.environ.get("OPENEHR_API_TLS_SESSION_RESUMPTION", "yes") == "yes")
+OPENEHR_API_CONNECT_TIMEOUT = float(os.environ.get("OPENEHR_API_CONNECT_TIMEOUT", "5")) or None
+OPENEHR_API_READ_TIMEOUT = float(os.environ.get("OPENEHR_API_READ_TIMEOUT", "60")) or None
 
-DEMOGRAPHIC_API_BASE_URI = os.environ.get("DEMOGRAPHIC_API_BASE_URI", "http://127.0.0.1:12002")
+DEMOGRAPHIC_API_BASE_URIS = [uri.strip() for uri in os.environ.get("DEMOGRAPHIC_API_BASE_URI", "http://127.0.0.1:12002").split(",") if uri.strip() != ""]
+DEMOGRAPHIC_API_BASE_URI = DEMOGRAPHIC_API_BASE_URIS[0]
 VALIDATE_DEMOGRAPHIC_API_CERTIFICATE = (os.environ.get("VALIDATE_DEMOGRAPHIC_API_CERTIFICATE", "no") == "yes")
 USE_CUSTOM_DEMOGRAPHIC_API_CA_CERTIFICATE = (os.environ.get("USE_CUSTOM_DEMOGRAPHIC_API_CA_CERTIFICATE", "no") == "yes")
+STREAM_DEMOGRAPHIC_API_BODIES = (os.environ.get("STREAM_DEMOGRAPHIC_API_BODIES", "no") == "yes")
+DEMOGRAPHIC_API_POOL_CONNECTIONS = int(os.environ.get("DEMOGRAPHIC_API_POOL_CONNECTIONS", "10"))
+DEMOGRAPHIC_API_POOL_MAXSIZE = int(os.environ.get("DEMOGRAPHIC_API_POOL_MAXSIZE", "32"))
+DEMOGRAPHIC_API_POOL_BLOCK = (os.environ.get("DEMOGRAPHIC_API_POOL_BLOCK", "no") == "yes")
+DEMOGRAPHIC_API_POOL_IDLE_TIMEOUT = float(os.environ.get("DEMOGRAPHIC_API_POOL_IDLE_TIMEOUT", "15"))
+DEMOGRAPHIC_API_TLS_SESSION_RESUMPTION = (os.environ.get("DEMOGRAPHIC_API_TLS_SESSION_RESUMPTION", "yes") == "yes")
+DEMOGRAPHIC_API_CONNECT_TIMEOUT = float(os.environ.get("DEMOGRAPHIC_API_CONNECT_TIMEOUT", "5")) or None
+DEMOGRAPHIC_API_READ_TIMEOUT = float(os.environ.get("DEMOGRAPHIC_API_READ_TIMEOUT", "60")) or None
 
-PROV_API_BASE_URI = os.environ.get("PROV_API_BASE_URI", "http://127.0.0.1:12001")
+PROV_API_BASE_URIS = [uri.strip() for uri in os.environ.get("PROV_API_BASE_URI", "http://127.0.0.1:12001").split(",") if uri.strip() != ""]
+PROV_API_BASE_URI = PROV_API_BASE_URIS[0]
 VALIDATE_PROV_API_CERTIFICATE = (os.environ.get("VALIDATE_PROV_API_CERTIFICATE", "no") == "yes")
 USE_CUSTOM_PROV_API_CA_CERTIFICATE = (os.environ.get("USE_CUSTOM_PROV_API_CA_CERTIFICATE", "no") == "yes")
+STREAM_PROV_API_BODIES = (os.environ.get("STREAM_PROV_API_BODIES", "no") == "yes")
+PROV_API_POOL_CONNECTIONS = int(os.environ.get("PROV_API_POOL_CONNECTIONS", "10"))
+PROV_API_POOL_MAXSIZE = int(os.environ.get("PROV_API_POOL_MAXSIZE", "32"))
+PROV_API_POOL_BLOCK = (os.environ.get("PROV_API_POOL_BLOCK", "no") == "yes")
+PROV_API_POOL_IDLE_TIMEOUT = float(os.environ.get("PROV_API_POOL_IDLE_TIMEOUT", "15"))
+PROV_API_TLS_SESSION_RESUMPTION = (os.environ.get("PROV_API_TLS_SESSION_RESUMPTION", "yes") == "yes")
+PROV_API_CONNECT_TIMEOUT = float(os.environ.get("PROV_API_CONNECT_TIMEOUT", "5")) or None
+PROV_API_READ_TIMEOUT = float(os.environ.get("PROV_API_READ_TIMEOUT", "60")) or None
@@ -0,0 +1,364 @@
+"""
+Measures the throughput, latency, CPU time and memory of the gateway, running the real application (app.py) in front of stub
+servers which mimic the remote APIs (see stub_upstreams.py).
+
+The traffic is made of the requests of the Postman collection of the repository (except those of usage statistics), sent in
+random order by concurrent clients over keep-alive connections.
+
+Usage (from the root folder of the repository):
+
+    python benchmarks/load_test.py [--engine flask asgi] [--mix all|reads|writes] [--setting NAME=VALUE ...]
+                                   [--output results.json] [--baseline baseline.json]
+
+Each engine given is measured in turn, against the same stubs. The CPU time and memory are read from /proc, so they are only
+reported on Linux.
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import quote
+
+from stub_upstreams import StubUpstreams, StubSettings, add_stub_arguments
+
+ROOT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COLLECTION_PATH = os.path.join(ROOT_FOLDER, "OpenEHR proxy Service.postman_collection.json")
+
+# the folders of the Postman collection which are not part of the traffic.
+EXCLUDED_FOLDERS = ["Usage statistics"]
+
+# the metrics compared with a baseline, and whether higher values are better.
+COMPARED_METRICS = {"throughput": True, "p50_ms": False, "p99_ms": False, "cpu_ms_per_request": False}
+
+class BenchmarkRequest:
+    """
+    A request of the traffic, with its path relative to the base URL of the gateway.
+    """
+
+    def __init__(self, name : str, method : str, path : str, headers : dict, body : bytes):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+
+def load_collection_requests(base_url : str) -> list:
+    """
+    Reads the requests of the Postman collection, replacing its variables: {{BASE_URL}} by the base URL of the gateway and the
+    path variables (e.g. :ehr_id) by their values in the collection.
+    """
+
+    with open(COLLECTION_PATH, encoding="utf-8") as collection_file:
+        collection = json.load(collection_file)
+
+    result = []
+    def add_items(items):
+        for item in items:
+            if "item" in item:
+                if item["name"] not in EXCLUDED_FOLDERS:
+                    add_items(item["item"])
+                continue
+
+            postman_request = item["request"]
+            url = postman_request["url"]
+            path = url["raw"].replace("{{BASE_URL}}", "", 1)
+            for variable in url.get("variable", []):
+                path = re.sub(":{}(?=/|\\?|$)".format(re.escape(variable["key"])), variable["value"], path)
+            path = path.replace("{{BASE_URL}}", quote(base_url, safe=":/"))
+
+            headers = {header["key"]: header["value"] for header in postman_request.get("header", []) if not header.get("disabled", False)}
+            body = postman_request.get("body", {}).get("raw", "").encode("utf-8")
+            if len(body) > 0:
+                headers.setdefault("Content-Type", "application/json")
+            result.append(BenchmarkRequest(item["name"], postman_request["method"], path, headers, body))
+
+    add_items(collection["item"])
+    return result
+
+def select_mix(requests : list, mix : str) -> list:
+    if mix == "reads":
+        return [request for request in requests if request.method == "GET"]
+    if mix == "writes":
+        return [request for request in requests if request.method != "GET"]
+    return requests
+
+def find_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port : int, timeout : float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1.0):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("the gateway did not start listening on port {} in time".format(port))
+
+def run_stubs(settings : StubSettings, connection):
+    """
+    Runs the stubs in their own process, so that they do not compete with the clients for the GIL.
+    """
+
+    stubs = StubUpstreams(settings)
+    stubs.start()
+    connection.send(stubs.base_uris())
+    connection.recv()
+    stubs.stop()
+
+def process_tree(pid : int) -> list:
+    """
+    Gets a process and all of its descendants (e.g. the worker processes of the production server).
+    """
+
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/{}/stat".format(entry)) as stat_file:
+                parent = int(stat_file.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+
+    result = []
+    pending = [pid]
+    while len(pending) > 0:
+        current = pending.pop()
+        result.append(current)
+        pending.extend(children.get(current, []))
+    return result
+
+def cpu_seconds(pid : int) -> float:
+    """
+    Gets the CPU time (user and system) used so far by a process and its descendants, or None if it can not be read.
+    """
+
+    if not os.path.isdir("/proc"):
+        return None
+    ticks = 0
+    for current in process_tree(pid):
+        try:
+            with open("/proc/{}/stat".format(current)) as stat_file:
+                fields = stat_file.read().rsplit(")", 1)[1].split()
+            ticks += int(fields[11]) + int(fields[12])
+        except (OSError, IndexError, ValueError):
+            continue
+    return ticks / os.sysconf("SC_CLK_TCK")
+
+def rss_bytes(pid : int) -> int:
+    """
+    Gets the resident memory of a process and its descendants, or None if it can not be read.
+    """
+
+    if not os.path.isdir("/proc"):
+        return None
+    total = 0
+    for current in process_tree(pid):
+        try:
+            with open("/proc/{}/status".format(current)) as status_file:
+                for line in status_file:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+        except (OSError, ValueError):
+            continue
+    return total
+
+class LoadGenerator:
+    """
+    Sends the requests of a traffic mix to the gateway from concurrent clients, each with its own keep-alive connection.
+    """
+
+    def __init__(self, port : int, requests : list, concurrency : int, seed : int):
+        self._port = port
+        self._requests = requests
+        self._concurrency = concurrency
+        self._seed = seed
+
+    def run(self, duration : float) -> tuple:
+        """
+        Sends requests for the given number of seconds, returning the latencies of the successful requests and the number of
+        failed requests (those which were not answered, or were answered with a 5xx status code).
+        """
+
+        deadline = time.monotonic() + duration
+        latencies = [[] for _ in range(self._concurrency)]
+        errors = [0] * self._concurrency
+        threads = [threading.Thread(target=self._client, args=(index, deadline, latencies[index], errors)) for index in range(self._concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return [latency for client_latencies in latencies for latency in client_latencies], sum(errors)
+
+    def _client(self, index : int, deadline : float, latencies : list, errors : list):
+        generator = random.Random(self._seed + index)
+        connection = http.client.HTTPConnection("127.0.0.1", self._port, timeout=60)
+        try:
+            while time.monotonic() < deadline:
+                request = generator.choice(self._requests)
+                start_time = time.perf_counter()
+                try:
+                    connection.request(request.method, request.path, body=request.body or None, headers=request.headers)
+                    response = connection.getresponse()
+                    response.read()
+                except (OSError, http.client.HTTPException):
+                    errors[index] += 1
+                    connection.close()
+                    continue
+                if response.status >= 500:
+                    errors[index] += 1
+                else:
+                    latencies.append(time.perf_counter() - start_time)
+        finally:
+            connection.close()
+
+def percentile(sorted_values : list, percentile : float) -> float:
+    if len(sorted_values) == 0:
+        return None
+    index = min(len(sorted_values) - 1, int(round(percentile / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def measure(engine : str, args, base_uris : dict) -> dict:
+    """
+    Starts the gateway with the given engine, warms it up and measures it.
+    """
+
+    port = find_free_port()
+    environment = dict(os.environ)
+    environment.update(base_uris)
+    environment.update({
+        "PLAIN_HTTP": "yes",
+        "SERVER_PORT": str(port),
+        "SERVER_MODE": "production",
+        "PROXY_ENGINE": engine,
+        "SERVER_WORKERS": str(args.workers),
+        "SERVER_THREADS": str(args.threads)
+    })
+    for setting in args.setting:
+        name, value = setting.split("=", 1)
+        environment[name] = value
+
+    gateway = subprocess.Popen([sys.executable, "app.py"], cwd=ROOT_FOLDER, env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port, args.startup_timeout)
+        requests = select_mix(load_collection_requests("http://127.0.0.1:{}".format(port)), args.mix)
+        generator = LoadGenerator(port, requests, args.concurrency, args.seed)
+
+        generator.run(args.warmup)
+        cpu_before = cpu_seconds(gateway.pid)
+        start_time = time.perf_counter()
+        latencies, errors = generator.run(args.duration)
+        elapsed = time.perf_counter() - start_time
+        cpu_after = cpu_seconds(gateway.pid)
+        rss = rss_bytes(gateway.pid)
+    finally:
+        gateway.terminate()
+        try:
+            gateway.wait(timeout=args.startup_timeout)
+        except subprocess.TimeoutExpired:
+            gateway.kill()
+
+    latencies.sort()
+    requests_sent = len(latencies) + errors
+    result = {
+        "engine": engine,
+        "mix": args.mix,
+        "settings": args.setting,
+        "requests": requests_sent,
+        "errors": errors,
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": None if len(latencies) == 0 else percentile(latencies, 50.0) * 1000.0,
+        "p99_ms": None if len(latencies) == 0 else percentile(latencies, 99.0) * 1000.0,
+        "cpu_ms_per_request": None,
+        "rss_mib": None if rss is None else rss / (1024.0 * 1024.0)
+    }
+    if cpu_before is not None and requests_sent > 0:
+        result["cpu_ms_per_request"] = (cpu_after - cpu_before) / requests_sent * 1000.0
+    return result
+
+def format_value(value, digits : int = 2) -> str:
+    return "-" if value is None else "{:.{}f}".format(value, digits)
+
+def print_results(results : list):
+    print("{:<8} {:<7} {:>9} {:>7} {:>11} {:>9} {:>9} {:>12} {:>9}".format("engine", "mix", "requests", "errors", "requests/s", "p50 ms", "p99 ms", "cpu ms/req", "rss MiB"))
+    for result in results:
+        print("{:<8} {:<7} {:>9} {:>7} {:>11} {:>9} {:>9} {:>12} {:>9}".format(
+            result["engine"], result["mix"], result["requests"], result["errors"], format_value(result["throughput"], 1),
+            format_value(result["p50_ms"]), format_value(result["p99_ms"]), format_value(result["cpu_ms_per_request"], 3),
+            format_value(result["rss_mib"], 1)))
+
+def compare_with_baseline(results : list, baseline : list, tolerance : float) -> list:
+    """
+    Compares the results with those of a baseline run (matched by engine and mix), returning the descriptions of the metrics
+    which are worse than the baseline by more than the tolerance (a fraction of the baseline value).
+    """
+
+    regressions = []
+    for result in results:
+        for previous in baseline:
+            if previous["engine"] != result["engine"] or previous["mix"] != result["mix"]:
+                continue
+            for (metric, higher_is_better) in COMPARED_METRICS.items():
+                if result[metric] is None or not previous.get(metric):
+                    continue
+                change = (result[metric] - previous[metric]) / previous[metric]
+                if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                    regressions.append("{} ({}, {}): {} -> {} ({:+.1%})".format(metric, result["engine"], result["mix"], format_value(previous[metric]), format_value(result[metric]), change))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engine", nargs="+", default=["flask"], choices=["flask", "asgi"], help="proxy engines to measure, in turn")
+    parser.add_argument("--mix", default="all", choices=["all", "reads", "writes"], help="requests of the Postman collection which are sent")
+    parser.add_argument("--setting", action="append", default=[], metavar="NAME=VALUE", help="environment variable of the gateway (may be repeated)")
+    parser.add_argument("--workers", type=int, default=2, help="worker processes of the gateway")
+    parser.add_argument("--threads", type=int, default=8, help="threads of each worker process of the gateway")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of measured traffic")
+    parser.add_argument("--warmup", type=float, default=5.0, help="seconds of traffic sent before measuring")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random order of the requests")
+    parser.add_argument("--startup-timeout", type=float, default=30.0, help="seconds to wait for the gateway to start and stop")
+    parser.add_argument("--output", help="file where the results are written as JSON")
+    parser.add_argument("--baseline", help="JSON file of a previous run; exits with status 1 if the results are worse")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="fraction by which results may be worse than the baseline")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    stub_connection, connection = multiprocessing.Pipe()
+    stubs = multiprocessing.Process(target=run_stubs, args=(StubSettings(args.latency, args.jitter, args.payload_bytes), connection), daemon=True)
+    stubs.start()
+    try:
+        base_uris = stub_connection.recv()
+        results = [measure(engine, args, base_uris) for engine in args.engine]
+    finally:
+        stub_connection.send(None)
+        stubs.join(timeout=5.0)
+
+    print_results(results)
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            regressions = compare_with_baseline(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print("regression: " + regression)
+        if len(regressions) > 0:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
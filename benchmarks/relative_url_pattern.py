@@ -0,0 +1,44 @@
+"""
+Measures the per-request cost of translating the URLs of all the routes of the openEHR API.
+
+Usage (from the root folder of the repository):
+
+    python benchmarks/relative_url_pattern.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from presentation_layer import ehr_routes
+
+REPETITIONS = 5
+NUMBER = 20000
+
+def sample_request(route):
+    """
+    Builds the path parameters and query string of a request which uses all the variables of a route.
+    """
+
+    pattern = route.local_relative_url
+    path_params = {name: "value_of_" + name for name in pattern.path_variables}
+
+    # the routes of the openEHR API name their query string variables after their keys.
+    query_string = {name: "value_of_" + name for name in pattern.query_string_variables}
+    return path_params, query_string
+
+def main():
+    total = 0.0
+    print("{:<45} {:>12}".format("route", "ns/request"))
+    for route in ehr_routes.proxy.routes:
+        path_params, query_string = sample_request(route)
+        timer = timeit.Timer(lambda: route.translate(path_params, query_string))
+        best = min(timer.repeat(repeat=REPETITIONS, number=NUMBER)) / NUMBER
+        total += best
+        print("{:<45} {:>12.0f}".format(route.name, best * 1e9))
+    print("{:<45} {:>12.0f}".format("mean", total / len(ehr_routes.proxy.routes) * 1e9))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Stub servers which mimic the openEHR, demographic and PROV APIs, answering every request after a configurable latency with a
+JSON body of a configurable size.
+
+Usage (from the root folder of the repository):
+
+    python benchmarks/stub_upstreams.py [--latency SECONDS] [--jitter SECONDS] [--payload-bytes BYTES]
+
+The stubs listen on the ports of the default base URIs of the gateway, so a gateway run with the default settings (and
+PLAIN_HTTP set to yes) accesses them.
+"""
+
+import argparse
+import json
+import random
+import socket
+import threading
+import time
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# the APIs mimicked by the stubs, along with the base path of their URLs and the port of their default base URIs.
+STUB_APIS = [("openehr", "/ehrbase/rest/openehr", 12003), ("demographic", "", 12002), ("prov", "", 12001)]
+
+# the status codes of the responses to each method.
+STATUS_CODES = {"GET": 200, "POST": 201, "PUT": 200, "DELETE": 204}
+
+class StubSettings:
+    """
+    How the stub servers respond: each response is sent after latency seconds (plus a random jitter of up to jitter seconds),
+    with a body of about payload_bytes bytes.
+    """
+
+    def __init__(self, latency : float = 0.0, jitter : float = 0.0, payload_bytes : int = 1024):
+        self.latency = latency
+        self.jitter = jitter
+        self.payload_bytes = payload_bytes
+
+    def delay(self) -> float:
+        return self.latency + random.uniform(0.0, self.jitter)
+
+def create_payload(name : str, payload_bytes : int) -> bytes:
+    """
+    Creates a JSON body of (at least) the given size, shaped like a resource of the given API.
+    """
+
+    resource = {
+        "_type": "STUB_RESOURCE",
+        "api": name,
+        "uid": {"value": "{}::stub.example.com::1".format(uuid.UUID(int=0))},
+        "items": []
+    }
+    body = json.dumps(resource)
+    filler = "x" * 64
+    while len(body) < payload_bytes:
+        resource["items"].append({"_type": "ELEMENT", "value": filler})
+        body = json.dumps(resource)
+    return body.encode("utf-8")
+
+def create_handler(name : str, settings : StubSettings):
+    payload = create_payload(name, settings.payload_bytes)
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            # the headers and the body are written separately, so they must not wait for each other.
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def handle_request(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > 0:
+                self.rfile.read(length)
+
+            time.sleep(settings.delay())
+
+            status_code = STATUS_CODES.get(self.command, 200)
+            body = b"" if status_code == 204 else payload
+            self.send_response(status_code)
+            if len(body) > 0:
+                self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", '"{}"'.format(uuid.UUID(int=0)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = handle_request
+        do_POST = handle_request
+        do_PUT = handle_request
+        do_DELETE = handle_request
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+class StubUpstreams:
+    """
+    The stub servers of all APIs, served by background threads.
+
+    Unless default_ports is True, they listen on free ports chosen by the system.
+    """
+
+    def __init__(self, settings : StubSettings, host : str = "127.0.0.1", default_ports : bool = False):
+        self._servers = []
+        for (name, _, default_port) in STUB_APIS:
+            port = default_port if default_ports else 0
+            server = ThreadingHTTPServer((host, port), create_handler(name, settings))
+            server.daemon_threads = True
+            self._servers.append(server)
+        self._host = host
+
+    def base_uris(self) -> dict:
+        """
+        Gets the base URI of each API, by the name of its setting.
+        """
+
+        result = {}
+        for ((name, base_path, _), server) in zip(STUB_APIS, self._servers):
+            result["{}_API_BASE_URI".format(name.upper())] = "http://{}:{}{}".format(self._host, server.server_address[1], base_path)
+        return result
+
+    def start(self):
+        for server in self._servers:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+
+def add_stub_arguments(parser : argparse.ArgumentParser):
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds each stub waits before responding")
+    parser.add_argument("--jitter", type=float, default=0.0, help="maximum random seconds added to the latency")
+    parser.add_argument("--payload-bytes", type=int, default=1024, help="size of the response bodies of the stubs")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    stubs = StubUpstreams(StubSettings(args.latency, args.jitter, args.payload_bytes), default_ports=True)
+    stubs.start()
+    for (setting, base_uri) in stubs.base_uris().items():
+        print("{}={}".format(setting, base_uri))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stubs.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Measures the per-call overhead of measuring a function with timed.measure, for each kind of timed measurements, with one and
+with several threads calling the function concurrently.
+
+Usage (from the root folder of the repository):
+
+    python benchmarks/timed_measure.py
+"""
+
+import os
+import sys
+import threading
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_layer.shared_statistics import SharedTimed
+from data_layer.time_measurement import NotTimed, Timed
+
+REPETITIONS = 5
+NUMBER = 200000
+THREADS = 8
+MAX_SAMPLES = 100
+WINDOW_SECONDS = 60.0
+SHARED_MEMORY_SIZE = 16 * 1024 * 1024
+
+def function():
+    pass
+
+def measure_threads(fn, threads : int) -> float:
+    """
+    Gets the seconds per call when threads threads call a function NUMBER times each.
+    """
+
+    barrier = threading.Barrier(threads + 1)
+
+    def run():
+        barrier.wait()
+        for _ in range(NUMBER):
+            fn()
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start_time = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - start_time) / (NUMBER * threads)
+
+def main():
+    baseline = min(timeit.Timer(function).repeat(repeat=REPETITIONS, number=NUMBER)) / NUMBER
+    baseline_threads = min(measure_threads(function, THREADS) for _ in range(REPETITIONS))
+
+    timed_kinds = [
+        ("NotTimed", NotTimed()),
+        ("Timed", Timed(MAX_SAMPLES, WINDOW_SECONDS)),
+        ("SharedTimed", SharedTimed(MAX_SAMPLES, WINDOW_SECONDS, SHARED_MEMORY_SIZE))
+    ]
+    print("{:<15} {:>18} {:>18}".format("timed", "ns/call (1 thread)", "ns/call ({} threads)".format(THREADS)))
+    for (name, timed) in timed_kinds:
+        measured = timed.measure("function")(function)
+        single = min(timeit.Timer(measured).repeat(repeat=REPETITIONS, number=NUMBER)) / NUMBER
+        concurrent = min(measure_threads(measured, THREADS) for _ in range(REPETITIONS))
+        print("{:<15} {:>18.0f} {:>18.0f}".format(name, (single - baseline) * 1e9, (concurrent - baseline_threads) * 1e9))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import base64
+import json
+
+from werkzeug.test import EnvironBuilder
+
+from app_settings import BATCH_MAX_WORKERS, BATCH_CONCURRENCY
+
+BATCH_PATH = "/batch"
+
+# the headers of the batch request which are inherited by its sub-requests (unless they define them).
+INHERITED_HEADERS = ["Authorization", "Cookie"]
+
+executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix="batch")
+
+class InvalidBatch(Exception):
+    pass
+
+def parse_batch(batch) -> list:
+    """
+    Validates the sub-requests of a batch, which must be a list of objects with a path and, optionally, an id, a method (GET by
+    default), headers and a body (a string, or any other JSON value, which is sent encoded as JSON).
+    """
+
+    if not isinstance(batch, list):
+        raise InvalidBatch("the batch must be a list of requests")
+
+    for (index, sub_request) in enumerate(batch):
+        if not isinstance(sub_request, dict) or not isinstance(sub_request.get("path"), str) or not sub_request["path"].startswith("/"):
+            raise InvalidBatch("request {} must be an object with an absolute path".format(index))
+        if not isinstance(sub_request.get("method", "GET"), str) or not isinstance(sub_request.get("headers", {}), dict):
+            raise InvalidBatch("request {} has an invalid method or headers".format(index))
+    return batch
+
+def describe_response(response) -> dict:
+    """
+    Describes a response as a dictionary. JSON bodies are included as they are, other bodies as strings (or encoded with base64,
+    if they are not text).
+    """
+
+    result = {
+        "status": response.status_code,
+        "headers": dict(response.headers)
+    }
+
+    body = response.get_data()
+    if len(body) == 0:
+        return result
+
+    if response.is_json:
+        try:
+            result["body"] = json.loads(body)
+            return result
+        except ValueError:
+            pass
+    try:
+        result["body"] = body.decode("utf-8")
+    except UnicodeDecodeError:
+        result["body_base64"] = base64.b64encode(body).decode("ascii")
+    return result
+
+def execute_sub_request(app, index : int, sub_request : dict, inherited_headers : dict, base_url : str) -> dict:
+    """
+    Dispatches a sub-request to the route of the Flask application which handles its path, as if it had been sent by the client.
+    """
+
+    result = {"index": index}
+    if "id" in sub_request:
+        result["id"] = sub_request["id"]
+
+    headers = dict(inherited_headers)
+    headers.update(sub_request.get("headers", {}))
+    body = sub_request.get("body")
+    if body is not None and not isinstance(body, str):
+        body = json.dumps(body)
+        headers.setdefault("Content-Type", "application/json")
+
+    builder = EnvironBuilder(path=sub_request["path"], base_url=base_url, method=sub_request.get("method", "GET").upper(), headers=headers, data=body)
+    if builder.path == BATCH_PATH:
+        result["error"] = "batches can not be nested"
+        return result
+
+    try:
+        with app.request_context(builder.get_environ()):
+            response = app.full_dispatch_request()
+            try:
+                result.update(describe_response(response))
+            finally:
+                response.close()
+    except Exception as e:
+        result["error"] = "request failed: {}".format(e.__class__.__name__)
+    return result
+
+def execute_batch(app, batch : list, client_headers, base_url : str):
+    """
+    Executes the sub-requests of a batch, with at most BATCH_CONCURRENCY of them at once, yielding their results (as lines of
+    JSON) in the order they are completed.
+    """
+
+    inherited_headers = {name: client_headers[name] for name in INHERITED_HEADERS if name in client_headers}
+
+    sub_requests = iter(enumerate(batch))
+    pending = set()
+    while True:
+        for (index, sub_request) in sub_requests:
+            pending.add(executor.submit(execute_sub_request, app, index, sub_request, inherited_headers, base_url))
+            if len(pending) >= BATCH_CONCURRENCY:
+                break
+
+        if len(pending) == 0:
+            return
+
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield json.dumps(future.result()) + "\n"
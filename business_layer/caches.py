@@ -0,0 +1,196 @@
+import json
+
+from data_layer.response_cache import ResponseCache
+from data_layer.tag_generations import TagGenerations
+from data_layer.ehr_id_index import EhrIdIndex
+from data_layer.disk_cache import DiskCache, TieredCache
+from data_layer import path_utils
+from app_settings import CACHE_VERSIONED_RESOURCES, VERSIONED_RESOURCE_CACHE_MAX_ENTRIES, VERSIONED_RESOURCE_CACHE_MAX_BYTES, VERSIONED_RESOURCE_CACHE_MAX_ENTRY_BYTES
+from app_settings import CACHE_DEFINITIONS, DEFINITION_CACHE_MAX_ENTRIES, DEFINITION_CACHE_MAX_BYTES, DEFINITION_CACHE_MAX_ENTRY_BYTES, DEFINITION_CACHE_TTL
+from app_settings import DISK_CACHE, DISK_CACHE_PATH, DISK_CACHE_MAX_ENTRIES, DISK_CACHE_MAX_BYTES, DISK_CACHE_SEGMENT_BYTES
+from app_settings import CACHE_EHR_IDS, EHR_ID_CACHE_MAX_ENTRIES, EHR_ID_CACHE_MAX_BYTES, EHR_ID_CACHE_MAX_ENTRY_BYTES, EHR_ID_CACHE_TTL
+from app_settings import CACHE_QUERY_RESULTS, QUERY_RESULT_CACHE_MAX_ENTRIES, QUERY_RESULT_CACHE_MAX_BYTES, QUERY_RESULT_CACHE_MAX_ENTRY_BYTES, QUERY_RESULT_CACHE_TTL
+
+VERSIONED_RESOURCE_CACHE = "versioned_resources"
+DEFINITION_CACHE = "definitions"
+EHR_ID_CACHE = "ehr_ids"
+QUERY_RESULT_CACHE = "query_results"
+
+# the tags of the cached definitions, invalidated when definitions are uploaded.
+TEMPLATES_1_4_TAG = "templates_1_4"
+TEMPLATES_2_TAG = "templates_2"
+STORED_QUERIES_TAG = "stored_queries"
+
+# the tag of the cached results of the queries which are not scoped to an EHR (and may read any of them), invalidated when any
+# EHR is written.
+ALL_EHRS_TAG = "all_ehrs"
+
+# the kinds of the responses kept by the EHR id index.
+PATIENT_EHR_ID = "patient_ehr_id"
+SUBJECT_EHR = "subject_ehr"
+
+def is_version_uid(params : dict) -> bool:
+    """
+    Checks whether the version_uid argument of a request identifies a single version (e.g. "<object id>::<system id>::<version>")
+    instead of a versioned object, whose latest version may change.
+    """
+
+    return "::" in params.get("version_uid", "")
+
+def patient_tag(params : dict) -> str:
+    """
+    Gets the tag of the cached EHR id of the patient a request refers to, by its versioned_object_uid argument or by the object
+    id of its preceding_version_uid argument (e.g. "<object id>::<system id>::<version>").
+    """
+
+    if "versioned_object_uid" in params:
+        return "patient:" + params["versioned_object_uid"]
+    return "patient:" + params["preceding_version_uid"].split("::")[0]
+
+def patient_tags(params : dict) -> list:
+    """
+    Gets the tags of the cached EHR id of the patient a request refers to.
+    """
+
+    return [patient_tag(params)]
+
+def subject_tags(params : dict) -> list:
+    """
+    Gets the tags of the cached EHR id of the subject a request refers to.
+    """
+
+    return ["subject:{}:{}".format(params.get("subject_namespace", ""), params.get("subject_id", ""))]
+
+def ehr_id_tag(ehr_id : str) -> str:
+    """
+    Gets the tag of the cached EHR ids, EHRs and query results of an EHR.
+    """
+
+    return "ehr:" + ehr_id.lower()
+
+def ehr_tag(params : dict) -> str:
+    """
+    Gets the tag of the cached EHR ids, EHRs and query results of the EHR a request refers to.
+    """
+
+    return ehr_id_tag(params["ehr_id"])
+
+def read_ehr_id(body : bytes, field : str) -> str:
+    """
+    Gets the EHR id held by a field of a JSON response (as {"value": "<EHR id>"}), or None if it has none.
+    """
+
+    try:
+        ehr_id = json.loads(body)[field]["value"]
+    except (ValueError, KeyError, TypeError):
+        return None
+    return ehr_id if isinstance(ehr_id, str) else None
+
+def patient_ehr_id(body : bytes) -> str:
+    """
+    Gets the EHR id from the response of the demographic API which associates a patient with an EHR.
+    """
+
+    return read_ehr_id(body, "ehr_uid")
+
+def subject_ehr_id(body : bytes) -> str:
+    """
+    Gets the EHR id from an EHR returned by the openEHR API.
+    """
+
+    return read_ehr_id(body, "ehr_id")
+
+def query_tags(arguments : dict) -> list:
+    """
+    Gets the tags of the cached results of a query, given its normalized arguments: the tag of its EHR (or, if it is not scoped
+    to one, the tag of all EHRs) and, for stored queries, the tag of the stored queries.
+    """
+
+    tags = [ALL_EHRS_TAG] if arguments["ehr_id"] is None else [ehr_tag(arguments)]
+    if "qualified_query_name" in arguments:
+        tags.append(STORED_QUERIES_TAG)
+    return tags
+
+def with_disk_tier(name : str, cache : ResponseCache, max_entry_bytes : int, ttl : float = None):
+    """
+    Adds a disk tier, kept in a folder named after the cache, to an in-memory cache if the disk cache is enabled.
+    """
+
+    if not DISK_CACHE:
+        return cache
+    disk_cache = DiskCache(path_utils.relative_path(DISK_CACHE_PATH, name), DISK_CACHE_MAX_ENTRIES, DISK_CACHE_MAX_BYTES, max_entry_bytes, DISK_CACHE_SEGMENT_BYTES, ttl=ttl)
+    return TieredCache(cache, disk_cache)
+
+if CACHE_VERSIONED_RESOURCES:
+    versioned_resource_cache = with_disk_tier(VERSIONED_RESOURCE_CACHE,
+        ResponseCache(VERSIONED_RESOURCE_CACHE_MAX_ENTRIES, VERSIONED_RESOURCE_CACHE_MAX_BYTES, VERSIONED_RESOURCE_CACHE_MAX_ENTRY_BYTES),
+        VERSIONED_RESOURCE_CACHE_MAX_ENTRY_BYTES)
+else:
+    versioned_resource_cache = None
+
+if CACHE_DEFINITIONS:
+    definition_cache = with_disk_tier(DEFINITION_CACHE,
+        ResponseCache(DEFINITION_CACHE_MAX_ENTRIES, DEFINITION_CACHE_MAX_BYTES, DEFINITION_CACHE_MAX_ENTRY_BYTES, ttl=DEFINITION_CACHE_TTL, compress=True, generations=TagGenerations()),
+        DEFINITION_CACHE_MAX_ENTRY_BYTES, ttl=DEFINITION_CACHE_TTL)
+else:
+    definition_cache = None
+
+# the EHR id index only lives in memory: the ids are small and the responses are kept once per EHR. Its invalidations reach all
+# worker processes through the generations shared by its caches.
+if CACHE_EHR_IDS:
+    ehr_id_generations = TagGenerations()
+    ehr_id_cache = EhrIdIndex(
+        ResponseCache(EHR_ID_CACHE_MAX_ENTRIES, EHR_ID_CACHE_MAX_BYTES, EHR_ID_CACHE_MAX_ENTRY_BYTES, ttl=EHR_ID_CACHE_TTL, generations=ehr_id_generations),
+        ResponseCache(EHR_ID_CACHE_MAX_ENTRIES, EHR_ID_CACHE_MAX_BYTES, EHR_ID_CACHE_MAX_ENTRY_BYTES, ttl=EHR_ID_CACHE_TTL, generations=ehr_id_generations),
+        ehr_id_tag)
+    patient_ehr_id_cache = ehr_id_cache.resolver(PATIENT_EHR_ID, patient_ehr_id)
+    subject_ehr_cache = ehr_id_cache.resolver(SUBJECT_EHR, subject_ehr_id)
+else:
+    ehr_id_cache = None
+    patient_ehr_id_cache = None
+    subject_ehr_cache = None
+
+if CACHE_QUERY_RESULTS:
+    query_result_cache = with_disk_tier(QUERY_RESULT_CACHE,
+        ResponseCache(QUERY_RESULT_CACHE_MAX_ENTRIES, QUERY_RESULT_CACHE_MAX_BYTES, QUERY_RESULT_CACHE_MAX_ENTRY_BYTES, ttl=QUERY_RESULT_CACHE_TTL, compress=True, generations=TagGenerations()),
+        QUERY_RESULT_CACHE_MAX_ENTRY_BYTES, ttl=QUERY_RESULT_CACHE_TTL)
+else:
+    query_result_cache = None
+
+def invalidates_definitions(tag : str) -> list:
+    """
+    Gets the (cache, tag) pairs invalidated by a route which changes the definitions with a given tag.
+    """
+
+    if definition_cache is None:
+        return []
+    return [(definition_cache, tag)]
+
+def invalidates_ehr_ids(tag) -> list:
+    """
+    Gets the (cache, tag) pairs invalidated by a route which changes the EHR ids with a given tag (or tag function).
+    """
+
+    if ehr_id_cache is None:
+        return []
+    return [(ehr_id_cache, tag)]
+
+def invalidates_query_results(tag) -> list:
+    """
+    Gets the (cache, tag) pairs invalidated by a route which changes the query results with a given tag (or tag function).
+    """
+
+    if query_result_cache is None:
+        return []
+    return [(query_result_cache, tag)]
+
+def invalidates_ehr_query_results(tag) -> list:
+    """
+    Gets the (cache, tag) pairs invalidated by a route which writes the EHR with a given tag (or tag function): the results of
+    the queries scoped to that EHR, and those of the queries which are not scoped to an EHR.
+    """
+
+    return invalidates_query_results(tag) + invalidates_query_results(ALL_EHRS_TAG)
+
+ALL_CACHES = {name: cache for (name, cache) in [(VERSIONED_RESOURCE_CACHE, versioned_resource_cache), (DEFINITION_CACHE, definition_cache), (EHR_ID_CACHE, ehr_id_cache), (QUERY_RESULT_CACHE, query_result_cache)] if cache is not None}
+ALL_DISK_CACHES = {name: cache.disk for (name, cache) in ALL_CACHES.items() if isinstance(cache, TieredCache)}
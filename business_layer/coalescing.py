@@ -0,0 +1,11 @@
+from data_layer.single_flight import SingleFlight
+from app_settings import COALESCE_REQUESTS
+
+REQUEST_COALESCING = "requests"
+
+if COALESCE_REQUESTS:
+    request_coalescing = SingleFlight()
+else:
+    request_coalescing = None
+
+ALL_SINGLE_FLIGHTS = {name: single_flight for (name, single_flight) in [(REQUEST_COALESCING, request_coalescing)] if single_flight is not None}
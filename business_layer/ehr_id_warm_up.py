@@ -0,0 +1,60 @@
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import requests
+from werkzeug.test import EnvironBuilder
+
+from data_layer.backend_guard import BackendUnavailable
+from business_layer.upstreams import demographic_client, demographic_session
+from app_settings import EHR_ID_CACHE_WARM_UP_MAX_PATIENTS, EHR_ID_CACHE_WARM_UP_HEADERS
+
+# the number of EHR ids requested at once while warming up.
+WARM_UP_CONCURRENCY = 8
+
+def list_patient_ids() -> list:
+    """
+    Gets the ids of (at most EHR_ID_CACHE_WARM_UP_MAX_PATIENTS) patients from the demographic API, which lists them as a JSON
+    array of strings.
+    """
+
+    resp = demographic_client.request("GET", "/v1/patient", headers=EHR_ID_CACHE_WARM_UP_HEADERS)
+    if resp.status_code != 200:
+        return []
+    try:
+        patient_ids = resp.json()
+    except ValueError:
+        return []
+    if not isinstance(patient_ids, list):
+        return []
+    return [patient_id for patient_id in patient_ids if isinstance(patient_id, str)][:EHR_ID_CACHE_WARM_UP_MAX_PATIENTS]
+
+def resolve_ehr_id(app, patient_id : str) -> bool:
+    """
+    Dispatches a request for the EHR id of a patient to the route of the Flask application which handles it, so that its
+    response is cached as if it had been sent by a client with the warm-up headers. Returns whether it succeeded.
+    """
+
+    path = "/v1/versioned_patient/{}/ehr".format(quote(patient_id, safe=""))
+    builder = EnvironBuilder(path=path, method="GET", headers=EHR_ID_CACHE_WARM_UP_HEADERS)
+    with app.request_context(builder.get_environ()):
+        response = app.full_dispatch_request()
+        response.close()
+        return response.status_code == 200
+
+def warm_up_ehr_id_cache(app) -> int:
+    """
+    Resolves the EHR ids of the patients listed by the demographic API, returning how many were cached.
+
+    It runs when the application is imported, so the cached EHR ids are inherited by all worker processes. The connections
+    opened to the demographic API are closed afterwards, so that they are not shared by the worker processes.
+    """
+
+    try:
+        patient_ids = list_patient_ids()
+        with ThreadPoolExecutor(max_workers=WARM_UP_CONCURRENCY, thread_name_prefix="ehr_id_warm_up") as warm_up_executor:
+            return sum(warm_up_executor.map(lambda patient_id: resolve_ehr_id(app, patient_id), patient_ids))
+    except (requests.RequestException, BackendUnavailable) as e:
+        app.logger.warning("the EHR id cache could not be warmed up: %s", e.__class__.__name__)
+        return 0
+    finally:
+        demographic_session.close()
@@ -0,0 +1,12 @@
+from data_layer.hedging import RequestHedging, RetryBudget
+from app_settings import HEDGE_REQUESTS, HEDGE_PERCENTILE, HEDGE_MIN_DELAY, HEDGE_MAX_WORKERS, UPSTREAM_MAX_RETRIES, RETRY_BACKOFF, RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN_PER_SECOND
+
+IDEMPOTENT_READS = "idempotent_reads"
+
+if HEDGE_REQUESTS or UPSTREAM_MAX_RETRIES > 0:
+    retry_budget = RetryBudget(RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN_PER_SECOND)
+    request_hedging = RequestHedging(retry_budget, HEDGE_REQUESTS, HEDGE_PERCENTILE, HEDGE_MIN_DELAY, UPSTREAM_MAX_RETRIES, RETRY_BACKOFF, max_workers=HEDGE_MAX_WORKERS)
+else:
+    request_hedging = None
+
+ALL_HEDGING = {name: hedging for (name, hedging) in [(IDEMPOTENT_READS, request_hedging)] if hedging is not None}
@@ -0,0 +1,131 @@
+from data_layer.metrics import MetricsRegistry, ProxyMetrics, HistogramCollector, CounterCollector, GaugeCollector
+from business_layer.timing import timed
+from business_layer.upstreams import ALL_SESSIONS, ALL_GUARDS, ALL_LOAD_BALANCERS
+from data_layer.backend_guard import BackendGuard, CLOSED, OPEN, HALF_OPEN
+from data_layer.load_balancer import Endpoint
+from business_layer.caches import ALL_CACHES, ALL_DISK_CACHES
+from business_layer.coalescing import ALL_SINGLE_FLIGHTS
+from business_layer.hedging import ALL_HEDGING
+from data_layer.shared_statistics import SharedCounters
+from app_settings import INCLUDE_METRICS, SHARE_METRICS, METRICS_MAX_SERIES
+
+# upper bounds (in seconds) of the buckets of the exported latency histograms.
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+def collect_latency_histograms():
+    return [((name,), timed.get_group(name).get_lifetime_histogram()) for name in timed.get_group_names()]
+
+def collect_pool_statistics():
+    result = []
+    for (backend, session) in ALL_SESSIONS.items():
+        for (event, value) in session.statistics.to_dict().items():
+            result.append(((backend, event), value))
+    return result
+
+def collect_cache_events():
+    result = []
+    for (name, cache) in ALL_CACHES.items():
+        statistics = cache.statistics()
+        for event in cache.COUNTERS:
+            result.append(((name, event), statistics[event]))
+    return result
+
+def collect_cache_sizes():
+    result = []
+    for (name, cache) in ALL_CACHES.items():
+        statistics = cache.statistics()
+        result.append(((name, "entries"), statistics["entries"]))
+        result.append(((name, "bytes"), statistics["bytes"]))
+    return result
+
+def collect_disk_cache_events():
+    result = []
+    for (name, cache) in ALL_DISK_CACHES.items():
+        statistics = cache.statistics()
+        for event in cache.COUNTERS:
+            result.append(((name, event), statistics[event]))
+    return result
+
+def collect_disk_cache_sizes():
+    result = []
+    for (name, cache) in ALL_DISK_CACHES.items():
+        statistics = cache.statistics()
+        result.append(((name, "entries"), statistics["entries"]))
+        result.append(((name, "bytes"), statistics["bytes"]))
+    return result
+
+def collect_coalescing_statistics():
+    result = []
+    for (name, single_flight) in ALL_SINGLE_FLIGHTS.items():
+        for (event, value) in single_flight.statistics().items():
+            result.append(((name, event), value))
+    return result
+
+def collect_guard_events():
+    result = []
+    for (backend, guard) in ALL_GUARDS.items():
+        statistics = guard.statistics()
+        for event in BackendGuard.COUNTERS:
+            result.append(((backend, event), statistics[event]))
+    return result
+
+def collect_guard_concurrency():
+    result = []
+    for (backend, guard) in ALL_GUARDS.items():
+        statistics = guard.statistics()
+        result.append(((backend, "limit"), statistics["limit"]))
+        result.append(((backend, "in_flight"), statistics["in_flight"]))
+    return result
+
+def collect_circuit_states():
+    result = []
+    for (backend, guard) in ALL_GUARDS.items():
+        current_state = guard.statistics()["state"]
+        for state in [CLOSED, OPEN, HALF_OPEN]:
+            result.append(((backend, state), 1 if state == current_state else 0))
+    return result
+
+def collect_endpoint_events():
+    result = []
+    for (backend, balancer) in ALL_LOAD_BALANCERS.items():
+        for (endpoint, statistics) in balancer.statistics().items():
+            for event in Endpoint.COUNTERS:
+                result.append(((backend, endpoint, event), statistics[event]))
+    return result
+
+def collect_endpoint_states():
+    result = []
+    for (backend, balancer) in ALL_LOAD_BALANCERS.items():
+        for (endpoint, statistics) in balancer.statistics().items():
+            result.append(((backend, endpoint, "outstanding"), statistics["outstanding"]))
+            result.append(((backend, endpoint, "ejected"), 1 if statistics["ejected"] else 0))
+    return result
+
+def collect_hedging_statistics():
+    result = []
+    for (name, hedging) in ALL_HEDGING.items():
+        for (event, value) in hedging.statistics().items():
+            result.append(((name, event), value))
+    return result
+
+if INCLUDE_METRICS:
+    registry = MetricsRegistry()
+    # created when the application is imported, before the worker processes are forked, so that all of them share it.
+    shared_metrics = SharedCounters(METRICS_MAX_SERIES) if SHARE_METRICS else None
+    proxy_metrics = ProxyMetrics(registry, shared_metrics)
+    registry.register(HistogramCollector("gateway_measurement_duration_seconds", "Duration of the timed measurements.", ["measurement"], LATENCY_BUCKETS, collect_latency_histograms))
+    registry.register(CounterCollector("gateway_upstream_pool_events_total", "Events of the connection pools of the remote APIs.", ["backend", "event"], collect_pool_statistics))
+    registry.register(CounterCollector("gateway_response_cache_events_total", "Events of the response caches.", ["cache", "event"], collect_cache_events))
+    registry.register(CounterCollector("gateway_coalesced_requests_total", "Requests sent to the remote APIs (calls) and requests which shared them (collapsed).", ["group", "event"], collect_coalescing_statistics))
+    registry.register(CounterCollector("gateway_hedged_requests_total", "Requests of hedged routes, hedges fired, won and cancelled, retries and extra requests denied by the retry budget.", ["group", "event"], collect_hedging_statistics))
+    registry.register(CounterCollector("gateway_backend_guard_events_total", "Requests accepted and rejected by the guards of the remote APIs, their outcomes and the times circuits were opened.", ["backend", "event"], collect_guard_events))
+    registry.register(GaugeCollector("gateway_backend_concurrency", "Concurrency limit and requests in flight of the guards of the remote APIs.", ["backend", "kind"], collect_guard_concurrency))
+    registry.register(GaugeCollector("gateway_backend_circuit_state", "State of the circuit breakers of the remote APIs (1 for the current state).", ["backend", "state"], collect_circuit_states))
+    registry.register(CounterCollector("gateway_upstream_endpoint_events_total", "Requests sent to each endpoint of the load-balanced remote APIs, their failures and the times the endpoints were ejected.", ["backend", "endpoint", "event"], collect_endpoint_events))
+    registry.register(GaugeCollector("gateway_upstream_endpoint_state", "Requests in progress of each endpoint of the load-balanced remote APIs, and whether it is ejected (1) or not (0).", ["backend", "endpoint", "kind"], collect_endpoint_states))
+    registry.register(GaugeCollector("gateway_response_cache_usage", "Number of responses and bytes held by the response caches.", ["cache", "unit"], collect_cache_sizes))
+    registry.register(CounterCollector("gateway_disk_cache_events_total", "Events of the disk tiers of the response caches, in this worker process.", ["cache", "event"], collect_disk_cache_events))
+    registry.register(GaugeCollector("gateway_disk_cache_usage", "Number of responses and bytes held by the disk tiers of the response caches.", ["cache", "unit"], collect_disk_cache_sizes))
+else:
+    registry = None
+    proxy_metrics = None
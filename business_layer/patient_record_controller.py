@@ -0,0 +1,118 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import quote
+import time
+
+import requests
+
+from data_layer.backend_guard import BackendUnavailable
+from business_layer.upstreams import openehr_client, demographic_client, prov_client
+from app_settings import PATIENT_RECORD_TIMEOUT, PATIENT_RECORD_MAX_WORKERS
+
+# the headers of the client which are sent to the remote APIs.
+FORWARDED_HEADERS = ["Authorization", "Cookie"]
+
+EHR_PARTS = ["ehr", "ehr_status", "ehr_status_provenance"]
+
+executor = ThreadPoolExecutor(max_workers=PATIENT_RECORD_MAX_WORKERS, thread_name_prefix="patient_record")
+
+def fetch_part(client, relative_url : str, headers : dict) -> dict:
+    """
+    Gets a part of a patient record from a remote API, describing its response (or the error which prevented getting it).
+    """
+
+    try:
+        resp = client.request("GET", relative_url, headers=headers, timeout=PATIENT_RECORD_TIMEOUT)
+    except requests.Timeout:
+        return {"error": "timeout"}
+    except BackendUnavailable as e:
+        return {"error": "remote service unavailable: {}".format(e.reason)}
+    except requests.RequestException as e:
+        return {"error": "request failed: {}".format(e.__class__.__name__)}
+
+    part = {"status": resp.status_code}
+    if len(resp.content) > 0:
+        try:
+            part["body"] = resp.json()
+        except ValueError:
+            part["body"] = resp.text
+    return part
+
+def extract_ehr_id(part : dict) -> str:
+    """
+    Gets the EHR id from the response of the demographic API which associates a patient with an EHR.
+    """
+
+    if part.get("status") != 200:
+        return None
+    try:
+        return part["body"]["ehr_uid"]["value"]
+    except (KeyError, TypeError):
+        return None
+
+def provenance_url(target : str) -> str:
+    return "/provenance/service?target=" + quote(target, safe="")
+
+def get_patient_record(patient_id : str, ehr_id : str, client_headers, gateway_base_url : str) -> dict:
+    """
+    Gets the data of a patient from all remote APIs at once: the versioned patient, the EHR associated with the patient, its
+    EHR_STATUS and the provenance of the patient and of the EHR_STATUS.
+
+    If ehr_id is None, it is obtained from the demographic API, and the parts which depend on it are requested as soon as it is
+    known. Parts which fail (or are not obtained in PATIENT_RECORD_TIMEOUT seconds) are described by an error.
+    """
+
+    deadline = time.monotonic() + PATIENT_RECORD_TIMEOUT
+    headers = {name: client_headers[name] for name in FORWARDED_HEADERS if name in client_headers}
+    headers["Accept"] = "application/json"
+    quoted_patient_id = quote(patient_id, safe="")
+
+    futures = {}
+    def submit(name : str, client, relative_url : str):
+        future = executor.submit(fetch_part, client, relative_url, headers)
+        futures[future] = name
+        return future
+
+    def submit_ehr_parts(ehr_id : str) -> set:
+        quoted_ehr_id = quote(ehr_id, safe="")
+        return {
+            submit("ehr", openehr_client, "/v1/ehr/" + quoted_ehr_id),
+            submit("ehr_status", openehr_client, "/v1/ehr/{}/ehr_status".format(quoted_ehr_id)),
+            submit("ehr_status_provenance", prov_client, provenance_url("{}/v1/ehr/{}/ehr_status".format(gateway_base_url, quoted_ehr_id)))
+        }
+
+    submit("patient", demographic_client, "/v1/versioned_patient/" + quoted_patient_id)
+    submit("patient_provenance", prov_client, provenance_url("{}/v1/patient/{}".format(gateway_base_url, quoted_patient_id)))
+    if ehr_id is None:
+        submit("ehr_id", demographic_client, "/v1/versioned_patient/{}/ehr".format(quoted_patient_id))
+    else:
+        submit_ehr_parts(ehr_id)
+
+    parts = {}
+    pending = set(futures)
+    while len(pending) > 0:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = futures[future]
+            parts[name] = future.result()
+            if name == "ehr_id":
+                ehr_id = extract_ehr_id(parts[name])
+                if ehr_id is not None:
+                    pending |= submit_ehr_parts(ehr_id)
+
+    for future in pending:
+        future.cancel()
+        parts[futures[future]] = {"error": "timeout"}
+
+    if ehr_id is None:
+        for name in EHR_PARTS:
+            parts[name] = {"error": "the EHR of the patient could not be found"}
+
+    return {
+        "patient_id": patient_id,
+        "ehr_id": ehr_id,
+        "parts": parts
+    }
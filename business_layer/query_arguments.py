@@ -0,0 +1,112 @@
+from urllib.parse import parse_qsl
+import json
+import re
+
+# the string literals of an AQL query (which are kept as they are) or the runs of whitespace between them.
+AQL_TOKEN_PATTERN = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")|\s+")
+
+def normalize_query_text(q : str) -> str:
+    """
+    Replaces each run of whitespace of an AQL query by a single space, except inside string literals.
+    """
+
+    return AQL_TOKEN_PATTERN.sub(lambda match: match.group(1) or " ", q).strip()
+
+def normalize_value(value) -> str:
+    """
+    Represents a value by its JSON encoding, so that values of different types (e.g. "30" and 30, or "true" and true), which
+    are bound differently by the query, are kept apart.
+    """
+
+    return json.dumps(value, sort_keys=True)
+
+def normalize_count(value, in_query_string : bool) -> str:
+    """
+    Represents an offset or fetch given in the query string (always a string) or in a JSON body (as a number) in the same way.
+    """
+
+    if in_query_string and isinstance(value, str) and value.isdigit():
+        value = int(value)
+    return normalize_value(value)
+
+def read_json_body(get_body) -> dict:
+    """
+    Reads the JSON object in the body of a request, or None if it has no such body.
+    """
+
+    try:
+        body = json.loads(get_body())
+    except ValueError:
+        return None
+    if not isinstance(body, dict):
+        return None
+    return body
+
+def query_arguments(arguments : dict, query_parameters, in_query_string : bool) -> dict:
+    """
+    Normalizes the ehr_id, offset, fetch and query_parameters of a query execution, given either in the query string (where the
+    query parameters are URL-encoded) or in a JSON body.
+
+    The values of the query parameters keep their JSON type; only the offset and fetch given in the query string are read as
+    numbers. The ehr_id may also be given as a query parameter. Returns None if the arguments are invalid.
+    """
+
+    if isinstance(query_parameters, str):
+        query_parameters = dict(parse_qsl(query_parameters, keep_blank_values=True))
+    elif query_parameters is None:
+        query_parameters = {}
+    elif not isinstance(query_parameters, dict):
+        return None
+
+    query_parameters = dict(query_parameters)
+    ehr_id = arguments.get("ehr_id")
+    if ehr_id is None:
+        ehr_id = query_parameters.pop("ehr_id", None)
+    query_parameters = {name: normalize_value(value) for (name, value) in query_parameters.items()}
+    if ehr_id is not None and not isinstance(ehr_id, str):
+        return None
+    return {
+        "ehr_id": None if ehr_id is None else ehr_id.lower(),
+        "offset": normalize_count(arguments.get("offset", 0), in_query_string),
+        "fetch": None if arguments.get("fetch") is None else normalize_count(arguments["fetch"], in_query_string),
+        "query_parameters": query_parameters
+    }
+
+def ad_hoc_query_arguments(method : str, params : dict, get_body) -> dict:
+    """
+    Gets the arguments which identify the results of an ad hoc query, from the query string of a GET request or from the JSON
+    body of a POST request, so that both are answered with the same cached results.
+    """
+
+    if method == "GET":
+        arguments = params
+    else:
+        arguments = read_json_body(get_body)
+        if arguments is None:
+            return None
+    if not isinstance(arguments.get("q"), str):
+        return None
+
+    result = query_arguments(arguments, arguments.get("query_parameters"), method == "GET")
+    if result is not None:
+        result["q"] = normalize_query_text(arguments["q"])
+    return result
+
+def stored_query_arguments(method : str, params : dict, get_body) -> dict:
+    """
+    Gets the arguments which identify the results of a stored query, from the query string of a GET request or from the JSON
+    body of a POST request, so that both are answered with the same cached results.
+    """
+
+    if method == "GET":
+        arguments = params
+    else:
+        arguments = read_json_body(get_body)
+        if arguments is None:
+            return None
+
+    result = query_arguments(arguments, arguments.get("query_parameters"), method == "GET")
+    if result is not None:
+        result["qualified_query_name"] = params["qualified_query_name"]
+        result["version"] = params["version"]
+    return result
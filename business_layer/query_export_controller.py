@@ -0,0 +1,159 @@
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+import json
+
+import requests
+
+from data_layer.backend_guard import BackendUnavailable
+from data_layer.json_stream import iterate_result_set
+from business_layer.upstreams import openehr_client
+from app_settings import AQL_EXPORT_PAGE_SIZE, AQL_EXPORT_MAX_WORKERS, STREAMING_CHUNK_SIZE
+
+# the headers of the client which are sent to the openEHR API.
+FORWARDED_HEADERS = ["Authorization", "Cookie"]
+
+executor = ThreadPoolExecutor(max_workers=AQL_EXPORT_MAX_WORKERS, thread_name_prefix="aql_export")
+
+class QueryExport:
+    """
+    An AQL query whose results are exported page by page.
+
+    The query is sent with POST to relative_url (the ad hoc query route or a stored query route), with the given body plus the
+    offset and fetch of each page.
+    """
+
+    def __init__(self, relative_url : str, body : dict, client_headers, offset : int = 0, limit : int = None):
+        self.relative_url = relative_url
+        self.body = body
+        self.offset = offset
+        self.limit = limit
+        self.headers = {name: client_headers[name] for name in FORWARDED_HEADERS if name in client_headers}
+        self.headers["Accept"] = "application/json"
+        self.headers["Content-Type"] = "application/json"
+
+    def page_size(self, exported : int) -> int:
+        """
+        Gets the number of rows of the next page, given the number of rows exported so far (0 if there are no more rows).
+        """
+
+        if self.limit is None:
+            return AQL_EXPORT_PAGE_SIZE
+        return max(0, min(AQL_EXPORT_PAGE_SIZE, self.limit - exported))
+
+    def request_page(self, exported : int, stream : bool = False):
+        """
+        Requests a page of results, starting after the given number of rows.
+
+        Unless stream is True, the whole page is read before returning.
+        """
+
+        body = dict(self.body)
+        body["offset"] = self.offset + exported
+        body["fetch"] = self.page_size(exported)
+        return openehr_client.request("POST", self.relative_url, headers=self.headers, data=json.dumps(body), stream=stream)
+
+def ad_hoc_query_export(body : dict, client_headers) -> QueryExport:
+    """
+    Creates the export of an ad hoc query, described by the same body accepted by the ad hoc query route.
+    """
+
+    body = dict(body)
+    offset = int(body.pop("offset", 0))
+    limit = body.pop("fetch", None)
+    return QueryExport("/v1/query/aql", body, client_headers, offset, None if limit is None else int(limit))
+
+def stored_query_export(qualified_query_name : str, version : str, body : dict, client_headers) -> QueryExport:
+    """
+    Creates the export of a stored query, described by the same body accepted by the stored query route.
+    """
+
+    body = dict(body)
+    offset = int(body.pop("offset", 0))
+    limit = body.pop("fetch", None)
+    relative_url = "/v1/query/{}/{}".format(quote(qualified_query_name, safe=""), quote(version, safe=""))
+    return QueryExport(relative_url, body, client_headers, offset, None if limit is None else int(limit))
+
+def format_row(row, column_names : list) -> str:
+    """
+    Encodes a row as a line of JSON: an object keyed by the names of the columns if they are known and unique, else an array.
+    """
+
+    if column_names is not None and isinstance(row, list) and len(row) == len(column_names):
+        row = dict(zip(column_names, row))
+    return json.dumps(row) + "\n"
+
+def get_column_names(columns) -> list:
+    try:
+        names = [column["name"] for column in columns]
+    except (KeyError, TypeError):
+        return None
+    if len(set(names)) != len(names):
+        return None
+    return names
+
+def export_rows(export : QueryExport, first_page):
+    """
+    Yields the rows of all pages of an export as lines of JSON, starting from the (already requested) first page.
+
+    Once a page has returned a full page of rows (so that there may be more of them), the next one is requested in the
+    background while the rest of the page is parsed and sent, so at most two pages are held in memory and no page is requested
+    after the last one. If a later page can not be obtained, a last line with an error is sent.
+    """
+
+    exported = 0
+    page = first_page
+    chunks = first_page.iter_content(STREAMING_CHUNK_SIZE)
+    column_names = None
+    next_page = None
+    try:
+        while True:
+            page_exported = 0
+            page_size = export.page_size(exported)
+
+            for (name, value) in iterate_result_set(chunks):
+                if name == "columns":
+                    column_names = get_column_names(value)
+                elif name == "row":
+                    page_exported += 1
+                    if page_exported == page_size and export.page_size(exported + page_size) > 0:
+                        next_page = executor.submit(export.request_page, exported + page_size)
+                    yield format_row(value, column_names)
+            page.close()
+
+            exported += page_exported
+            if page_exported < page_size or next_page is None:
+                return
+
+            try:
+                page = next_page.result()
+            except (requests.RequestException, BackendUnavailable) as e:
+                yield json.dumps({"error": "the page at offset {} could not be obtained: {}".format(export.offset + exported, e.__class__.__name__)}) + "\n"
+                return
+            finally:
+                next_page = None
+            if page.status_code != 200:
+                yield json.dumps({"error": "the page at offset {} could not be obtained".format(export.offset + exported), "status": page.status_code}) + "\n"
+                return
+            chunks = chunk_bytes(page.content, STREAMING_CHUNK_SIZE)
+    finally:
+        page.close()
+        if next_page is not None:
+            next_page.cancel()
+
+def run_export(export : QueryExport):
+    """
+    Starts an export, returning the status code, the content type and the body of the response sent to the client.
+
+    If the first page can not be obtained, the response of the openEHR API is returned as it is. Otherwise, the body is an
+    iterator over the rows of all pages, encoded as newline-delimited JSON.
+    """
+
+    first_page = export.request_page(0, stream=True)
+    if first_page.status_code != 200:
+        return first_page.status_code, first_page.headers.get("Content-Type"), first_page.content
+
+    return 200, "application/x-ndjson", export_rows(export, first_page)
+
+def chunk_bytes(data : bytes, chunk_size : int):
+    for start in range(0, len(data), chunk_size):
+        yield data[start:start + chunk_size]
@@ -1,5 +1,6 @@
 from data_layer.time_measurement import Timed, NotTimed
-from app_settings import USAGE_STATISTICS_MAX_SAMPLES, INCLUDE_USAGE_STATISTICS
+from data_layer.shared_statistics import SharedTimed
+from app_settings import USAGE_STATISTICS_MAX_SAMPLES, USAGE_STATISTICS_WINDOW, INCLUDE_USAGE_STATISTICS, SHARE_USAGE_STATISTICS, USAGE_STATISTICS_SHARED_MEMORY
 
 CREATE_PATIENT_MEASUREMENT = "create_patient"
 UPDATE_PATIENT_MEASUREMENT = "update_patient"
@@ -15,9 +16,12 @@ GET_CONTRIBUTION_OF_PATIENT_MEASUREMENT = "get_contribution_of_patient"
 
 GET_PROVENANCE_MEASUREMENT = "get_provenance"
 
-ALL_MEASUREMENTS = [CREATE_PATIENT_MEASUREMENT, UPDATE_PATIENT_MEASUREMENT, DELETE_PATIENT_MEASUREMENT, GET_PATIENT_MEASUREMENT, GET_VERSIONED_PATIENT_MEASUREMENT, GET_VERSIONED_PATIENT_REVISION_HISTORY_MEASUREMENT, GET_VERSIONED_PATIENT_VERSION_MEASUREMENT, LIST_PATIENTS_MEASUREMENT, GET_EHR_ID_FROM_PATIENT_MEASUREMENT, SET_EHR_ID_FROM_PATIENT_MEASUREMENT, GET_CONTRIBUTION_OF_PATIENT_MEASUREMENT, GET_PROVENANCE_MEASUREMENT]
+GET_PATIENT_RECORD_MEASUREMENT = "get_patient_record"
 
-if INCLUDE_USAGE_STATISTICS:
-    timed = Timed(USAGE_STATISTICS_MAX_SAMPLES)
+if INCLUDE_USAGE_STATISTICS and SHARE_USAGE_STATISTICS:
+    # created when the application is imported, before the worker processes are forked, so that all of them share it.
+    timed = SharedTimed(USAGE_STATISTICS_MAX_SAMPLES, USAGE_STATISTICS_WINDOW, USAGE_STATISTICS_SHARED_MEMORY)
+elif INCLUDE_USAGE_STATISTICS:
+    timed = Timed(USAGE_STATISTICS_MAX_SAMPLES, USAGE_STATISTICS_WINDOW)
 else:
     timed = NotTimed()
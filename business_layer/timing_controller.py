@@ -1,20 +1,66 @@
 from data_layer.time_measurement import TimedGroup
-from business_layer.timing import timed, ALL_MEASUREMENTS
+from business_layer.timing import timed
+from business_layer.upstreams import ALL_SESSIONS, ALL_GUARDS, ALL_LOAD_BALANCERS
+from business_layer.caches import ALL_CACHES
+from business_layer.coalescing import ALL_SINGLE_FLIGHTS
+from business_layer.hedging import ALL_HEDGING
 
-def get_usage_statistics():
+def get_usage_statistics(include_samples : bool = False):
     usage_statistics = {}
 
-    for measurement_name in ALL_MEASUREMENTS:
+    for measurement_name in timed.get_group_names():
         group = timed.get_group(measurement_name)
 
-        usage_statistics[measurement_name] = extract_statistics(group)
+        usage_statistics[measurement_name] = extract_statistics(group, include_samples)
 
     return usage_statistics
 
+def get_pool_statistics():
+    return {backend: session.statistics.to_dict() for (backend, session) in ALL_SESSIONS.items()}
+
+def get_cache_statistics():
+    return {name: cache.statistics() for (name, cache) in ALL_CACHES.items()}
+
+def get_coalescing_statistics():
+    return {name: single_flight.statistics() for (name, single_flight) in ALL_SINGLE_FLIGHTS.items()}
+
+def get_hedging_statistics():
+    return {name: hedging.statistics() for (name, hedging) in ALL_HEDGING.items()}
+
+def get_guard_statistics():
+    return {backend: guard.statistics() for (backend, guard) in ALL_GUARDS.items()}
+
+def get_load_balancer_statistics():
+    return {backend: balancer.statistics() for (backend, balancer) in ALL_LOAD_BALANCERS.items()}
+
 def clear_usage_statistics():
     timed.clear_all()
 
-def extract_statistics(group : TimedGroup) -> dict:
-    return {
-        "samples": group.get_samples()
+    for session in ALL_SESSIONS.values():
+        session.statistics.clear()
+
+    for cache in ALL_CACHES.values():
+        cache.clear_statistics()
+
+    for single_flight in ALL_SINGLE_FLIGHTS.values():
+        single_flight.clear_statistics()
+
+    for hedging in ALL_HEDGING.values():
+        hedging.clear_statistics()
+
+    for guard in ALL_GUARDS.values():
+        guard.clear_statistics()
+
+    for balancer in ALL_LOAD_BALANCERS.values():
+        balancer.clear_statistics()
+
+def extract_statistics(group : TimedGroup, include_samples : bool) -> dict:
+    statistics = {
+        "lifetime": group.get_lifetime_summary(),
+        "window": group.get_window_summary()
     }
+
+    if include_samples:
+        statistics["samples"] = group.get_samples()
+
+    return statistics
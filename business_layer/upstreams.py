@@ -0,0 +1,70 @@
+from data_layer.upstream_session import create_session, UpstreamClient
+from data_layer.backend_guard import BackendGuard, CircuitBreaker, AdaptiveLimiter
+from data_layer.load_balancer import LoadBalancer
+from app_settings import OPENEHR_API_BASE_URI, OPENEHR_API_BASE_URIS, VALIDATE_OPENEHR_API_CERTIFICATE, USE_CUSTOM_OPENEHR_API_CA_CERTIFICATE, OPENEHR_API_POOL_CONNECTIONS, OPENEHR_API_POOL_MAXSIZE, OPENEHR_API_POOL_BLOCK, OPENEHR_API_POOL_IDLE_TIMEOUT, OPENEHR_API_TLS_SESSION_RESUMPTION, OPENEHR_API_CONNECT_TIMEOUT, OPENEHR_API_READ_TIMEOUT
+from app_settings import DEMOGRAPHIC_API_BASE_URI, DEMOGRAPHIC_API_BASE_URIS, VALIDATE_DEMOGRAPHIC_API_CERTIFICATE, USE_CUSTOM_DEMOGRAPHIC_API_CA_CERTIFICATE, DEMOGRAPHIC_API_POOL_CONNECTIONS, DEMOGRAPHIC_API_POOL_MAXSIZE, DEMOGRAPHIC_API_POOL_BLOCK, DEMOGRAPHIC_API_POOL_IDLE_TIMEOUT, DEMOGRAPHIC_API_TLS_SESSION_RESUMPTION, DEMOGRAPHIC_API_CONNECT_TIMEOUT, DEMOGRAPHIC_API_READ_TIMEOUT
+from app_settings import PROV_API_BASE_URI, PROV_API_BASE_URIS, VALIDATE_PROV_API_CERTIFICATE, USE_CUSTOM_PROV_API_CA_CERTIFICATE, PROV_API_POOL_CONNECTIONS, PROV_API_POOL_MAXSIZE, PROV_API_POOL_BLOCK, PROV_API_POOL_IDLE_TIMEOUT, PROV_API_TLS_SESSION_RESUMPTION, PROV_API_CONNECT_TIMEOUT, PROV_API_READ_TIMEOUT
+from app_settings import GUARD_UPSTREAMS, UPSTREAM_CONCURRENCY_LIMIT, UPSTREAM_MIN_CONCURRENCY_LIMIT, UPSTREAM_MAX_CONCURRENCY_LIMIT, UPSTREAM_LATENCY_TOLERANCE, CIRCUIT_BREAKER_FAILURE_THRESHOLD, CIRCUIT_BREAKER_RESET_TIMEOUT
+from app_settings import LOAD_BALANCING, ENDPOINT_EJECTION_FAILURES, ENDPOINT_EJECTION_TIME
+
+OPENEHR_BACKEND = "openehr"
+DEMOGRAPHIC_BACKEND = "demographic"
+PROV_BACKEND = "prov"
+
+openehr_session, openehr_extra_params = create_session(
+    OPENEHR_API_BASE_URI, VALIDATE_OPENEHR_API_CERTIFICATE, USE_CUSTOM_OPENEHR_API_CA_CERTIFICATE, "openehr_api_ca_certificate.pem",
+    max(OPENEHR_API_POOL_CONNECTIONS, len(OPENEHR_API_BASE_URIS)), OPENEHR_API_POOL_MAXSIZE, OPENEHR_API_POOL_BLOCK, OPENEHR_API_POOL_IDLE_TIMEOUT, OPENEHR_API_TLS_SESSION_RESUMPTION,
+    OPENEHR_API_CONNECT_TIMEOUT, OPENEHR_API_READ_TIMEOUT)
+
+demographic_session, demographic_extra_params = create_session(
+    DEMOGRAPHIC_API_BASE_URI, VALIDATE_DEMOGRAPHIC_API_CERTIFICATE, USE_CUSTOM_DEMOGRAPHIC_API_CA_CERTIFICATE, "demographic_api_ca_certificate.pem",
+    max(DEMOGRAPHIC_API_POOL_CONNECTIONS, len(DEMOGRAPHIC_API_BASE_URIS)), DEMOGRAPHIC_API_POOL_MAXSIZE, DEMOGRAPHIC_API_POOL_BLOCK, DEMOGRAPHIC_API_POOL_IDLE_TIMEOUT, DEMOGRAPHIC_API_TLS_SESSION_RESUMPTION,
+    DEMOGRAPHIC_API_CONNECT_TIMEOUT, DEMOGRAPHIC_API_READ_TIMEOUT)
+
+prov_session, prov_extra_params = create_session(
+    PROV_API_BASE_URI, VALIDATE_PROV_API_CERTIFICATE, USE_CUSTOM_PROV_API_CA_CERTIFICATE, "prov_api_ca_certificate.pem",
+    max(PROV_API_POOL_CONNECTIONS, len(PROV_API_BASE_URIS)), PROV_API_POOL_MAXSIZE, PROV_API_POOL_BLOCK, PROV_API_POOL_IDLE_TIMEOUT, PROV_API_TLS_SESSION_RESUMPTION,
+    PROV_API_CONNECT_TIMEOUT, PROV_API_READ_TIMEOUT)
+
+def create_load_balancer(base_uris : list) -> LoadBalancer:
+    """
+    Creates the load balancer of a remote service, or None if it has a single endpoint.
+    """
+
+    if len(base_uris) < 2:
+        return None
+    return LoadBalancer(base_uris, LOAD_BALANCING, ENDPOINT_EJECTION_FAILURES, ENDPOINT_EJECTION_TIME)
+
+openehr_load_balancer = create_load_balancer(OPENEHR_API_BASE_URIS)
+demographic_load_balancer = create_load_balancer(DEMOGRAPHIC_API_BASE_URIS)
+prov_load_balancer = create_load_balancer(PROV_API_BASE_URIS)
+
+ALL_LOAD_BALANCERS = {backend: balancer for (backend, balancer) in [(OPENEHR_BACKEND, openehr_load_balancer), (DEMOGRAPHIC_BACKEND, demographic_load_balancer), (PROV_BACKEND, prov_load_balancer)] if balancer is not None}
+
+ALL_SESSIONS = {
+    OPENEHR_BACKEND: openehr_session,
+    DEMOGRAPHIC_BACKEND: demographic_session,
+    PROV_BACKEND: prov_session
+}
+
+def create_guard() -> BackendGuard:
+    """
+    Creates the guard of a remote service, or None if remote services are not guarded.
+    """
+
+    if not GUARD_UPSTREAMS:
+        return None
+    breaker = CircuitBreaker(CIRCUIT_BREAKER_FAILURE_THRESHOLD, CIRCUIT_BREAKER_RESET_TIMEOUT)
+    limiter = AdaptiveLimiter(UPSTREAM_CONCURRENCY_LIMIT, UPSTREAM_MIN_CONCURRENCY_LIMIT, UPSTREAM_MAX_CONCURRENCY_LIMIT, tolerance=UPSTREAM_LATENCY_TOLERANCE)
+    return BackendGuard(breaker, limiter)
+
+# each remote service has its own guard, so that a slow service does not affect the routes of the others.
+openehr_guard = create_guard()
+demographic_guard = create_guard()
+prov_guard = create_guard()
+
+ALL_GUARDS = {backend: guard for (backend, guard) in [(OPENEHR_BACKEND, openehr_guard), (DEMOGRAPHIC_BACKEND, demographic_guard), (PROV_BACKEND, prov_guard)] if guard is not None}
+
+openehr_client = UpstreamClient(OPENEHR_API_BASE_URI, openehr_session, openehr_extra_params, openehr_load_balancer, openehr_guard)
+demographic_client = UpstreamClient(DEMOGRAPHIC_API_BASE_URI, demographic_session, demographic_extra_params, demographic_load_balancer, demographic_guard)
+prov_client = UpstreamClient(PROV_API_BASE_URI, prov_session, prov_extra_params, prov_load_balancer, prov_guard)
@@ -0,0 +1,333 @@
+import ssl
+import time
+from urllib.parse import parse_qsl
+
+import httpx
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from flask import Response
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import Map, Rule
+
+from .backend_guard import BackendUnavailable
+from .compression import negotiate_encoding, upstream_accept_encoding
+from .flask_proxy import EXCLUDED_RESPONSE_HEADERS, FAILURE_STATUS_CODES, UpstreamPermit, upstream_latency, gateway_error_response
+from .time_measurement import RequestTiming, request_outcome
+
+def create_async_client(proxy, max_connections : int) -> httpx.AsyncClient:
+    """
+    Creates an asynchronous HTTP client which accesses the remote service of a proxy with the same certificate and pool settings
+    as its session.
+    """
+
+    session = proxy.session
+
+    verify = proxy.extra_params.get("verify", True)
+    if isinstance(verify, str):
+        context = ssl.create_default_context(cafile=verify)
+        if session.ignore_hostname:
+            context.check_hostname = False
+        verify = context
+
+    timeout = None
+    if proxy.extra_params.get("timeout") is not None:
+        connect_timeout, read_timeout = proxy.extra_params["timeout"]
+        timeout = httpx.Timeout(None, connect=connect_timeout, read=read_timeout)
+
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=session.pool_maxsize, keepalive_expiry=session.idle_timeout)
+    return httpx.AsyncClient(verify=verify, limits=limits, timeout=timeout)
+
+class ThreadedWsgiToAsgiInstance(WsgiToAsgiInstance):
+    # the WSGI application is run in any thread of the default executor, instead of a single thread shared by all requests
+    # (which handles one request at a time, and makes concurrent requests fail with "would deadlock" errors under uvicorn).
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__["run_wsgi_app"].func, thread_sensitive=False)
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    """
+    Wraps a thread-safe WSGI application (such as a Flask application) to make it into an ASGI application which handles
+    concurrent requests.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await ThreadedWsgiToAsgiInstance(self.wsgi_application)(scope, receive, send)
+
+async def iterate_request_body(receive):
+    """
+    Relays the body of an ASGI request as it is received.
+    """
+
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        yield message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+async def read_request_body(receive) -> bytes:
+    """
+    Reads the whole body of an ASGI request.
+    """
+
+    chunks = []
+    async for chunk in iterate_request_body(receive):
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+class AsyncResponseBodyStream:
+    """
+    Relays the body of an upstream response in bounded chunks, measuring the time spent downloading it.
+
+    The upstream response is closed and the permit of the request released when the stream is closed, even if the body was
+    never read. The request counts as failed if the body could not be read as a whole.
+    """
+
+    def __init__(self, resp, chunk_size : int, route, timing : RequestTiming, permit, success : bool, decode : bool = True):
+        self._resp = resp
+        self._chunk_size = chunk_size
+        self._route = route
+        self._timing = timing
+        self._permit = permit
+        self._success = success
+        self._decode = decode
+        self._closed = False
+
+    async def __aiter__(self):
+        chunks = self._resp.aiter_bytes(self._chunk_size) if self._decode else self._resp.aiter_raw(self._chunk_size)
+        while True:
+            start_time = time.perf_counter()
+            try:
+                chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                break
+            except Exception:
+                self._success = False
+                raise
+            finally:
+                self._timing.add("download", time.perf_counter() - start_time)
+            yield chunk
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await self._resp.aclose()
+        finally:
+            self._permit.release(self._success, upstream_latency(self._timing))
+            self._route.record_download(self._timing)
+
+class AsgiProxyApp:
+    """
+    An ASGI application which serves the routes of FlaskProxy instances with an asynchronous HTTP client.
+
+    Requests which do not match any of these routes, and the routes which require features of FlaskProxy only available in
+    Flask (such as response caches), are handled by the Flask application.
+    """
+
+    def __init__(self, app, proxies : list, max_connections : int = 1000):
+        self._wsgi_app = ThreadedWsgiToAsgi(app)
+        self._proxies = proxies
+        self._max_connections = max_connections
+        self._clients = {}
+
+        # index all proxied routes with the same rules used by Flask.
+        self._handlers = []
+        rules = []
+        for proxy in proxies:
+            for route in proxy.routes:
+                endpoint = len(self._handlers)
+                # the rules of routes handled by Flask are kept, so that they still take precedence over later rules.
+                self._handlers.append(None if route.requires_wsgi else self._create_handler(proxy, route))
+                rules.append(Rule(route.local_relative_url.path_pattern, methods=route.methods, endpoint=endpoint))
+
+        # the other rules of the Flask application are also kept, so that they still take precedence over less specific rules.
+        for rule in app.url_map.iter_rules():
+            self._handlers.append(None)
+            rules.append(Rule(rule.rule, methods=rule.methods, endpoint=len(self._handlers) - 1))
+        self._url_map = Map(rules)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._handle_lifespan(receive, send)
+            return
+
+        if scope["type"] != "http":
+            await self._wsgi_app(scope, receive, send)
+            return
+
+        adapter = self._url_map.bind("localhost")
+        try:
+            endpoint, path_params = adapter.match(scope["path"], method=scope["method"])
+        except HTTPException:
+            # not found, redirections and method mismatches are handled by Flask.
+            await self._wsgi_app(scope, receive, send)
+            return
+
+        handler = self._handlers[endpoint]
+        if handler is None:
+            await self._wsgi_app(scope, receive, send)
+            return
+
+        query_string = {}
+        for (key, value) in parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True):
+            query_string.setdefault(key, value)
+
+        response, body_iterator = await handler(scope, receive, path_params, query_string)
+        await self._send_response(send, response, body_iterator)
+
+    def _get_client(self, proxy) -> httpx.AsyncClient:
+        client = self._clients.get(id(proxy))
+        if client is None:
+            client = create_async_client(proxy, self._max_connections)
+            self._clients[id(proxy)] = client
+        return client
+
+    def _create_handler(self, proxy, route):
+        """
+        Creates the coroutine function which handles the requests of a route.
+
+        It returns the response produced by the route and, if the upstream body is streamed, the iterator over the upstream body.
+        """
+
+        async def handle_request(scope, receive, path_params, query_string):
+            timing = RequestTiming()
+            if proxy.metrics is not None:
+                proxy.metrics.request_started(proxy.name)
+            status = "error"
+            try:
+                result, body_iterator = await forward(scope, receive, path_params, query_string, timing)
+                status = getattr(result, "status_code", "unknown")
+                return result, body_iterator
+            finally:
+                if proxy.metrics is not None:
+                    proxy.metrics.request_finished(proxy.name, route.name, scope["method"], status)
+                route.record(timing, request_outcome(status))
+
+        async def forward(scope, receive, path_params, query_string, timing):
+            params, remote_relative_url = route.translate(path_params, query_string)
+
+            # send request to remote system.
+            headers = [(key, value) for (key, value) in scope["headers"] if key.lower() not in (b"host", b"transfer-encoding", b"accept-encoding")]
+            client_accept_encoding = ", ".join(value.decode("latin-1") for (key, value) in scope["headers"] if key.lower() == b"accept-encoding")
+            if proxy.upstream_compression:
+                accept_encoding = upstream_accept_encoding(client_accept_encoding, proxy.pass_through_compression and route.stream)
+            else:
+                accept_encoding = "identity"
+            headers.append((b"accept-encoding", accept_encoding.encode("latin-1")))
+            if route.stream:
+                content = iterate_request_body(receive)
+            else:
+                headers = [(key, value) for (key, value) in headers if key.lower() != b"content-length"]
+                content = await read_request_body(receive)
+
+            try:
+                permit = UpstreamPermit(proxy.guard.acquire(), proxy.load_balancer.acquire())
+            except BackendUnavailable as e:
+                return gateway_error_response(503, e.reason, e.retry_after), None
+            client = self._get_client(proxy)
+            upstream_request = client.build_request(
+                method=scope["method"],
+                url=permit.base_url + remote_relative_url,
+                headers=headers,
+                content=content)
+            upstream_request.extensions["trace"] = self._create_trace(timing)
+            timing.start_phase()
+            try:
+                resp = await client.send(upstream_request, stream=True)
+            except httpx.TimeoutException:
+                permit.release(False)
+                return gateway_error_response(504, "the remote service did not respond in time"), None
+            except httpx.TransportError:
+                permit.release(False)
+                return gateway_error_response(502, "the remote service could not be reached"), None
+            timing.end_phase("first_byte")
+            success = resp.status_code not in FAILURE_STATUS_CODES
+            route.invalidate(resp.status_code, params)
+
+            # create Flask-style response object.
+            headers = [(name, value) for (name, value) in resp.headers.multi_items() if name.lower() not in EXCLUDED_RESPONSE_HEADERS]
+            if route.stream:
+                encoding = None
+                if proxy.pass_through_compression and resp.headers.get("content-encoding"):
+                    encoding = negotiate_encoding(client_accept_encoding, [resp.headers["content-encoding"]])
+                if encoding is not None:
+                    headers.append(("Content-Encoding", encoding))
+                response = Response(None, resp.status_code, headers)
+                if proxy.pass_through_compression:
+                    response.vary.add("Accept-Encoding")
+                body_iterator = AsyncResponseBodyStream(resp, proxy.chunk_size, route, timing, permit, success, decode=encoding is None)
+            else:
+                try:
+                    content = await resp.aread()
+                except httpx.TimeoutException:
+                    permit.release(False)
+                    return gateway_error_response(504, "the remote service did not respond in time"), None
+                except httpx.TransportError:
+                    permit.release(False)
+                    return gateway_error_response(502, "the remote service could not be reached"), None
+                permit.release(success, upstream_latency(timing))
+                timing.end_phase("download")
+                response = Response(content, resp.status_code, headers)
+                body_iterator = None
+
+            result = route.finish(response, params)
+            if result is not response and body_iterator is not None:
+                await body_iterator.aclose()
+                body_iterator = None
+            return result, body_iterator
+
+        return route.decorate(handle_request)
+
+    def _create_trace(self, timing : RequestTiming):
+        """
+        Creates the trace callback which ends the "connect" phase of a request when the connection is ready to send it.
+        """
+
+        async def trace(event_name, info):
+            if event_name.endswith(".send_request_headers.started"):
+                timing.end_phase("connect")
+        return trace
+
+    async def _send_response(self, send, response, body_iterator):
+        headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for (name, value) in response.headers.items()]
+        # a streamed upstream response is released even if the client disconnects before its body is sent.
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": headers
+            })
+
+            if body_iterator is None:
+                await send({
+                    "type": "http.response.body",
+                    "body": response.get_data()
+                })
+                return
+
+            async for chunk in body_iterator:
+                await send({
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": True
+                })
+        finally:
+            if body_iterator is not None:
+                await body_iterator.aclose()
+        await send({
+            "type": "http.response.body",
+            "body": b""
+        })
+
+    async def _handle_lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                for client in self._clients.values():
+                    await client.aclose()
+                self._clients = {}
+                await send({"type": "lifespan.shutdown.complete"})
+                return
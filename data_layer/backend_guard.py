@@ -0,0 +1,234 @@
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class BackendUnavailable(Exception):
+    """
+    Raised when a request to a remote service is rejected by its guard, without being sent.
+
+    retry_after is the number of seconds after which the request may succeed, if known.
+    """
+
+    def __init__(self, reason : str, retry_after : float = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a remote service after failure_threshold consecutive failures.
+
+    While the circuit is open, requests fail immediately. After reset_timeout seconds it becomes half-open: a single probe request
+    is let through, which closes the circuit if it succeeds or opens it again if it fails.
+
+    It is not thread-safe: it is used under the lock of its guard.
+    """
+
+    def __init__(self, failure_threshold : int, reset_timeout : float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def allow(self, now : float) -> bool:
+        """
+        Checks whether a request may be sent. In the half-open state, the request allowed is the probe.
+        """
+
+        if self.state == OPEN and now - self._opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+            self._probing = False
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def cancel(self):
+        """
+        Gives up a request allowed by allow() which was not sent.
+        """
+
+        self._probing = False
+
+    def record(self, success : bool, now : float) -> bool:
+        """
+        Records the outcome of a request, returning whether the circuit was opened.
+        """
+
+        if success:
+            self.consecutive_failures = 0
+            if self.state == HALF_OPEN:
+                self.state = CLOSED
+            return False
+
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.consecutive_failures >= self.failure_threshold):
+            self.state = OPEN
+            self._opened_at = now
+            return True
+        return False
+
+    def retry_after(self, now : float) -> float:
+        return max(0.0, self._opened_at + self.reset_timeout - now)
+
+class AdaptiveLimiter:
+    """
+    Limits the number of concurrent requests to a remote service, adapting the limit to the latency of its responses (AIMD).
+
+    The baseline latency is the lowest latency observed in the last period of sample_window requests. While responses take up to
+    tolerance times the baseline latency, the limit grows by about one request per limit requests (additive increase); slower
+    responses and failures shrink it by the backoff factor (multiplicative decrease).
+
+    It is not thread-safe: it is used under the lock of its guard.
+    """
+
+    def __init__(self, initial_limit : int, min_limit : int, max_limit : int, tolerance : float = 2.0, backoff : float = 0.9, sample_window : int = 100):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.sample_window = sample_window
+        self.in_flight = 0
+        self.baseline_latency = None
+        self._period_min_latency = None
+        self._period_samples = 0
+
+    def try_acquire(self) -> bool:
+        if self.in_flight >= int(self.limit):
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self, latency : float, success : bool):
+        """
+        Frees the slot of a request, adapting the limit to its outcome and latency (which is None if it is unknown).
+        """
+
+        in_flight = self.in_flight
+        self.in_flight -= 1
+
+        if not success:
+            self._decrease()
+            return
+        if latency is None:
+            return
+
+        self._add_sample(latency)
+        if latency > self.baseline_latency * self.tolerance:
+            self._decrease()
+        elif in_flight * 2 >= self.limit:
+            # the limit only grows while it is actually being used.
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def _decrease(self):
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+
+    def _add_sample(self, latency : float):
+        if self._period_min_latency is None or latency < self._period_min_latency:
+            self._period_min_latency = latency
+        if self.baseline_latency is None or latency < self.baseline_latency:
+            self.baseline_latency = latency
+
+        self._period_samples += 1
+        if self._period_samples >= self.sample_window:
+            # the baseline follows the remote service if it becomes permanently slower (or faster).
+            self.baseline_latency = self._period_min_latency
+            self._period_min_latency = None
+            self._period_samples = 0
+
+class Permit:
+    """
+    The permission to send a request to a remote service, which must be released exactly once.
+    """
+
+    def __init__(self, guard):
+        self._guard = guard
+        self._released = False
+
+    def release(self, success : bool, latency : float = None):
+        """
+        Releases the permit, reporting whether the request succeeded and how long the remote service took to respond.
+        """
+
+        if not self._released:
+            self._released = True
+            self._guard._release(success, latency)
+
+class BackendGuard:
+    """
+    Protects the gateway from a slow or failing remote service, combining a circuit breaker with an adaptive concurrency limit.
+
+    Requests which would exceed the limit, or which are sent while the circuit is open, are rejected immediately, so a remote
+    service which stops responding does not hold all the threads of the gateway.
+    """
+
+    COUNTERS = ["accepted", "rejected_open", "rejected_limit", "succeeded", "failed", "opened"]
+
+    def __init__(self, breaker : CircuitBreaker, limiter : AdaptiveLimiter):
+        self._lock = threading.Lock()
+        self._breaker = breaker
+        self._limiter = limiter
+        self._counters = dict.fromkeys(BackendGuard.COUNTERS, 0)
+
+    def acquire(self) -> Permit:
+        """
+        Obtains the permission to send a request, raising BackendUnavailable if the request must be rejected.
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            if not self._breaker.allow(now):
+                self._counters["rejected_open"] += 1
+                raise BackendUnavailable("the remote service is unavailable", self._breaker.retry_after(now))
+            if not self._limiter.try_acquire():
+                self._breaker.cancel()
+                self._counters["rejected_limit"] += 1
+                raise BackendUnavailable("too many concurrent requests to the remote service")
+            self._counters["accepted"] += 1
+        return Permit(self)
+
+    def _release(self, success : bool, latency : float):
+        with self._lock:
+            self._counters["succeeded" if success else "failed"] += 1
+            self._limiter.release(latency, success)
+            if self._breaker.record(success, time.monotonic()):
+                self._counters["opened"] += 1
+
+    def statistics(self) -> dict:
+        """
+        Gets the state of the circuit, the current concurrency limit, the number of requests in flight and the counters of the
+        guard.
+        """
+
+        with self._lock:
+            statistics = self._counters.copy()
+            statistics["state"] = self._breaker.state
+            statistics["limit"] = int(self._limiter.limit)
+            statistics["in_flight"] = self._limiter.in_flight
+            return statistics
+
+    def clear_statistics(self):
+        with self._lock:
+            self._counters = dict.fromkeys(BackendGuard.COUNTERS, 0)
+
+class NotGuarded:
+    """
+    A guard which accepts all requests.
+    """
+
+    def acquire(self) -> Permit:
+        return NO_PERMIT
+
+class NoPermit:
+    def release(self, success : bool, latency : float = None):
+        pass
+
+NO_PERMIT = NoPermit()
@@ -0,0 +1,292 @@
+import time
+import zlib
+
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# the content types of the bodies which are worth compressing (besides text/* and the types with a +json or +xml suffix).
+COMPRESSIBLE_CONTENT_TYPES = ["application/json", "application/xml", "application/x-ndjson", "application/javascript"]
+
+# the compression levels of each encoding, which favour speed over the size of the bodies.
+COMPRESSION_LEVELS = {"gzip": 6, "br": 4, "zstd": 3}
+
+# streamed bodies are flushed to the client once this many bytes have been compressed, or this many seconds after the last flush,
+# rather than after every chunk (which would spoil the compression of streams of small chunks).
+FLUSH_BYTES = 64 * 1024
+FLUSH_INTERVAL = 1.0
+
+class GzipEncoder:
+    def __init__(self, level : int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data : bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+class BrotliEncoder:
+    def __init__(self, level : int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data : bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+class ZstdEncoder:
+    def __init__(self, level : int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data : bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+# the encoders of the encodings which are available (brotli and zstd require optional packages).
+ENCODERS = {"gzip": GzipEncoder}
+if brotli is not None:
+    ENCODERS["br"] = BrotliEncoder
+if zstandard is not None:
+    ENCODERS["zstd"] = ZstdEncoder
+
+# the encodings of upstream bodies which the HTTP clients are able to decode.
+DECODABLE_ENCODINGS = ["gzip", "deflate"] + (["br"] if brotli is not None else [])
+
+def negotiate_encoding(accept_encoding : str, encodings : list) -> str:
+    """
+    Chooses the encoding preferred by a client (given its Accept-Encoding header) among the given encodings, or None if the
+    client accepts none of them. Ties are broken by the order of the encodings.
+    """
+
+    if not accept_encoding:
+        return None
+
+    accept = parse_accept_header(accept_encoding)
+    best_encoding = None
+    best_quality = 0
+    for encoding in encodings:
+        quality = accept.quality(encoding)
+        if quality > best_quality:
+            best_encoding = encoding
+            best_quality = quality
+    return best_encoding
+
+def upstream_accept_encoding(client_accept_encoding : str, pass_through : bool) -> str:
+    """
+    Computes the Accept-Encoding header sent to a remote service, which only lists encodings the gateway is able to decode.
+
+    If pass_through is True, the encodings the client does not accept are left out (unless it accepts none of them), so that the
+    compressed body may be relayed without decoding it.
+    """
+
+    encodings = DECODABLE_ENCODINGS
+    if pass_through and client_accept_encoding:
+        accept = parse_accept_header(client_accept_encoding)
+        accepted = [encoding for encoding in encodings if accept.quality(encoding) > 0]
+        if len(accepted) > 0:
+            encodings = accepted
+    return ", ".join(encodings)
+
+def is_compressible(content_type : str) -> bool:
+    mimetype = content_type.split(";")[0].strip().lower()
+    return mimetype in COMPRESSIBLE_CONTENT_TYPES or mimetype.startswith("text/") or mimetype.endswith("+json") or mimetype.endswith("+xml")
+
+class CompressionPolicy:
+    """
+    Decides which responses are compressed, and with which encoding.
+
+    Responses are compressed with the encoding preferred by the client among the given ones (those which are not available are
+    ignored) if their content type is compressible and they are not known to be smaller than min_size bytes.
+    """
+
+    def __init__(self, encodings : list, min_size : int):
+        self.encodings = [encoding for encoding in encodings if encoding in ENCODERS]
+        self.min_size = min_size
+
+    def select(self, method : str, accept_encoding : str, status_code : int, headers : Headers) -> str:
+        """
+        Chooses the encoding of a response, or None if it must be sent as it is.
+        """
+
+        if method == "HEAD" or status_code < 200 or status_code in (204, 206, 304):
+            return None
+        if "Content-Encoding" in headers or "Content-Range" in headers or not is_compressible(headers.get("Content-Type", "")):
+            return None
+        if "no-transform" in headers.get("Cache-Control", "").lower():
+            return None
+        content_length = headers.get("Content-Length", type=int)
+        if content_length is not None and content_length < self.min_size:
+            return None
+        return negotiate_encoding(accept_encoding, self.encodings)
+
+    def create_encoder(self, encoding : str):
+        return ENCODERS[encoding](COMPRESSION_LEVELS[encoding])
+
+def add_vary(headers : Headers):
+    vary = headers.get("Vary")
+    if vary is None:
+        headers["Vary"] = "Accept-Encoding"
+    elif "accept-encoding" not in vary.lower() and vary.strip() != "*":
+        headers["Vary"] = vary + ", Accept-Encoding"
+
+def set_encoding(headers : Headers, encoding : str):
+    """
+    Adjusts the headers of a response whose body is compressed with the given encoding.
+
+    The ETag is made weak, since the compressed body is not byte-for-byte the same.
+    """
+
+    headers["Content-Encoding"] = encoding
+    headers.pop("Content-Length", None)
+    etag = headers.get("ETag")
+    if etag is not None and not etag.startswith("W/"):
+        headers["ETag"] = "W/" + etag
+
+class StreamCompressor:
+    """
+    Compresses a body chunk by chunk, flushing the encoder only when FLUSH_BYTES bytes have been compressed or FLUSH_INTERVAL
+    seconds have passed since the last flush, and when the body ends.
+    """
+
+    def __init__(self, encoder):
+        self._encoder = encoder
+        self._pending = 0
+        self._flushed_at = time.monotonic()
+
+    def compress(self, chunk : bytes) -> bytes:
+        data = self._encoder.compress(chunk)
+        self._pending += len(chunk)
+        now = time.monotonic()
+        if self._pending >= FLUSH_BYTES or now - self._flushed_at >= FLUSH_INTERVAL:
+            data += self._encoder.flush()
+            self._pending = 0
+            self._flushed_at = now
+        return data
+
+    def finish(self) -> bytes:
+        return self._encoder.finish()
+
+def compress_chunks(chunks, encoder):
+    """
+    Compresses a body as it is produced, so that the client receives it as a stream.
+    """
+
+    compressor = StreamCompressor(encoder)
+    for chunk in chunks:
+        if chunk:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+    yield compressor.finish()
+
+class CompressionMiddleware:
+    """
+    A WSGI middleware which compresses the responses of an application, as decided by a compression policy.
+
+    Bodies are compressed as they are produced, so streamed responses are still streamed.
+    """
+
+    def __init__(self, app, policy : CompressionPolicy):
+        self._app = app
+        self._policy = policy
+
+    def __call__(self, environ, start_response):
+        accept_encoding = environ.get("HTTP_ACCEPT_ENCODING", "")
+        method = environ.get("REQUEST_METHOD", "GET")
+        selected = []
+
+        def compressing_start_response(status, response_headers, exc_info=None):
+            headers = Headers(response_headers)
+            if is_compressible(headers.get("Content-Type", "")):
+                add_vary(headers)
+            encoding = self._policy.select(method, accept_encoding, int(status.split(" ", 1)[0]), headers)
+            if encoding is not None:
+                set_encoding(headers, encoding)
+                selected.append(encoding)
+            return start_response(status, headers.to_wsgi_list(), exc_info)
+
+        body = self._app(environ, compressing_start_response)
+        if len(selected) == 0:
+            return body
+        return ClosingIterator(compress_chunks(body, self._policy.create_encoder(selected[0])), body)
+
+class ClosingIterator:
+    """
+    Iterates a compressed body, closing the original body when done.
+    """
+
+    def __init__(self, chunks, body):
+        self._chunks = chunks
+        self._body = body
+
+    def __iter__(self):
+        return self._chunks
+
+    def close(self):
+        if hasattr(self._body, "close"):
+            self._body.close()
+
+class AsgiCompressionMiddleware:
+    """
+    An ASGI middleware which compresses the responses of an application, as decided by a compression policy.
+    """
+
+    def __init__(self, app, policy : CompressionPolicy):
+        self._app = app
+        self._policy = policy
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self._app(scope, receive, send)
+            return
+
+        accept_encoding = ""
+        for (name, value) in scope["headers"]:
+            if name.lower() == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+        compressors = []
+
+        async def compressing_send(message):
+            if message["type"] == "http.response.start":
+                headers = Headers([(name.decode("latin-1"), value.decode("latin-1")) for (name, value) in message["headers"]])
+                if is_compressible(headers.get("Content-Type", "")):
+                    add_vary(headers)
+                encoding = self._policy.select(scope["method"], accept_encoding, message["status"], headers)
+                if encoding is not None:
+                    set_encoding(headers, encoding)
+                    compressors.append(StreamCompressor(self._policy.create_encoder(encoding)))
+                message = dict(message)
+                message["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1")) for (name, value) in headers.items()]
+            elif message["type"] == "http.response.body" and len(compressors) > 0:
+                compressor = compressors[0]
+                body = message.get("body", b"")
+                more_body = message.get("more_body", False)
+                data = compressor.compress(body) if body else b""
+                if not more_body:
+                    data += compressor.finish()
+                message = {"type": "http.response.body", "body": data, "more_body": more_body}
+            await send(message)
+
+        await self._app(scope, receive, compressing_send)
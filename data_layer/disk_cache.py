@@ -0,0 +1,495 @@
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from .response_cache import ResponseCache, CachedResponse, hit_rate
+
+# the layout of the index file, in 8-byte words: a header, the sequence number of the last invalidation of each tag bit, the
+# number of responses of each segment (in a ring of max_segments words) and the slots, grouped in sets of SLOT_WAYS slots.
+INDEX_MAGIC = 0x3158444943484531
+INDEX_VERSION = 2
+HEADER_WORDS = 16
+MAGIC_WORD = 0
+VERSION_WORD = 1
+SLOT_COUNT_WORD = 2
+SEGMENT_BYTES_WORD = 3
+FIRST_SEGMENT_WORD = 4
+LAST_SEGMENT_WORD = 5
+WRITE_OFFSET_WORD = 6
+ENTRIES_WORD = 7
+MAX_SEGMENTS_WORD = 8
+SEQUENCE_WORD = 9
+TAG_BITS = 64
+
+# the words of each slot: the digest of the key, where the record is stored, when it expires (0 if never), the bits of its
+# tags and the sequence number when it was requested. Empty slots have a length of 0, and slots of deleted segments are empty
+# as well.
+SLOT_WAYS = 4
+SLOT_DIGEST = 0
+SLOT_SEGMENT = 2
+SLOT_OFFSET = 3
+SLOT_LENGTH = 4
+SLOT_EXPIRES = 5
+SLOT_TAGS = 6
+SLOT_SEQUENCE = 7
+SLOT_WORDS = 8
+
+# the header of each record of a segment: the digest of the key, the status code, the length of the headers (as JSON) and the
+# length of the body, which follow it.
+RECORD_HEADER = struct.Struct("<16sIIQ")
+
+def key_digest(key) -> bytes:
+    # the key is not stored, as it contains the Authorization and Cookie headers of the request.
+    return hashlib.blake2b(json.dumps(key).encode("utf-8"), digest_size=16).digest()
+
+def tag_bit(tag) -> int:
+    # responses with a tag are found by a bit of their slot, so other responses may be invalidated along with them.
+    return 1 << (zlib.crc32(str(tag).encode("utf-8")) % TAG_BITS)
+
+class DiskCachedResponse:
+    """
+    A response read from a disk cache, whose body is a view of its memory-mapped segment.
+
+    The body is only copied (from the page cache shared by all processes) when it is used, chunk by chunk if it is sent with
+    body_chunks.
+    """
+
+    compressed = False
+
+    def __init__(self, status_code : int, headers : list, body_view : memoryview):
+        self.status_code = status_code
+        self.headers = headers
+        self._body_view = body_view
+
+    @property
+    def body(self) -> bytes:
+        return bytes(self._body_view)
+
+    @property
+    def body_length(self) -> int:
+        return len(self._body_view)
+
+    def body_chunks(self, chunk_size : int):
+        # WSGI servers (such as Gunicorn) only send bytes, so each chunk is copied when it is sent.
+        for start in range(0, len(self._body_view), chunk_size):
+            yield bytes(self._body_view[start:start + chunk_size])
+
+class DiskCache:
+    """
+    A cache of responses kept in files of a folder, shared by all processes which use the folder and kept across restarts.
+
+    Responses are appended to segment files of segment_bytes bytes, and the responses are found through an index of max_entries
+    slots, which is memory-mapped. When the segments hold max_bytes bytes, the oldest segment is deleted along with its
+    responses. Responses larger than max_entry_bytes are not cached. If ttl is given, responses expire that many seconds after
+    being stored (even if the server is restarted meanwhile).
+
+    Invalidations are lazy: the index keeps the sequence number of the last invalidation of each tag bit, and responses
+    requested before it are dropped when they are looked up (or replaced). Likewise, the slots of deleted segments are only
+    emptied when they are reused, so neither scans the index.
+
+    Processes are synchronized with locks on the index file; the files are opened again in each process (e.g. after the worker
+    processes are forked). The counters are kept by each process.
+    """
+
+    COUNTERS = ResponseCache.COUNTERS
+
+    def __init__(self, path : str, max_entries : int, max_bytes : int, max_entry_bytes : int, segment_bytes : int, ttl : float = None):
+        self._path = path
+        self._slot_count = max(SLOT_WAYS, (max_entries + SLOT_WAYS - 1) // SLOT_WAYS * SLOT_WAYS)
+        self._segment_bytes = segment_bytes
+        self._max_segments = max(2, max_bytes // segment_bytes)
+        self._max_entry_bytes = min(max_entry_bytes, segment_bytes)
+        self._ttl = ttl
+        self._tags_word = HEADER_WORDS
+        self._segment_entries_word = self._tags_word + TAG_BITS
+        self._slots_word = self._segment_entries_word + self._max_segments
+        self._lock = threading.Lock()
+        self._pid = None
+        self._counters = dict.fromkeys(DiskCache.COUNTERS, 0)
+
+    def get(self, key) -> DiskCachedResponse:
+        """
+        Gets the response stored with a key, or None if there is none.
+        """
+
+        digest = key_digest(key)
+        with self._lock:
+            self._open()
+            with self._locked(fcntl.LOCK_SH):
+                slot = self._find(digest)
+                if slot is None:
+                    self._counters["misses"] += 1
+                    return None
+                segment = self._words[slot + SLOT_SEGMENT]
+                offset = self._words[slot + SLOT_OFFSET]
+                length = self._words[slot + SLOT_LENGTH]
+                expires_at = self._floats[slot + SLOT_EXPIRES]
+                sequence = self._words[slot + SLOT_SEQUENCE]
+                invalidated = self._invalidated_since(self._words[slot + SLOT_TAGS], sequence)
+                try:
+                    view = self._segment_view(segment)
+                except FileNotFoundError:
+                    self._counters["misses"] += 1
+                    return None
+
+            expired = expires_at != 0.0 and time.time() >= expires_at
+            if invalidated or expired:
+                with self._locked(fcntl.LOCK_EX):
+                    if self._find(digest) == slot and self._words[slot + SLOT_SEQUENCE] == sequence and self._floats[slot + SLOT_EXPIRES] == expires_at:
+                        self._clear_slot(slot)
+                self._counters["invalidations" if invalidated else "expirations"] += 1
+                self._counters["misses"] += 1
+                return None
+
+            record_digest, status_code, headers_length, body_length = RECORD_HEADER.unpack_from(view, offset)
+            if record_digest != digest or RECORD_HEADER.size + headers_length + body_length != length:
+                self._counters["misses"] += 1
+                return None
+            headers_start = offset + RECORD_HEADER.size
+            body_start = headers_start + headers_length
+            headers = [tuple(header) for header in json.loads(bytes(view[headers_start:body_start]))]
+            self._counters["hits"] += 1
+            return DiskCachedResponse(status_code, headers, view[body_start:body_start + body_length])
+
+    def stamp(self, tags : list) -> int:
+        """
+        Gets the stamp of the response of a request, which must be taken before the request is sent (so that the response is
+        not stored if its tags are invalidated meanwhile): the current sequence number.
+        """
+
+        with self._lock:
+            self._open()
+            return self._words[SEQUENCE_WORD]
+
+    def put(self, key, entry : CachedResponse, tags : list = (), stamp : int = None):
+        """
+        Stores a response, deleting the oldest segments if needed.
+
+        If the stamp taken before the response was requested is given, the response is only stored if its tags were not
+        invalidated since then.
+        """
+
+        headers = json.dumps(entry.headers).encode("utf-8")
+        body = entry.body
+        digest = key_digest(key)
+        length = RECORD_HEADER.size + len(headers) + len(body)
+        if length > self._max_entry_bytes:
+            return
+        expires_at = 0.0 if self._ttl is None else time.time() + self._ttl
+        tag_bits = 0
+        for tag in tags:
+            tag_bits |= tag_bit(tag)
+
+        with self._lock:
+            self._open()
+            with self._locked(fcntl.LOCK_EX):
+                if stamp is None:
+                    stamp = self._words[SEQUENCE_WORD]
+                elif self._invalidated_since(tag_bits, stamp):
+                    return
+                if self._words[WRITE_OFFSET_WORD] + length > self._segment_bytes:
+                    self._start_segment()
+                segment = self._words[LAST_SEGMENT_WORD]
+                offset = self._words[WRITE_OFFSET_WORD]
+                fd = os.open(self._segment_path(segment), os.O_WRONLY)
+                try:
+                    os.pwrite(fd, RECORD_HEADER.pack(digest, entry.status_code, len(headers), len(body)) + headers + body, offset)
+                finally:
+                    os.close(fd)
+                self._words[WRITE_OFFSET_WORD] = offset + length
+
+                slot = self._choose_slot(digest)
+                if self._words[slot + SLOT_LENGTH] != 0:
+                    if self._read_digest(slot) != digest and not self._is_stale(slot):
+                        self._counters["evictions"] += 1
+                    self._clear_slot(slot)
+                self._words[slot + SLOT_SEGMENT] = segment
+                self._words[slot + SLOT_OFFSET] = offset
+                self._floats[slot + SLOT_EXPIRES] = expires_at
+                self._words[slot + SLOT_TAGS] = tag_bits
+                self._words[slot + SLOT_SEQUENCE] = stamp
+                self._write_digest(slot, digest)
+                self._words[slot + SLOT_LENGTH] = length
+                self._words[ENTRIES_WORD] += 1
+                self._words[self._segment_entries(segment)] += 1
+            self._counters["stores"] += 1
+
+    def invalidate(self, tag):
+        """
+        Invalidates all responses stored with a tag (and with the tags which share its bit), which are dropped when they are
+        looked up.
+        """
+
+        bit = tag_bit(tag).bit_length() - 1
+        with self._lock:
+            self._open()
+            with self._locked(fcntl.LOCK_EX):
+                sequence = self._words[SEQUENCE_WORD] + 1
+                self._words[SEQUENCE_WORD] = sequence
+                self._words[self._tags_word + bit] = sequence
+
+    def clear(self):
+        """
+        Removes all responses from the cache.
+        """
+
+        with self._lock:
+            self._open()
+            with self._locked(fcntl.LOCK_EX):
+                self._words[self._segment_entries_word:] = memoryview(bytes((len(self._words) - self._segment_entries_word) * 8)).cast("Q")
+                self._words[ENTRIES_WORD] = 0
+
+    def statistics(self) -> dict:
+        """
+        Gets the counters of this process, along with the number of responses held by the cache (including the invalidated
+        responses which were not looked up yet) and the size of its segments.
+        """
+
+        with self._lock:
+            self._open()
+            result = self._counters.copy()
+            result["hit_rate"] = hit_rate(result)
+            with self._locked(fcntl.LOCK_SH):
+                result["entries"] = self._words[ENTRIES_WORD]
+                result["bytes"] = (self._words[LAST_SEGMENT_WORD] - self._words[FIRST_SEGMENT_WORD]) * self._segment_bytes + self._words[WRITE_OFFSET_WORD]
+            return result
+
+    def clear_statistics(self):
+        with self._lock:
+            self._counters = dict.fromkeys(DiskCache.COUNTERS, 0)
+
+    def _open(self):
+        """
+        Opens the index of the cache in the current process, creating it if it does not exist or was created with other settings.
+        """
+
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+
+        os.makedirs(self._path, exist_ok=True)
+        index_words = self._slots_word + self._slot_count * SLOT_WORDS
+        self._index_fd = os.open(os.path.join(self._path, "index"), os.O_RDWR | os.O_CREAT, 0o600)
+        self._segments = {}
+        self._pid = pid
+        with self._locked(fcntl.LOCK_EX):
+            valid = os.fstat(self._index_fd).st_size == index_words * 8
+            if not valid:
+                os.ftruncate(self._index_fd, 0)
+                os.ftruncate(self._index_fd, index_words * 8)
+            self._index = mmap.mmap(self._index_fd, index_words * 8)
+            self._words = memoryview(self._index).cast("Q")
+            self._floats = memoryview(self._index).cast("d")
+
+            expected = {MAGIC_WORD: INDEX_MAGIC, VERSION_WORD: INDEX_VERSION, SLOT_COUNT_WORD: self._slot_count, SEGMENT_BYTES_WORD: self._segment_bytes, MAX_SEGMENTS_WORD: self._max_segments}
+            if not valid or any(self._words[word] != value for (word, value) in expected.items()):
+                for name in os.listdir(self._path):
+                    if name.startswith("segment-"):
+                        os.remove(os.path.join(self._path, name))
+                self._words[:] = memoryview(bytes(index_words * 8)).cast("Q")
+                for (word, value) in expected.items():
+                    self._words[word] = value
+                self._create_segment(0)
+
+    def _locked(self, operation : int):
+        return FileLock(self._index_fd, operation)
+
+    def _set_start(self, digest : bytes) -> int:
+        index = int.from_bytes(digest[:8], "little") % (self._slot_count // SLOT_WAYS)
+        return self._slots_word + index * SLOT_WAYS * SLOT_WORDS
+
+    def _segment_entries(self, segment : int) -> int:
+        return self._segment_entries_word + segment % self._max_segments
+
+    def _is_stored(self, slot : int) -> bool:
+        # the responses of deleted segments were already removed from the counts of responses.
+        return self._words[slot + SLOT_LENGTH] != 0 and self._words[slot + SLOT_SEGMENT] >= self._words[FIRST_SEGMENT_WORD]
+
+    def _invalidated_since(self, tag_bits : int, sequence : int) -> bool:
+        """
+        Checks whether any of some tag bits was invalidated after a sequence number.
+        """
+
+        while tag_bits != 0:
+            bit = (tag_bits & -tag_bits).bit_length() - 1
+            if self._words[self._tags_word + bit] > sequence:
+                return True
+            tag_bits &= tag_bits - 1
+        return False
+
+    def _is_stale(self, slot : int) -> bool:
+        return self._invalidated_since(self._words[slot + SLOT_TAGS], self._words[slot + SLOT_SEQUENCE])
+
+    def _find(self, digest : bytes) -> int:
+        start = self._set_start(digest)
+        for slot in range(start, start + SLOT_WAYS * SLOT_WORDS, SLOT_WORDS):
+            if self._is_stored(slot) and self._read_digest(slot) == digest:
+                return slot
+        return None
+
+    def _choose_slot(self, digest : bytes) -> int:
+        """
+        Chooses the slot of a response: the slot of the same key, else an empty (or invalidated) slot, else the slot of the
+        oldest response of the set.
+        """
+
+        slot = self._find(digest)
+        if slot is not None:
+            return slot
+        start = self._set_start(digest)
+        slots = range(start, start + SLOT_WAYS * SLOT_WORDS, SLOT_WORDS)
+        for slot in slots:
+            if not self._is_stored(slot):
+                self._words[slot + SLOT_LENGTH] = 0
+                return slot
+        for slot in slots:
+            if self._is_stale(slot):
+                return slot
+        return min(slots, key=lambda slot: (self._words[slot + SLOT_SEGMENT], self._words[slot + SLOT_OFFSET]))
+
+    def _read_digest(self, slot : int) -> bytes:
+        return bytes(self._words[slot + SLOT_DIGEST:slot + SLOT_DIGEST + 2].cast("B"))
+
+    def _write_digest(self, slot : int, digest : bytes):
+        self._words[slot + SLOT_DIGEST:slot + SLOT_DIGEST + 2] = memoryview(digest).cast("Q")
+
+    def _clear_slot(self, slot : int):
+        self._words[slot + SLOT_LENGTH] = 0
+        self._words[ENTRIES_WORD] -= 1
+        self._words[self._segment_entries(self._words[slot + SLOT_SEGMENT])] -= 1
+
+    def _create_segment(self, segment : int):
+        fd = os.open(self._segment_path(segment), os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            # the segment is allocated at once (sparsely), so that it may be mapped as a whole before it is full.
+            os.ftruncate(fd, self._segment_bytes)
+        finally:
+            os.close(fd)
+
+    def _start_segment(self):
+        while self._words[LAST_SEGMENT_WORD] - self._words[FIRST_SEGMENT_WORD] + 1 >= self._max_segments:
+            self._delete_first_segment()
+        self._words[LAST_SEGMENT_WORD] += 1
+        self._words[WRITE_OFFSET_WORD] = 0
+        self._create_segment(self._words[LAST_SEGMENT_WORD])
+
+    def _delete_first_segment(self):
+        """
+        Deletes the oldest segment, whose responses are removed from the count of responses at once (their slots are left as
+        they are, and are seen as empty).
+        """
+
+        segment = self._words[FIRST_SEGMENT_WORD]
+        entries = self._words[self._segment_entries(segment)]
+        self._words[ENTRIES_WORD] -= entries
+        self._words[self._segment_entries(segment)] = 0
+        self._counters["evictions"] += entries
+        self._words[FIRST_SEGMENT_WORD] = segment + 1
+        try:
+            os.remove(self._segment_path(segment))
+        except FileNotFoundError:
+            pass
+
+    def _segment_path(self, segment : int) -> str:
+        return os.path.join(self._path, "segment-{:08d}".format(segment))
+
+    def _segment_view(self, segment : int) -> memoryview:
+        """
+        Gets a view of a segment, which is mapped once by each process.
+
+        Mappings of deleted segments are dropped, but they remain valid while the responses read from them are in use.
+        """
+
+        if segment not in self._segments:
+            first_segment = self._words[FIRST_SEGMENT_WORD]
+            for old_segment in [old_segment for old_segment in self._segments if old_segment < first_segment]:
+                del self._segments[old_segment]
+            fd = os.open(self._segment_path(segment), os.O_RDONLY)
+            try:
+                self._segments[segment] = memoryview(mmap.mmap(fd, self._segment_bytes, prot=mmap.PROT_READ))
+            finally:
+                os.close(fd)
+        return self._segments[segment]
+
+class FileLock:
+    """
+    A lock on a file, shared by all processes, which is released when the with block ends.
+    """
+
+    def __init__(self, fd : int, operation : int):
+        self._fd = fd
+        self._operation = operation
+
+    def __enter__(self):
+        fcntl.flock(self._fd, self._operation)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+class TieredCache:
+    """
+    A cache of responses with two tiers: an in-memory cache of each process, and a disk cache shared by all processes.
+
+    Responses are stored in both tiers. Responses not found in memory are looked up on disk; they are not copied back to
+    memory, since their bodies are sent from the (memory-mapped) segments, whose pages are shared by all processes.
+
+    Invalidations apply to the disk tier, and to the memory tiers of all processes if the memory tier has generations (see
+    ResponseCache).
+    """
+
+    COUNTERS = ResponseCache.COUNTERS
+
+    def __init__(self, memory : ResponseCache, disk : DiskCache):
+        self._memory = memory
+        self._disk = disk
+        self.compress = memory.compress
+        self.max_entry_bytes = memory.max_entry_bytes
+
+    @property
+    def memory(self) -> ResponseCache:
+        return self._memory
+
+    @property
+    def disk(self) -> DiskCache:
+        return self._disk
+
+    def get(self, key):
+        entry = self._memory.get(key)
+        if entry is None:
+            entry = self._disk.get(key)
+        return entry
+
+    def stamp(self, tags : list) -> tuple:
+        return (self._memory.stamp(tags), self._disk.stamp(tags))
+
+    def put(self, key, entry : CachedResponse, tags : list = (), stamp : tuple = None):
+        memory_stamp, disk_stamp = (None, None) if stamp is None else stamp
+        self._memory.put(key, entry, tags, memory_stamp)
+        self._disk.put(key, entry, tags, disk_stamp)
+
+    def invalidate(self, tag):
+        self._memory.invalidate(tag)
+        self._disk.invalidate(tag)
+
+    def clear(self):
+        self._memory.clear()
+        self._disk.clear()
+
+    def statistics(self) -> dict:
+        """
+        Gets the statistics of the memory tier, along with those of the disk tier (under "disk").
+        """
+
+        result = self._memory.statistics()
+        result["disk"] = self._disk.statistics()
+        return result
+
+    def clear_statistics(self):
+        self._memory.clear_statistics()
+        self._disk.clear_statistics()
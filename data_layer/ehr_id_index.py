@@ -0,0 +1,102 @@
+from .response_cache import ResponseCache, CachedResponse
+
+class IndexedEhrId:
+    """
+    The EHR id of a patient or subject, kept in the ResponseCache of the ids of an EhrIdIndex.
+    """
+
+    def __init__(self, ehr_id : str):
+        self.ehr_id = ehr_id
+        self.expires_at = None
+        self.tags = ()
+        self.stamp = None
+        self.size = len(ehr_id)
+
+class EhrIdIndex:
+    """
+    An index from patients and subjects to the ids of their EHRs, filled from the responses of the routes which resolve them.
+
+    Only the EHR id of each patient or subject is kept in ids; the responses are kept in responses once per EHR (and route),
+    so a lookup takes two constant-time steps. The ids are stored with the tag of their EHR (given by ehr_tag, a function of the
+    EHR id), along with the tags of their route, so that changing an EHR (e.g. its EHR_STATUS, which holds its subject) invalidates
+    both its ids and its responses. Both caches should have the same generations, so that invalidations reach all processes.
+    """
+
+    COUNTERS = ResponseCache.COUNTERS
+
+    def __init__(self, ids : ResponseCache, responses : ResponseCache, ehr_tag):
+        self.ids = ids
+        self.responses = responses
+        self.ehr_tag = ehr_tag
+
+    def resolver(self, kind : str, extract_ehr_id) -> "EhrIdResolver":
+        """
+        Creates the cache of a route which resolves EHR ids, whose responses are identified by kind. extract_ehr_id gets the EHR
+        id from the body of a response, or None if it has none.
+        """
+
+        return EhrIdResolver(self, kind, extract_ehr_id)
+
+    def invalidate(self, tag):
+        self.ids.invalidate(tag)
+        self.responses.invalidate(tag)
+
+    def clear(self):
+        self.ids.clear()
+        self.responses.clear()
+
+    def statistics(self) -> dict:
+        """
+        Gets the statistics of the ids, along with those of the responses (under "responses").
+        """
+
+        result = self.ids.statistics()
+        result["responses"] = self.responses.statistics()
+        return result
+
+    def clear_statistics(self):
+        self.ids.clear_statistics()
+        self.responses.clear_statistics()
+
+class EhrIdResolver:
+    """
+    The cache of a route which resolves the EHR id of a patient or subject, backed by an EhrIdIndex.
+
+    It is keyed like the other caches of a proxy (by the remote URL, followed by the values of the KEY_HEADERS), and the response
+    of an EHR is keyed by the kind of the route and the EHR id, followed by the same headers.
+    """
+
+    def __init__(self, index : EhrIdIndex, kind : str, extract_ehr_id):
+        self._index = index
+        self._kind = kind
+        self._extract_ehr_id = extract_ehr_id
+        self.compress = index.responses.compress
+        self.max_entry_bytes = index.responses.max_entry_bytes
+
+    def get(self, key) -> CachedResponse:
+        indexed = self._index.ids.get(key)
+        if indexed is None:
+            return None
+        return self._index.responses.get(self._response_key(indexed.ehr_id, key))
+
+    def stamp(self, tags : list) -> tuple:
+        return self._index.ids.stamp(tags)
+
+    def put(self, key, entry : CachedResponse, tags : list = (), stamp : tuple = None):
+        """
+        Stores the EHR id of a response and the response itself.
+
+        The tag of the EHR is only known once the response is received, so its generation is read then.
+        """
+
+        ehr_id = self._extract_ehr_id(entry.body)
+        if ehr_id is None:
+            return
+        ehr_tag = self._index.ehr_tag(ehr_id)
+        if stamp is not None:
+            stamp = stamp + self._index.ids.stamp([ehr_tag])
+        self._index.ids.put(key, IndexedEhrId(ehr_id), list(tags) + [ehr_tag], stamp)
+        self._index.responses.put(self._response_key(ehr_id, key), entry, [ehr_tag])
+
+    def _response_key(self, ehr_id : str, key : tuple) -> tuple:
+        return (self._kind, ehr_id) + tuple(key[1:])
@@ -1,78 +1,759 @@
 import requests
+import hashlib
 import inspect
+import json
+import math
+import time
 
 from flask import request, Response
+from werkzeug.http import http_date
 
+from .backend_guard import BackendUnavailable, NotGuarded
+from .compression import negotiate_encoding, upstream_accept_encoding
+from .load_balancer import SingleEndpoint
 from .relative_url_pattern import RelativeURLPattern
+from .response_cache import CachedResponse
+from .time_measurement import SUCCESS, RequestTiming, request_outcome, set_current_timing
+
+# the phases of a request which are measured: acquiring (or opening) a connection to the remote service, waiting for the first
+# byte of its response, downloading the response body, the sum of these three phases, and everything else done by the gateway.
+UPSTREAM_PHASES = ["connect", "first_byte", "download"]
+MEASURED_PHASES = UPSTREAM_PHASES + ["upstream", "gateway"]
+
+# the status codes of upstream responses which count as failures of the remote service for its guard and load balancer.
+FAILURE_STATUS_CODES = [502, 503, 504]
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+class RequestBodyStream:
+    """
+    An iterable which reads the body of the incoming request in bounded chunks.
+
+    It has a length so that the upstream request is sent with the original Content-Length instead of being chunked.
+    """
+
+    def __init__(self, stream, length : int, chunk_size : int):
+        self._stream = stream
+        self._length = length
+        self._chunk_size = chunk_size
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        remaining = self._length
+        while remaining > 0:
+            chunk = self._stream.read(min(self._chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def iterate_request_body(stream, chunk_size : int):
+    """
+    Reads a request body of unknown length (i.e. sent with chunked transfer encoding) in bounded chunks.
+    """
+
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+class ResponseBodyStream:
+    """
+    Relays the body of an upstream response in bounded chunks, releasing the upstream connection when it is closed.
+
+    If a timing is given, the time spent reading the body (but not sending it) is added to its "download" phase. on_close is
+    called once the stream is closed, even if the body was never read (e.g. for HEAD requests, responses without a body or
+    clients which disconnected), since the server closes the response in every case. failed tells whether reading the body
+    raised an error. If decode is False, a compressed body is relayed as it is.
+    """
+
+    def __init__(self, resp, chunk_size : int, timing : RequestTiming = None, on_close=None, decode : bool = True):
+        self._resp = resp
+        self._chunk_size = chunk_size
+        self._timing = timing
+        self._on_close = on_close
+        self._decode = decode
+        self._closed = False
+        self._chunks = None
+        self._read_ahead = []
+        self.failed = False
+
+    def read_ahead(self, limit : int) -> bytes:
+        """
+        Reads the body before it is relayed, until it ends or more than limit bytes are read. Returns the whole body if it ended,
+        or None if it is longer (the chunks read are then relayed first).
+        """
+
+        size = 0
+        for chunk in self._upstream_chunks():
+            self._read_ahead.append(chunk)
+            size += len(chunk)
+            if size > limit:
+                return None
+        return b"".join(self._read_ahead)
+
+    def __iter__(self):
+        read_ahead, self._read_ahead = self._read_ahead, []
+        yield from read_ahead
+        yield from self._upstream_chunks()
+
+    def _upstream_chunks(self):
+        if self._chunks is None:
+            self._chunks = self._read_chunks()
+        return self._chunks
+
+    def _read_chunks(self):
+        resp = self._resp
+        chunks = resp.iter_content(self._chunk_size) if self._decode else resp.raw.stream(self._chunk_size, decode_content=False)
+        while True:
+            start_time = time.perf_counter()
+            try:
+                chunk = next(chunks, None)
+            except Exception:
+                self.failed = True
+                raise
+            finally:
+                if self._timing is not None:
+                    self._timing.add("download", time.perf_counter() - start_time)
+            if chunk is None:
+                break
+            yield chunk
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._resp.close()
+        finally:
+            if self._on_close is not None:
+                self._on_close()
+
+def upstream_latency(timing : RequestTiming) -> float:
+    """
+    Gets the time the remote service took to respond to a request (without downloading the body), used to adapt the
+    concurrency limit of its guard.
+    """
+
+    return timing.phases.get("connect", 0.0) + timing.phases.get("first_byte", 0.0)
+
+def gateway_error_response(status_code : int, message : str, retry_after : float = None) -> Response:
+    """
+    Creates the response sent when the remote service could not be accessed.
+    """
+
+    response = Response(json.dumps({"error": message}), status_code, mimetype="application/json")
+    if retry_after is not None:
+        response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+class UpstreamPermit:
+    """
+    The permit of the guard of a request along with the lease of the endpoint it is sent to, which are released together.
+    """
+
+    def __init__(self, permit, lease):
+        self._permit = permit
+        self._lease = lease
+
+    @property
+    def base_url(self) -> str:
+        return self._lease.base_url
+
+    def release(self, success : bool, latency : float = None):
+        self._lease.release(success, latency)
+        self._permit.release(success, latency)
+
+EXCLUDED_RESPONSE_HEADERS = ['content-encoding', 'content-length', 'transfer-encoding', 'connection']
+
+# the request headers which may change the response of the remote service, and thus are part of the keys of cached and
+# coalesced requests.
+KEY_HEADERS = ['Accept', 'Authorization', 'Cookie']
+
+# the request headers which make the remote service answer with a partial or empty response (e.g. 206 Partial Content or 304 Not
+# Modified), which must not be shared with other requests.
+UNCOALESCED_HEADERS = ['If-Match', 'If-None-Match', 'If-Modified-Since', 'If-Unmodified-Since', 'If-Range', 'Range']
+
+def request_key(remote_url : str, headers) -> tuple:
+    """
+    Computes the key which identifies the requests to a remote URL whose responses are interchangeable.
+    """
+
+    return (remote_url,) + tuple(headers.get(name) for name in KEY_HEADERS)
+
+class ProxyRoute:
+    """
+    A route redirected by a proxy to a remote service.
+    """
+
+    def __init__(self, local_url, target_url, methods, fn, decorators, stream, cache=None, cache_if=None, cache_tags=[], invalidates=[], single_flight=None, hedging=None, cache_arguments=None):
+        self.local_relative_url = RelativeURLPattern(local_url)
+        self.remote_relative_url = RelativeURLPattern(target_url)
+        self.methods = methods
+        self.fn = fn
+        self.decorators = decorators
+        self.stream = stream
+        self.cache = cache
+        self.cache_if = cache_if
+        self.cache_tags = cache_tags
+        self.cache_arguments = cache_arguments
+        self.invalidates = invalidates
+        self.single_flight = single_flight
+        self.hedging = hedging
+        self.hedge_delay = None
+        self.measurement = None
+
+        sig = inspect.signature(fn)
+        params = sig.parameters.values()
+        self.has_kwargs = any([True for p in params if p.kind == p.VAR_KEYWORD])
+
+    @property
+    def name(self):
+        return self.fn.__name__
+
+    @property
+    def requires_wsgi(self) -> bool:
+        """
+        Whether the route uses features which are only available when it is handled by the Flask application.
+        """
+
+        return self.cache is not None or self.single_flight is not None or self.hedging is not None
+
+    def translate(self, path_params : dict, query_string : dict):
+        """
+        Clones all arguments from path and query string and computes the URL of the remote resource, relative to the base URL.
+        """
+
+        params = path_params.copy()
+        query_string_keys = self.local_relative_url.query_string_keys
+        for key in query_string:
+            variable_name = query_string_keys.get(key)
+            if variable_name is not None:
+                params[variable_name] = query_string[key]
+
+        return params, self.remote_relative_url.replace(**params)
+
+    def finish(self, response, params : dict):
+        """
+        Lets the decorated function handle the response of the remote service.
+        """
+
+        if self.has_kwargs:
+            return self.fn(response, **params)
+        else:
+            return self.fn(response)
+
+    def cached_arguments(self, method : str, params : dict, get_body) -> dict:
+        """
+        Gets the arguments which identify the cached response of a request, or None if the response of the request must not be
+        cached.
+
+        If the route has a cache_arguments function, it gets them from the method, the arguments and the body of the request
+        (read by calling get_body). Otherwise, only GET requests are cached, and only if the cache_if function (if any) accepts
+        their arguments.
+        """
+
+        if self.cache is None:
+            return None
+        if self.cache_arguments is not None:
+            return self.cache_arguments(method, params, get_body)
+        if method != 'GET':
+            return None
+        if self.cache_if is not None and not self.cache_if(params):
+            return None
+        return params
+
+    def cache_key(self, arguments : dict, remote_url : str, headers) -> tuple:
+        """
+        Computes the key of the cached response of a request given its cached arguments, or None if they are None.
+
+        Requests of routes with a cache_arguments function are identified by these arguments instead of their remote URL.
+        """
+
+        if arguments is None:
+            return None
+        if self.cache_arguments is not None:
+            return (json.dumps(arguments, sort_keys=True),) + tuple(headers.get(name) for name in KEY_HEADERS)
+        return request_key(remote_url, headers)
+
+    def tags_of(self, arguments : dict) -> list:
+        """
+        Gets the tags of the cached response of a request: the cache_tags of the route, or the tags returned by it for the
+        cached arguments of the request if it is a function.
+        """
+
+        if callable(self.cache_tags):
+            return self.cache_tags(arguments)
+        return self.cache_tags
+
+    def coalescing_key(self, method : str, remote_url : str, headers) -> tuple:
+        """
+        Computes the key used to coalesce a request with identical concurrent requests, or None if it must not be coalesced.
+
+        Only GET requests of routes with a single flight group, whose bodies are not streamed, are coalesced, unless they are
+        conditional or ranged.
+        """
+
+        if self.single_flight is None or self.stream or method != 'GET':
+            return None
+        if any(name in headers for name in UNCOALESCED_HEADERS):
+            return None
+        return request_key(remote_url, headers)
+
+    def create_cached_response(self, status_code : int, headers : list, body : bytes) -> CachedResponse:
+        """
+        Creates the cached version of a response, with the ETag and Last-Modified headers used to answer conditional requests.
+
+        If the remote service did not send these headers, the ETag is a hash of the body and the response is considered
+        modified when it is cached.
+        """
+
+        header_names = {name.lower() for (name, _) in headers}
+        headers = list(headers)
+        if 'etag' not in header_names:
+            headers.append(('ETag', '"{}"'.format(hashlib.sha1(body).hexdigest())))
+        if 'last-modified' not in header_names:
+            headers.append(('Last-Modified', http_date()))
+        return CachedResponse(status_code, headers, body, compressed=self.cache.compress)
+
+    def invalidate(self, status_code : int, params : dict):
+        """
+        Invalidates the cached responses affected by a successful request.
+
+        Tags which are functions are called with the arguments of the request; they may return None if nothing is invalidated.
+        """
+
+        if 200 <= status_code < 300:
+            for (cache, tag) in self.invalidates:
+                if callable(tag):
+                    tag = tag(params)
+                if tag is not None:
+                    cache.invalidate(tag)
+
+    def record(self, timing : RequestTiming, outcome : str = SUCCESS):
+        """
+        Records the time taken by a request and its outcome, if the route is measured.
+
+        The gateway overhead is the part of the request which was not spent on the upstream phases.
+        """
+
+        if self.measurement is not None:
+            total_time = timing.elapsed()
+            upstream_time = sum(timing.phases.get(phase, 0.0) for phase in UPSTREAM_PHASES)
+            timing.add("upstream", upstream_time)
+            timing.add("gateway", total_time - upstream_time)
+            self.measurement.record(total_time, timing, outcome)
+
+    def record_download(self, timing : RequestTiming):
+        """
+        Records the time spent downloading a streamed response body, which ends after the request has been recorded.
+        """
+
+        if self.measurement is not None:
+            self.measurement.record_phase(timing, "download")
+
+    def decorate(self, handler):
+        """
+        Applies the decorators of the route to a request handler.
+        """
+
+        handler.__name__ = self.name
+
+        decorated = handler
+        for decorator in self.decorators:
+            decorated = decorator(decorated)
+        return decorated
 
 class FlaskProxy:
-    def __init__(self, app, remote_base_url, session=None, extra_params=None):
+    def __init__(self, app, remote_base_url, session=None, extra_params=None, stream=False, chunk_size=DEFAULT_CHUNK_SIZE, name=None, metrics=None, timed=None, upstream_compression=True, pass_through_compression=False, guard=None, load_balancer=None):
+        """
+        If a guard is given, the requests to the remote service are sent with the permission of the guard, and rejected with
+        503 Service Unavailable when it refuses them.
+
+        If a load balancer is given, each request is sent to one of its endpoints; remote_base_url is still used to identify
+        the requests whose responses are cached or coalesced.
+
+        If upstream_compression is True, the remote service is asked for bodies compressed with the encodings the gateway is
+        able to decode (else, for uncompressed bodies). If pass_through_compression is also True, streamed bodies compressed
+        with an encoding accepted by the client are relayed without being decoded.
+        """
+
         self._app = app
         self._remote_base_url = remote_base_url
         self._session = session
         self._extra_params = {} if extra_params is None else extra_params
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._name = name
+        self._metrics = metrics
+        self._timed = timed
+        self._upstream_compression = upstream_compression
+        self._pass_through_compression = pass_through_compression
+        self._guard = NotGuarded() if guard is None else guard
+        self._load_balancer = SingleEndpoint(remote_base_url) if load_balancer is None else load_balancer
+        self._routes = []
+
+    @property
+    def name(self):
+        """
+        The name of the remote service, used to label metrics.
+        """
 
-    def redirect(self, local_url, target_url=None, methods=["GET"], decorators=[]):
+        return self._name
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def remote_base_url(self):
+        return self._remote_base_url
+
+    @property
+    def session(self):
+        return self._session
+
+    @property
+    def extra_params(self):
+        return self._extra_params
+
+    @property
+    def chunk_size(self):
+        return self._chunk_size
+
+    @property
+    def upstream_compression(self):
+        return self._upstream_compression
+
+    @property
+    def pass_through_compression(self):
+        return self._pass_through_compression
+
+    @property
+    def guard(self):
+        return self._guard
+
+    @property
+    def load_balancer(self):
+        return self._load_balancer
+
+    @property
+    def routes(self) -> list:
+        """
+        The routes redirected by this proxy, in registration order.
+        """
+
+        return self._routes
+
+    def redirect(self, local_url, target_url=None, methods=["GET"], decorators=[], stream=None, measurement=None, cache=None, cache_if=None, cache_tags=[], invalidates=[], single_flight=None, hedging=None, cache_arguments=None):
         """
         Decorates the function as a Flask route handler which redirects to a remote service.
 
         The decorated function must take a single positional argument and may receive additional arguments.
+
+        If stream is True, the request and response bodies are piped between the client and the remote service in chunks
+        instead of being fully buffered. If stream is None, the setting of the proxy is used.
+
+        If the proxy is timed, the requests are measured under the name of the decorated function (or the given measurement
+        name), along with the phases of the requests: acquiring a connection to the remote service ("<name>.connect"), waiting
+        for the first byte of its response ("<name>.first_byte"), downloading the response body ("<name>.download"), the sum of
+        these ("<name>.upstream") and the overhead of the gateway ("<name>.gateway").
+
+        If a cache is given, successful responses to GET requests are stored in it (if cache_if is given, only when it returns
+        True for the arguments of the request) and later requests for the same remote URL, with the same headers listed in
+        KEY_HEADERS, are answered from the cache. The bodies of cached routes are only streamed if stream is True (and not
+        just set for the proxy); their request bodies are still buffered, and their responses are read ahead up to the largest
+        size cached, so that only the responses which are too large to be cached are streamed. Responses are stored with
+        the given cache_tags (or, if it is a function, with the tags it returns for the arguments of the request), and
+        conditional requests (with If-None-Match or If-Modified-Since) are answered with 304 Not Modified when possible.
+
+        If a cache_arguments function is also given, it is called with the method, the arguments and a function which reads the
+        body of each request, and returns the arguments which identify its response (or None if it must not be cached). Requests
+        of any method with the same arguments (and the same headers listed in KEY_HEADERS) are then answered with the same
+        cached response, and a cache_tags function receives these arguments instead of those of the request.
+
+        invalidates is a list of (cache, tag) pairs: when a request to the route succeeds, the responses stored in each cache
+        with the corresponding tag are invalidated. A tag may also be a function which gets it from the arguments of the request.
+
+        If a single flight group is given, identical concurrent GET requests (to the same remote URL, with the same headers
+        listed in KEY_HEADERS) share a single request to the remote service, unless their bodies are streamed.
+
+        If a RequestHedging object is given, GET requests whose bodies are not streamed are retried when they can not reach the
+        remote service and, if the proxy is timed, hedged after a percentile of the recent durations of their upstream phase.
+        It must only be given for idempotent routes.
         """
 
+        if stream is None:
+            stream = self._stream and cache is None
+
         if target_url is None:
             target_url = local_url
 
-        local_relative_url = RelativeURLPattern(local_url)
-        remote_relative_url = RelativeURLPattern(target_url)
-
         def proxy_decorator(fn):
-            sig = inspect.signature(fn)
-            params = sig.parameters.values()
-            has_kwargs = any([True for p in params if p.kind == p.VAR_KEYWORD])
+            route = ProxyRoute(local_url, target_url, methods, fn, decorators, stream, cache, cache_if, cache_tags, invalidates, single_flight, hedging, cache_arguments)
+            if self._timed is not None:
+                route.measurement = self._timed.measure_route(fn.__name__ if measurement is None else measurement, MEASURED_PHASES)
+            if hedging is not None and route.measurement is not None:
+                route.hedge_delay = hedging.create_delay(route.measurement.get_phase_group("upstream"))
+            self._routes.append(route)
 
             def handle_request(**path_params):
-                # clone all arguments from path and query string.
-                params = path_params.copy()
-                query_string = request.args.to_dict()
-                for key in query_string:
-                    variable_name = local_relative_url.query_string_variable_from_key(key)
-                    if variable_name is not None:
-                        params[variable_name] = query_string[key]
-
-                # send request to remote system.
-                remote_url = self._remote_base_url + remote_relative_url.replace(**params)
-                requester = requests
-                if self._session is not None:
-                    requester = self._session
-                resp = requester.request(
-                    method=request.method,
-                    url=remote_url,
-                    headers={key: value for (key, value) in request.headers if key != 'Host'},
-                    data=request.get_data(),
-                    cookies=request.cookies,
-                    allow_redirects=False,
-                    **self._extra_params)
-
-                # create Flask-style response object.
-                excluded_headers = ['content-encoding', 'content-length', 'transfer-encoding', 'connection']
-                headers = [(name, value) for (name, value) in resp.raw.headers.items() if name.lower() not in excluded_headers]
-                response = Response(resp.content, resp.status_code, headers)
-
-                if has_kwargs:
-                    return fn(response, **params)
-                else:
-                    return fn(response)
-
-            handle_request.__name__ = fn.__name__
-
-            decorated = handle_request
-            for decorator in decorators:
-                decorated = decorator(decorated)
-
-            flask_decorator = self._app.route(local_relative_url.path_pattern, methods=methods)
-            return flask_decorator(decorated)
+                timing = RequestTiming()
+                if self._metrics is not None:
+                    self._metrics.request_started(self._name)
+                status = "error"
+                try:
+                    result = self._forward(route, path_params, timing)
+                    status = getattr(result, "status_code", "unknown")
+                    return result
+                finally:
+                    if self._metrics is not None:
+                        self._metrics.request_finished(self._name, route.name, request.method, status)
+                    route.record(timing, request_outcome(status))
+
+            flask_decorator = self._app.route(route.local_relative_url.path_pattern, methods=methods)
+            return flask_decorator(route.decorate(handle_request))
 
         return proxy_decorator
 
+    def _forward(self, route : ProxyRoute, path_params : dict, timing : RequestTiming):
+        """
+        Redirects the current request to the remote service and lets the route handle the response.
+
+        Requests rejected by the guard of the remote service are answered with 503 Service Unavailable, and requests which
+        could not reach the remote service (or timed out) with 502 Bad Gateway (or 504 Gateway Timeout).
+        """
+
+        params, remote_relative_url = route.translate(path_params, request.args.to_dict())
+
+        remote_url = self._remote_base_url + remote_relative_url
+
+        cached_arguments = route.cached_arguments(request.method, params, request.get_data)
+        cache_key = route.cache_key(cached_arguments, remote_url, request.headers)
+        stamp = None
+        if cache_key is not None:
+            entry = route.cache.get(cache_key)
+            if entry is not None:
+                return route.finish(self._cached_response(entry), params)
+            # the stamp is taken before the request is sent, so that the response is not cached if it is invalidated meanwhile.
+            stamp = route.cache.stamp(route.tags_of(cached_arguments))
+
+        try:
+            response = self._respond(route, cached_arguments, remote_relative_url, cache_key, stamp, timing)
+        except BackendUnavailable as e:
+            return gateway_error_response(503, e.reason, e.retry_after)
+        except requests.Timeout:
+            return gateway_error_response(504, "the remote service did not respond in time")
+        except requests.ConnectionError:
+            return gateway_error_response(502, "the remote service could not be reached")
+
+        route.invalidate(response.status_code, params)
+
+        result = route.finish(response, params)
+        if result is not response:
+            # the upstream response (whose body may be streamed) is not sent, so it is released at once.
+            response.close()
+        return result
+
+    def _respond(self, route : ProxyRoute, cached_arguments : dict, remote_relative_url : str, cache_key : tuple, stamp : tuple, timing : RequestTiming) -> Response:
+        """
+        Sends the current request to the remote system and creates the Flask-style response object.
+
+        The upstream body is always read separately from the status and headers, so that downloading it is measured on its own.
+        If the bodies are streamed, it is downloaded while it is relayed to the client, so the download is not part of the
+        upstream and gateway times, unless the response is cached: its body is then read ahead, and only relayed as a stream if
+        it is too large to be cached.
+        """
+
+        upstream_request = self._prepare_request(route)
+        if route.stream:
+            resp, permit = self._send(remote_relative_url, timing, upstream_request)
+            status_code = resp.status_code
+            headers = [(name, value) for (name, value) in resp.raw.headers.items() if name.lower() not in EXCLUDED_RESPONSE_HEADERS]
+            encoding = self._pass_through_encoding(route, resp.headers.get('Content-Encoding'))
+            if encoding is not None:
+                headers.append(('Content-Encoding', encoding))
+            success = resp.status_code not in FAILURE_STATUS_CODES
+            content = None
+            def on_close():
+                permit.release(success and not body.failed, upstream_latency(timing))
+                # a body read ahead as a whole is part of the request, which is recorded afterwards.
+                if content is None:
+                    route.record_download(timing)
+            body = ResponseBodyStream(resp, self._chunk_size, timing, on_close, decode=encoding is None)
+            if cache_key is not None and status_code == 200:
+                try:
+                    content = body.read_ahead(route.cache.max_entry_bytes)
+                except requests.RequestException:
+                    body.close()
+                    raise
+            if content is None:
+                response = Response(body, status_code, headers)
+                if self._pass_through_compression:
+                    response.vary.add('Accept-Encoding')
+                return response
+            body.close()
+        else:
+            coalescing_key = route.coalescing_key(request.method, self._remote_base_url + remote_relative_url, request.headers)
+            if coalescing_key is None:
+                status_code, headers, content = self._fetch_idempotent(route, remote_relative_url, timing, upstream_request)
+            else:
+                timing.start_phase()
+                (status_code, headers, content), shared = route.single_flight.do(coalescing_key, lambda: self._fetch_idempotent(route, remote_relative_url, timing, upstream_request))
+                if shared:
+                    # the time spent waiting for the shared request counts as waiting for the remote service.
+                    timing.end_phase("first_byte")
+
+        response = Response(content, status_code, headers)
+        if cache_key is not None and status_code == 200:
+            entry = route.create_cached_response(status_code, headers, content)
+            route.cache.put(cache_key, entry, route.tags_of(cached_arguments), stamp)
+            response = Response(content, entry.status_code, entry.headers).make_conditional(request)
+        return response
+
+    def _prepare_request(self, route : ProxyRoute) -> dict:
+        """
+        Gets the method, headers, body and cookies of the request sent to the remote service, taken from the current request so
+        that it may also be sent from other threads.
+        """
+
+        headers = {key: value for (key, value) in request.headers if key not in ('Host', 'Accept-Encoding')}
+        if self._upstream_compression:
+            headers['Accept-Encoding'] = upstream_accept_encoding(request.headers.get('Accept-Encoding'), self._pass_through_compression and route.stream and route.cache is None)
+        else:
+            headers['Accept-Encoding'] = 'identity'
+        # the bodies of requests to cached routes may already have been read to identify their responses.
+        if route.stream and route.cache is None:
+            data = self._request_body_stream(headers)
+        else:
+            data = request.get_data()
+        return {
+            "method": request.method,
+            "headers": headers,
+            "data": data,
+            "cookies": request.cookies
+        }
+
+    def _send(self, remote_relative_url : str, timing : RequestTiming, upstream_request : dict):
+        """
+        Sends a request to the remote service, returning its response as soon as its status and headers are received, along
+        with the permit of the guard and the lease of the endpoint, which must be released once the body is read.
+
+        Each request (including each attempt of hedged and retried requests) is sent to the endpoint chosen by the load balancer.
+        """
+
+        requester = requests
+        if self._session is not None:
+            requester = self._session
+        permit = UpstreamPermit(self._guard.acquire(), self._load_balancer.acquire())
+        timing.start_phase()
+        set_current_timing(timing)
+        try:
+            resp = requester.request(
+                url=permit.base_url + remote_relative_url,
+                allow_redirects=False,
+                stream=True,
+                **upstream_request,
+                **self._extra_params)
+        except requests.RequestException:
+            permit.release(False)
+            raise
+        finally:
+            set_current_timing(None)
+        timing.end_phase("first_byte")
+        return resp, permit
+
+    def _fetch_idempotent(self, route : ProxyRoute, remote_relative_url : str, timing : RequestTiming, upstream_request : dict) -> tuple:
+        """
+        Fetches the response of a request, with the hedging and retries of the route (if any).
+
+        The phases of the request are those of the winning attempt, and the time spent before it was sent (waiting for the
+        hedge delay or the backoff of retries) counts as waiting for the first byte.
+        """
+
+        if route.hedging is None or upstream_request["method"] != 'GET':
+            return self._fetch(remote_relative_url, timing, upstream_request)
+
+        def attempt(cancelled):
+            attempt_timing = RequestTiming()
+            return self._fetch(remote_relative_url, attempt_timing, upstream_request, cancelled), attempt_timing
+
+        start_time = time.perf_counter()
+        result, attempt_timing = route.hedging.call(attempt, route.hedge_delay, retryable=(requests.ConnectionError,))
+        connect_time = attempt_timing.phases.get("connect", 0.0)
+        download_time = attempt_timing.phases.get("download", 0.0)
+        timing.add("connect", connect_time)
+        timing.add("first_byte", time.perf_counter() - start_time - connect_time - download_time)
+        timing.add("download", download_time)
+        return result
+
+    def _fetch(self, remote_relative_url : str, timing : RequestTiming, upstream_request : dict, cancelled=None) -> tuple:
+        """
+        Sends a request to the remote service and reads its whole response, returning its status code, its headers and its
+        body.
+
+        If the cancelled event is set once the status and headers are received, the body is not read and None is returned.
+        """
+
+        resp, permit = self._send(remote_relative_url, timing, upstream_request)
+        if cancelled is not None and cancelled.is_set():
+            resp.close()
+            permit.release(resp.status_code not in FAILURE_STATUS_CODES, upstream_latency(timing))
+            return None
+
+        headers = [(name, value) for (name, value) in resp.raw.headers.items() if name.lower() not in EXCLUDED_RESPONSE_HEADERS]
+        try:
+            content = resp.content
+        except requests.RequestException:
+            permit.release(False)
+            raise
+        permit.release(resp.status_code not in FAILURE_STATUS_CODES, upstream_latency(timing))
+        timing.end_phase("download")
+        return resp.status_code, headers, content
+
+    def _pass_through_encoding(self, route : ProxyRoute, content_encoding : str) -> str:
+        """
+        Gets the encoding of an upstream body which is relayed to the client without being decoded, or None if it must be
+        decoded by the gateway. The bodies of cached routes are always decoded, since they may be cached.
+        """
+
+        if not self._pass_through_compression or not route.stream or route.cache is not None or not content_encoding:
+            return None
+        return negotiate_encoding(request.headers.get('Accept-Encoding'), [content_encoding])
+
+    def _cached_response(self, entry : CachedResponse) -> Response:
+        """
+        Creates the response to the current request from a cached response, answering conditional requests.
+
+        The body is only decompressed (or read from the disk cache, chunk by chunk) if it is sent.
+        """
+
+        response = Response(None, entry.status_code, entry.headers).make_conditional(request)
+        if response.status_code == entry.status_code:
+            response.response = entry.body_chunks(self._chunk_size)
+            response.headers['Content-Length'] = str(entry.body_length)
+        return response
+
+    def _request_body_stream(self, headers : dict):
+        """
+        Creates an object which pipes the body of the current request to the remote service.
+
+        The headers sent to the remote service are adjusted so that the transfer encoding is decided by the requests library.
+        """
+
+        if request.content_length is not None:
+            if request.content_length == 0:
+                return None
+            return RequestBodyStream(request.stream, request.content_length, self._chunk_size)
+
+        if 'chunked' in request.headers.get('Transfer-Encoding', '').lower():
+            headers.pop('Transfer-Encoding', None)
+            return iterate_request_body(request.stream, self._chunk_size)
+
+        return None
+
     def __repr__(self):
         return '<FlaskProxy>'
\ No newline at end of file
@@ -0,0 +1,167 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import random
+import threading
+import time
+
+class RetryBudget:
+    """
+    Limits the extra requests (retries and hedges) sent to the remote services, so that they can not multiply the load of a
+    remote service which is already struggling.
+
+    Each request adds ratio to the budget and each extra request takes 1 from it. The budget is also refilled with
+    min_per_second per second, so that extra requests are still possible when there are few requests, and it never holds more
+    than max_balance.
+    """
+
+    def __init__(self, ratio : float, min_per_second : float, max_balance : float = 100.0):
+        self._lock = threading.Lock()
+        self._ratio = ratio
+        self._min_per_second = min_per_second
+        self._max_balance = max_balance
+        self._balance = max_balance
+        self._refilled_at = time.monotonic()
+
+    def deposit(self):
+        with self._lock:
+            self._balance = min(self._max_balance, self._balance + self._ratio)
+
+    def withdraw(self) -> bool:
+        """
+        Takes an extra request from the budget, returning False if the budget is exhausted.
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            self._balance = min(self._max_balance, self._balance + (now - self._refilled_at) * self._min_per_second)
+            self._refilled_at = now
+            if self._balance < 1.0:
+                return False
+            self._balance -= 1.0
+            return True
+
+class HedgeDelay:
+    """
+    The delay after which a request is hedged: a percentile of the recent durations of the requests, taken from a timed group.
+
+    It is recomputed at most once every refresh_interval seconds, and is None (i.e. requests are not hedged) until the window of
+    the group holds at least min_samples durations.
+    """
+
+    def __init__(self, group, percentile : float, min_delay : float, min_samples : int, refresh_interval : float):
+        self._group = group
+        self._percentile = percentile
+        self._min_delay = min_delay
+        self._min_samples = min_samples
+        self._refresh_interval = refresh_interval
+        self._value = None
+        self._computed_at = None
+
+    def get(self) -> float:
+        now = time.monotonic()
+        if self._computed_at is None or now - self._computed_at >= self._refresh_interval:
+            histogram = self._group.get_window_histogram()
+            if histogram.count < self._min_samples:
+                self._value = None
+            else:
+                self._value = max(self._min_delay, histogram.percentile(self._percentile))
+            self._computed_at = now
+        return self._value
+
+class RequestHedging:
+    """
+    Sends idempotent requests with hedging and retries.
+
+    If a request is not answered within its hedge delay, a duplicate request is sent and whichever is answered first wins (the
+    other one is cancelled). Requests which fail with a retryable error are retried after a random (jittered) exponential
+    backoff, up to max_retries times. Both hedges and retries are only sent while the retry budget allows them.
+    """
+
+    COUNTERS = ["requests", "hedges_fired", "hedges_won", "hedges_cancelled", "retries", "budget_exhausted"]
+
+    def __init__(self, budget : RetryBudget, hedge : bool, percentile : float, min_delay : float, max_retries : int, backoff : float, max_backoff : float = 1.0, max_workers : int = 64, min_samples : int = 20, refresh_interval : float = 1.0):
+        self._lock = threading.Lock()
+        self._budget = budget
+        self._hedge = hedge
+        self._percentile = percentile
+        self._min_delay = min_delay
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._min_samples = min_samples
+        self._refresh_interval = refresh_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedging") if hedge else None
+        self._counters = dict.fromkeys(RequestHedging.COUNTERS, 0)
+
+    def create_delay(self, group) -> HedgeDelay:
+        """
+        Creates the hedge delay of the requests measured by a timed group, or None if they are not hedged.
+        """
+
+        if not self._hedge or group is None:
+            return None
+        return HedgeDelay(group, self._percentile, self._min_delay, self._min_samples, self._refresh_interval)
+
+    def call(self, attempt, delay : HedgeDelay = None, retryable : tuple = ()):
+        """
+        Calls attempt, hedging and retrying it as needed, and returns the result of the first successful attempt.
+
+        attempt receives a threading.Event which is set once another attempt has won, in which case its result is discarded.
+        """
+
+        self._budget.deposit()
+        self._count("requests")
+
+        retries = 0
+        while True:
+            try:
+                hedge_delay = None if delay is None else delay.get()
+                if hedge_delay is None:
+                    return attempt(threading.Event())
+                return self._call_hedged(attempt, hedge_delay)
+            except retryable:
+                if retries >= self._max_retries or not self._withdraw():
+                    raise
+            retries += 1
+            self._count("retries")
+            time.sleep(random.uniform(0, min(self._max_backoff, self._backoff * 2 ** retries)))
+
+    def statistics(self) -> dict:
+        with self._lock:
+            return self._counters.copy()
+
+    def clear_statistics(self):
+        with self._lock:
+            self._counters = dict.fromkeys(RequestHedging.COUNTERS, 0)
+
+    def _call_hedged(self, attempt, hedge_delay : float):
+        cancelled = threading.Event()
+        primary = self._executor.submit(attempt, cancelled)
+        done, _ = wait([primary], timeout=hedge_delay)
+        if len(done) > 0 or not self._withdraw():
+            return primary.result()
+
+        hedge = self._executor.submit(attempt, cancelled)
+        self._count("hedges_fired")
+
+        # the first successful attempt wins; if both fail, the last error is raised.
+        pending = {primary, hedge}
+        error = None
+        while len(pending) > 0:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    cancelled.set()
+                    self._count("hedges_won" if future is hedge else "hedges_cancelled")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _withdraw(self) -> bool:
+        if self._budget.withdraw():
+            return True
+        self._count("budget_exhausted")
+        return False
+
+    def _count(self, counter : str):
+        with self._lock:
+            self._counters[counter] += 1
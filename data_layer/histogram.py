@@ -0,0 +1,257 @@
+from array import array
+from bisect import bisect_left
+from collections import Counter
+import math
+import time
+
+PERCENTILES = [50.0, 90.0, 99.0, 99.9]
+
+class LogHistogram:
+    """
+    A histogram with logarithmically sized buckets, which uses a fixed amount of memory regardless of the number of values.
+
+    Each power of two between min_value and max_value is split into buckets_per_octave buckets, so percentiles have a relative
+    error of about 2^(1 / buckets_per_octave) - 1 (about 9% with the default of 8 buckets per octave). Values below min_value and
+    above max_value are counted in two extra buckets.
+    """
+
+    def __init__(self, min_value : float = 1e-6, max_value : float = 1e3, buckets_per_octave : int = 8):
+        self._min_value = min_value
+        self._buckets_per_octave = buckets_per_octave
+        self._bucket_count = int(math.ceil(math.log2(max_value / min_value) * buckets_per_octave)) + 2
+        self._counts = array('Q', bytes(8 * self._bucket_count))
+        self.clear()
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def total(self) -> float:
+        """
+        The sum of all values.
+        """
+
+        return self._sum
+
+    @property
+    def bucket_count(self) -> int:
+        return self._bucket_count
+
+    def clear(self):
+        """
+        Removes all values from the histogram.
+        """
+
+        for i in range(self._bucket_count):
+            self._counts[i] = 0
+        self._count = 0
+        self._sum = 0.0
+        self._min = math.inf
+        self._max = -math.inf
+
+    def record(self, value : float):
+        """
+        Adds a value to the histogram.
+        """
+
+        self._counts[self.bucket_index(value)] += 1
+        self._count += 1
+        self._sum += value
+        if value < self._min:
+            self._min = value
+        if value > self._max:
+            self._max = value
+
+    def record_all(self, values : list, buckets : list):
+        """
+        Adds several values to the histogram, given their buckets (as returned by bucket_indexes).
+        """
+
+        if len(values) == 0:
+            return
+        # the values of a batch are usually in few buckets.
+        for (bucket, count) in Counter(buckets).items():
+            self._counts[bucket] += count
+        self._count += len(values)
+        self._sum += sum(values)
+        self._min = min(self._min, min(values))
+        self._max = max(self._max, max(values))
+
+    def merge(self, other : "LogHistogram"):
+        """
+        Adds all values of another histogram, with the same buckets, to this histogram.
+        """
+
+        self.merge_counts(other._counts, other._count, other._sum, other._min, other._max)
+
+    def merge_counts(self, counts, count : int, total : float, minimum : float, maximum : float):
+        """
+        Adds the values of a histogram with the same buckets, given its bucket counts, number of values, sum, minimum and maximum.
+        """
+
+        if count == 0:
+            return
+        for i in range(self._bucket_count):
+            self._counts[i] += counts[i]
+        self._count += count
+        self._sum += total
+        self._min = min(self._min, minimum)
+        self._max = max(self._max, maximum)
+
+    def percentile(self, percentile : float) -> float:
+        """
+        Estimates the value below which the given percentage of the values lie.
+        """
+
+        if self._count == 0:
+            return None
+
+        rank = max(1, int(math.ceil(self._count * percentile / 100.0)))
+        seen = 0
+        for i in range(self._bucket_count):
+            seen += self._counts[i]
+            if seen >= rank:
+                return min(max(self._bucket_value(i), self._min), self._max)
+        return self._max
+
+    def cumulative_counts(self, upper_bounds : list) -> list:
+        """
+        Counts the values up to each of the given (sorted) upper bounds. Values are attributed to the bucket they fall in.
+        """
+
+        result = []
+        seen = 0
+        i = 0
+        for upper_bound in upper_bounds:
+            while i < self._bucket_count and self._bucket_upper_bound(i) <= upper_bound:
+                seen += self._counts[i]
+                i += 1
+            result.append(seen)
+        return result
+
+    def summary(self) -> dict:
+        """
+        Summarizes the values of the histogram.
+        """
+
+        result = {
+            "count": self._count,
+            "mean": self._sum / self._count if self._count > 0 else None,
+            "min": self._min if self._count > 0 else None,
+            "max": self._max if self._count > 0 else None
+        }
+        for percentile in PERCENTILES:
+            result["p{:g}".format(percentile)] = self.percentile(percentile)
+        return result
+
+    def copy(self) -> "LogHistogram":
+        result = LogHistogram.__new__(LogHistogram)
+        result._min_value = self._min_value
+        result._buckets_per_octave = self._buckets_per_octave
+        result._bucket_count = self._bucket_count
+        result._counts = array('Q', self._counts)
+        result._count = self._count
+        result._sum = self._sum
+        result._min = self._min
+        result._max = self._max
+        return result
+
+    def bucket_index(self, value : float) -> int:
+        if value < self._min_value:
+            return 0
+        index = int(math.log2(value / self._min_value) * self._buckets_per_octave) + 1
+        return min(index, self._bucket_count - 1)
+
+    def bucket_indexes(self, values : list) -> list:
+        min_value = self._min_value
+        buckets_per_octave = self._buckets_per_octave
+        last = self._bucket_count - 1
+        log2 = math.log2
+        result = [0 if value < min_value else int(log2(value / min_value) * buckets_per_octave) + 1 for value in values]
+        if len(result) > 0 and max(result) > last:
+            result = [min(index, last) for index in result]
+        return result
+
+    def _bucket_upper_bound(self, index : int) -> float:
+        if index == self._bucket_count - 1:
+            return math.inf
+        return self._min_value * 2.0 ** (index / self._buckets_per_octave)
+
+    def _bucket_value(self, index : int) -> float:
+        # the geometric mean of the bounds of the bucket.
+        if index == 0:
+            return self._min_value
+        return self._min_value * 2.0 ** ((index - 0.5) / self._buckets_per_octave)
+
+class WindowedHistogram:
+    """
+    A histogram of the values recorded in the last window_seconds seconds.
+
+    The window is split into slices, each one with its own histogram, and the oldest slice is cleared as time goes by.
+    """
+
+    def __init__(self, window_seconds : float, slices : int = 12, **histogram_args):
+        self._slice_seconds = window_seconds / slices
+        self._slices = [LogHistogram(**histogram_args) for _ in range(slices)]
+        self._epochs = [None] * slices
+
+    def clear(self):
+        for histogram in self._slices:
+            histogram.clear()
+        self._epochs = [None] * len(self._slices)
+
+    def record(self, value : float, now : float = None):
+        epoch = int((time.monotonic() if now is None else now) / self._slice_seconds)
+        position = epoch % len(self._slices)
+        if self._is_outdated(position, epoch):
+            return
+        if self._epochs[position] != epoch:
+            self._slices[position].clear()
+            self._epochs[position] = epoch
+        self._slices[position].record(value)
+
+    def _is_outdated(self, position : int, epoch : int) -> bool:
+        """
+        Checks whether values of a given epoch are older than the slice at the given position, so they are out of the window
+        and must not replace its newer values.
+        """
+
+        slice_epoch = self._epochs[position]
+        return slice_epoch is not None and epoch < slice_epoch
+
+    def record_all(self, values : list, timestamps : list, buckets : list):
+        """
+        Adds several values, recorded at the given (non-decreasing) times, given their buckets.
+
+        Values older than the slice they fall in (e.g. the buffered samples of an idle thread, added a whole window later) are
+        dropped.
+        """
+
+        start = 0
+        while start < len(values):
+            epoch = int(timestamps[start] / self._slice_seconds)
+            end = bisect_left(timestamps, (epoch + 1) * self._slice_seconds, start)
+            position = epoch % len(self._slices)
+            if self._is_outdated(position, epoch):
+                start = end
+                continue
+            if self._epochs[position] != epoch:
+                self._slices[position].clear()
+                self._epochs[position] = epoch
+            self._slices[position].record_all(values[start:end], buckets[start:end])
+            start = end
+
+    def snapshot(self, now : float = None) -> LogHistogram:
+        """
+        Merges the slices of the current window into a single histogram.
+        """
+
+        epoch = int((time.monotonic() if now is None else now) / self._slice_seconds)
+        result = self._slices[0].copy()
+        result.clear()
+        for position in range(len(self._slices)):
+            slice_epoch = self._epochs[position]
+            if slice_epoch is not None and epoch - slice_epoch < len(self._slices):
+                result.merge(self._slices[position])
+        return result
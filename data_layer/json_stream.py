@@ -0,0 +1,106 @@
+import codecs
+import json
+import re
+
+WHITESPACE = re.compile(r'\s*')
+DECODER = json.JSONDecoder()
+
+class IncrementalJSONReader:
+    """
+    Reads JSON values one at a time from a document received in chunks of bytes (encoded with UTF-8), so that the elements of a
+    large array can be handled without parsing the whole document at once.
+
+    Only the part of the document which has not been read yet is kept in memory.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._position = 0
+        self._finished = False
+
+    def peek(self) -> str:
+        """
+        Gets the next character which is not whitespace, without consuming it (or an empty string at the end of the document).
+        """
+
+        while True:
+            self._position = WHITESPACE.match(self._buffer, self._position).end()
+            if self._position < len(self._buffer) or not self._read():
+                return self._buffer[self._position:self._position + 1]
+
+    def expect(self, character : str):
+        """
+        Consumes the next character which is not whitespace, which must be the given one.
+        """
+
+        found = self.peek()
+        if found != character:
+            raise ValueError("expected {!r} but found {!r}".format(character, found))
+        self._position += 1
+
+    def value(self):
+        """
+        Reads the next JSON value.
+        """
+
+        self.peek()
+        while True:
+            try:
+                value, end = DECODER.raw_decode(self._buffer, self._position)
+                # a value at the end of the buffer may be incomplete (e.g. a number), unless the document has ended.
+                if end < len(self._buffer) or self._finished:
+                    self._position = end
+                    return value
+            except ValueError:
+                if self._finished:
+                    raise
+            self._read()
+
+    def _read(self) -> bool:
+        if self._finished:
+            return False
+
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            text = self._decoder.decode(b"", final=True)
+            self._finished = True
+        else:
+            text = self._decoder.decode(chunk)
+        self._buffer = self._buffer[self._position:] + text
+        self._position = 0
+        return chunk is not None
+
+def iterate_result_set(chunks):
+    """
+    Parses an AQL result set incrementally, yielding ("row", row) for each element of its "rows" array and (name, value) for
+    each of its other members, in the order they appear in the document.
+    """
+
+    reader = IncrementalJSONReader(chunks)
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+
+    while True:
+        name = reader.value()
+        reader.expect(":")
+        if name == "rows" and reader.peek() == "[":
+            reader.expect("[")
+            if reader.peek() == "]":
+                reader.expect("]")
+            else:
+                while True:
+                    yield ("row", reader.value())
+                    if reader.peek() != ",":
+                        break
+                    reader.expect(",")
+                reader.expect("]")
+        else:
+            yield (name, reader.value())
+
+        if reader.peek() != ",":
+            break
+        reader.expect(",")
+    reader.expect("}")
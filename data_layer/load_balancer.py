@@ -0,0 +1,142 @@
+import random
+import threading
+import time
+
+LEAST_OUTSTANDING = "least_outstanding"
+POWER_OF_TWO_CHOICES = "power_of_two_choices"
+
+class Endpoint:
+    """
+    A replica of a remote service, identified by its base URL.
+    """
+
+    COUNTERS = ["requests", "failures", "ejections"]
+
+    def __init__(self, base_url : str):
+        self.base_url = base_url
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejected_until = None
+        self.counters = dict.fromkeys(Endpoint.COUNTERS, 0)
+
+    def is_ejected(self, now : float) -> bool:
+        return self.ejected_until is not None and now < self.ejected_until
+
+class Lease:
+    """
+    The use of an endpoint by a request, which must be released exactly once.
+    """
+
+    def __init__(self, balancer, endpoint : Endpoint):
+        self._balancer = balancer
+        self.endpoint = endpoint
+        self._released = False
+
+    @property
+    def base_url(self) -> str:
+        return self.endpoint.base_url
+
+    def release(self, success : bool, latency : float = None):
+        """
+        Releases the endpoint, reporting whether the request succeeded.
+        """
+
+        if not self._released:
+            self._released = True
+            self._balancer._release(self.endpoint, success)
+
+class LoadBalancer:
+    """
+    Spreads the requests to a remote service among its replicas.
+
+    With the least_outstanding strategy, each request is sent to the endpoint with the fewest requests in progress; with the
+    power_of_two_choices strategy, to the one with the fewest requests in progress among two endpoints chosen at random.
+
+    Endpoints which fail ejection_failures consecutive requests are ejected (i.e. receive no requests) for ejection_time seconds,
+    unless all other endpoints are also ejected.
+    """
+
+    def __init__(self, base_urls : list, strategy : str = LEAST_OUTSTANDING, ejection_failures : int = 5, ejection_time : float = 30.0):
+        self._lock = threading.Lock()
+        self._endpoints = [Endpoint(base_url) for base_url in base_urls]
+        self._strategy = strategy
+        self._ejection_failures = ejection_failures
+        self._ejection_time = ejection_time
+
+    @property
+    def endpoints(self) -> list:
+        return self._endpoints
+
+    def acquire(self) -> Lease:
+        """
+        Chooses the endpoint of a request.
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            candidates = [endpoint for endpoint in self._endpoints if not endpoint.is_ejected(now)]
+            if len(candidates) == 0:
+                # all endpoints are ejected: the one which was ejected first is tried.
+                candidates = [min(self._endpoints, key=lambda endpoint: endpoint.ejected_until)]
+
+            if self._strategy == POWER_OF_TWO_CHOICES and len(candidates) > 2:
+                candidates = random.sample(candidates, 2)
+            fewest = min(endpoint.outstanding for endpoint in candidates)
+            endpoint = random.choice([endpoint for endpoint in candidates if endpoint.outstanding == fewest])
+
+            endpoint.outstanding += 1
+            endpoint.counters["requests"] += 1
+        return Lease(self, endpoint)
+
+    def _release(self, endpoint : Endpoint, success : bool):
+        with self._lock:
+            endpoint.outstanding -= 1
+            if success:
+                endpoint.consecutive_failures = 0
+                return
+
+            endpoint.counters["failures"] += 1
+            endpoint.consecutive_failures += 1
+            now = time.monotonic()
+            if endpoint.consecutive_failures >= self._ejection_failures and not endpoint.is_ejected(now):
+                endpoint.ejected_until = now + self._ejection_time
+                endpoint.consecutive_failures = 0
+                endpoint.counters["ejections"] += 1
+
+    def statistics(self) -> dict:
+        """
+        Gets the counters, the requests in progress and whether each endpoint is ejected, by base URL.
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            result = {}
+            for endpoint in self._endpoints:
+                statistics = endpoint.counters.copy()
+                statistics["outstanding"] = endpoint.outstanding
+                statistics["ejected"] = endpoint.is_ejected(now)
+                result[endpoint.base_url] = statistics
+            return result
+
+    def clear_statistics(self):
+        with self._lock:
+            for endpoint in self._endpoints:
+                endpoint.counters = dict.fromkeys(Endpoint.COUNTERS, 0)
+
+class SingleEndpoint:
+    """
+    A load balancer with a single endpoint, which is always used.
+    """
+
+    def __init__(self, base_url : str):
+        self._lease = NoLease(base_url)
+
+    def acquire(self):
+        return self._lease
+
+class NoLease:
+    def __init__(self, base_url : str):
+        self.base_url = base_url
+
+    def release(self, success : bool, latency : float = None):
+        pass
@@ -0,0 +1,227 @@
+import math
+import threading
+
+def escape_label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def format_labels(label_names, label_values) -> str:
+    if len(label_names) == 0:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, escape_label_value(value)) for (name, value) in zip(label_names, label_values)) + '}'
+
+def format_value(value) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+class MetricFamily:
+    """
+    A family of metrics with the same name and different label values, in the Prometheus text exposition format.
+
+    The text of the labels of each metric is computed once, when the metric is first used, so rendering only formats the values.
+    """
+
+    def __init__(self, name : str, help_text : str, metric_type : str, label_names : list):
+        self.name = name
+        self._header = '# HELP {} {}\n# TYPE {} {}\n'.format(name, help_text, name, metric_type)
+        self._label_names = label_names
+        self._lock = threading.Lock()
+        self._values = {}
+        self._prefixes = {}
+
+    def inc(self, label_values : tuple, amount : float = 1):
+        with self._lock:
+            if label_values not in self._values:
+                self._add(label_values)
+            self._values[label_values] += amount
+
+    def set(self, label_values : tuple, value : float):
+        with self._lock:
+            if label_values not in self._values:
+                self._add(label_values)
+            self._values[label_values] = value
+
+    def clear(self):
+        with self._lock:
+            for label_values in self._values:
+                self._values[label_values] = 0
+
+    def render(self, lines : list):
+        with self._lock:
+            values = list(self._values.items())
+        lines.append(self._header)
+        for (label_values, value) in values:
+            lines.append(self._prefixes[label_values] + format_value(value) + '\n')
+
+    def _add(self, label_values : tuple):
+        self._values[label_values] = 0
+        self._prefixes[label_values] = self.name + format_labels(self._label_names, label_values) + ' '
+
+class Counter(MetricFamily):
+    def __init__(self, name : str, help_text : str, label_names : list):
+        super().__init__(name, help_text, 'counter', label_names)
+
+class Gauge(MetricFamily):
+    def __init__(self, name : str, help_text : str, label_names : list):
+        super().__init__(name, help_text, 'gauge', label_names)
+
+    def dec(self, label_values : tuple, amount : float = 1):
+        self.inc(label_values, -amount)
+
+class SharedMetricFamily(MetricFamily):
+    """
+    A family of metrics whose values are kept in a SharedCounters object, so that they cover all worker processes of the server.
+
+    The values which do not fit in it are kept by each process, as in MetricFamily.
+    """
+
+    def __init__(self, name : str, help_text : str, metric_type : str, label_names : list, shared):
+        super().__init__(name, help_text, metric_type, label_names)
+        self._shared = shared
+        self._gauge = metric_type == 'gauge'
+        self._indexes = {}
+
+    def inc(self, label_values : tuple, amount : float = 1):
+        index = self._indexes.get(label_values, -1)
+        if index == -1:
+            index = self._shared.register(self.name + format_labels(self._label_names, label_values), self._gauge)
+            self._indexes[label_values] = index
+        if index is None or not self._shared.add(index, amount):
+            super().inc(label_values, amount)
+
+    def render(self, lines : list):
+        prefix = self.name + '{'
+        values = {name: value for (name, value) in self._shared.values() if name == self.name or name.startswith(prefix)}
+        with self._lock:
+            for (label_values, value) in self._values.items():
+                name = self._prefixes[label_values][:-1]
+                values[name] = values.get(name, 0) + value
+        lines.append(self._header)
+        for (name, value) in values.items():
+            lines.append(name + ' ' + format_value(value) + '\n')
+
+class SharedCounter(SharedMetricFamily):
+    def __init__(self, name : str, help_text : str, label_names : list, shared):
+        super().__init__(name, help_text, 'counter', label_names, shared)
+
+class SharedGauge(SharedMetricFamily):
+    def __init__(self, name : str, help_text : str, label_names : list, shared):
+        super().__init__(name, help_text, 'gauge', label_names, shared)
+
+    def dec(self, label_values : tuple, amount : float = 1):
+        self.inc(label_values, -amount)
+
+class HistogramCollector:
+    """
+    Exposes, as Prometheus histograms, LogHistogram objects obtained when the metrics are rendered.
+
+    The function passed to the constructor must return a list of (label values, histogram) pairs.
+    """
+
+    def __init__(self, name : str, help_text : str, label_names : list, upper_bounds : list, collect):
+        self.name = name
+        self._header = '# HELP {} {}\n# TYPE {} histogram\n'.format(name, help_text, name)
+        self._label_names = label_names
+        self._bucket_label_names = label_names + ['le']
+        self._upper_bounds = upper_bounds + [math.inf]
+        self._collect = collect
+        self._prefixes = {}
+
+    def clear(self):
+        pass
+
+    def render(self, lines : list):
+        lines.append(self._header)
+        for (label_values, histogram) in self._collect():
+            bucket_prefixes, sum_prefix, count_prefix = self._get_prefixes(label_values)
+            histogram = histogram.copy()
+            for (prefix, count) in zip(bucket_prefixes, histogram.cumulative_counts(self._upper_bounds)):
+                lines.append(prefix + str(count) + '\n')
+            lines.append(sum_prefix + format_value(histogram.total) + '\n')
+            lines.append(count_prefix + str(histogram.count) + '\n')
+
+    def _get_prefixes(self, label_values : tuple):
+        prefixes = self._prefixes.get(label_values)
+        if prefixes is None:
+            labels = format_labels(self._label_names, label_values)
+            bucket_prefixes = [self.name + '_bucket' + format_labels(self._bucket_label_names, label_values + (format_value(upper_bound),)) + ' ' for upper_bound in self._upper_bounds]
+            prefixes = (bucket_prefixes, self.name + '_sum' + labels + ' ', self.name + '_count' + labels + ' ')
+            self._prefixes[label_values] = prefixes
+        return prefixes
+
+class CounterCollector:
+    """
+    Exposes, as Prometheus counters, values obtained when the metrics are rendered.
+
+    The function passed to the constructor must return a list of (label values, value) pairs.
+    """
+
+    metric_type = 'counter'
+
+    def __init__(self, name : str, help_text : str, label_names : list, collect):
+        self.name = name
+        self._header = '# HELP {} {}\n# TYPE {} {}\n'.format(name, help_text, name, self.metric_type)
+        self._label_names = label_names
+        self._collect = collect
+        self._prefixes = {}
+
+    def clear(self):
+        pass
+
+    def render(self, lines : list):
+        lines.append(self._header)
+        for (label_values, value) in self._collect():
+            prefix = self._prefixes.get(label_values)
+            if prefix is None:
+                prefix = self.name + format_labels(self._label_names, label_values) + ' '
+                self._prefixes[label_values] = prefix
+            lines.append(prefix + format_value(value) + '\n')
+
+class GaugeCollector(CounterCollector):
+    """
+    Exposes, as Prometheus gauges, values obtained when the metrics are rendered.
+    """
+
+    metric_type = 'gauge'
+
+class MetricsRegistry:
+    """
+    A set of metric families rendered together in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self._families = []
+
+    def register(self, family):
+        self._families.append(family)
+        return family
+
+    def render(self) -> str:
+        lines = []
+        for family in self._families:
+            family.render(lines)
+        return ''.join(lines)
+
+class ProxyMetrics:
+    """
+    The metrics of the requests redirected by proxies: a counter of requests and a gauge of requests in flight.
+
+    If shared (a SharedCounters object) is given, the metrics cover all worker processes.
+    """
+
+    def __init__(self, registry : MetricsRegistry, shared=None):
+        if shared is None:
+            self._requests = registry.register(Counter("gateway_proxied_requests_total", "Requests redirected to remote APIs.", ["route", "method", "backend", "status"]))
+            self._in_flight = registry.register(Gauge("gateway_proxied_requests_in_flight", "Requests currently being redirected to remote APIs.", ["backend"]))
+        else:
+            self._requests = registry.register(SharedCounter("gateway_proxied_requests_total", "Requests redirected to remote APIs.", ["route", "method", "backend", "status"], shared))
+            self._in_flight = registry.register(SharedGauge("gateway_proxied_requests_in_flight", "Requests currently being redirected to remote APIs.", ["backend"], shared))
+
+    def request_started(self, backend : str):
+        self._in_flight.inc((backend,))
+
+    def request_finished(self, backend : str, route : str, method : str, status):
+        self._in_flight.dec((backend,))
+        self._requests.inc((route, method, backend, str(status)))
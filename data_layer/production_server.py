@@ -0,0 +1,46 @@
+from gunicorn.app.base import BaseApplication
+
+class ProductionServer(BaseApplication):
+    """
+    Runs an application under Gunicorn, a pre-forking multi-process server.
+
+    The options are the same as the ones accepted by Gunicorn's configuration file.
+    """
+
+    def __init__(self, application, options : dict):
+        self._application = application
+        self._options = options
+        super().__init__()
+
+    def load_config(self):
+        for (key, value) in self._options.items():
+            if value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        return self._application
+
+def run(application, port : int, workers : int, threads : int, keepalive : int, backlog : int, graceful_timeout : int, max_requests : int, max_requests_jitter : int, asgi : bool = False, certificate_path : str = None, key_path : str = None):
+    """
+    Runs a WSGI (or, if asgi is True, ASGI) application with the given number of worker processes.
+
+    Sending SIGHUP to the main process gracefully reloads all workers, which are given up to graceful_timeout seconds to finish
+    the requests they are handling. If max_requests is not 0, each worker is also gracefully restarted after handling that many
+    requests (plus a random amount up to max_requests_jitter).
+    """
+
+    options = {
+        "bind": "0.0.0.0:{}".format(port),
+        "workers": workers,
+        "worker_class": "uvicorn.workers.UvicornWorker" if asgi else "gthread",
+        "threads": threads,
+        "keepalive": keepalive,
+        "backlog": backlog,
+        "graceful_timeout": graceful_timeout,
+        "max_requests": max_requests,
+        "max_requests_jitter": max_requests_jitter,
+        "certfile": certificate_path,
+        "keyfile": key_path
+    }
+
+    ProductionServer(application, options).run()
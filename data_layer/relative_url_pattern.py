@@ -2,6 +2,14 @@ import re
 
 path_pattern_regex = re.compile(r"^((?:\/(?:(?:[^\/%?#=<>]|%[a-zA-Z0-9]{2})+|<[a-zA-Z_][a-zA-Z0-9_]*>))+\/?|\/)(?:\?((?:[^\/%?#=<>]|%[a-zA-Z0-9]{2})+=<[a-zA-Z_][a-zA-Z0-9_]*>(?:&(?:[^\/%?#=<>]|%[a-zA-Z0-9]{2})+=<[a-zA-Z_][a-zA-Z0-9_]*>)*))?$")
 
+class PlaceholderKeepingDict(dict):
+    """
+    A dictionary used when formatting paths, which keeps the placeholders of the variables without values.
+    """
+
+    def __missing__(self, key):
+        return '<' + key + '>'
+
 class RelativeURLPattern:
     """
     A pattern that may be used to match relative URL.
@@ -46,49 +54,63 @@ class RelativeURLPattern:
                     'name': query_element_name
                 }
 
+        self._compile()
+
+    def _compile(self):
+        """
+        Precomputes the indexes and the URL template used when translating requests, so that they do not scan the variables.
+        """
+
+        self._path_variables = [name for name in self._variables if self._variables[name]['where'] == 'path']
+        self._query_string_variables = [name for name in self._variables if self._variables[name]['where'] == 'querystring']
+
+        # reverse index from query string keys to variable names.
+        self._query_string_keys = {self._variables[name]['name']: name for name in self._query_string_variables}
+
+        # the path is a format string whose fields are the path variables.
+        path_format_elements = []
+        for path_element in self._path_elements:
+            if len(path_element) > 0 and path_element[0] == '<':
+                path_format_elements.append('{' + path_element[1:-1] + '}')
+            else:
+                path_format_elements.append(path_element.replace('{', '{{').replace('}', '}}'))
+        self._path_format = '/' + '/'.join(path_format_elements)
+
+        self._query_slots = [(name, self._variables[name]['name'] + '=') for name in self._query_string_variables]
+
     @property
     def path_pattern(self):
         return self._path_pattern
 
     @property
     def path_variables(self):
-        result = []
-        for variable_name in self._variables:
-            variable = self._variables[variable_name]
-            if variable['where'] == 'path':
-                result.append(variable_name)
-        return result
+        return self._path_variables
 
     @property
     def query_string_variables(self):
-        result = []
-        for variable_name in self._variables:
-            variable = self._variables[variable_name]
-            if variable['where'] == 'querystring':
-                result.append(variable_name)
-        return result
+        return self._query_string_variables
+
+    @property
+    def query_string_keys(self):
+        """
+        A dictionary which maps the keys of the query string to the names of their variables.
+        """
+
+        return self._query_string_keys
 
     def query_string_variable_from_key(self, key):
-        for variable_name in self._variables:
-            variable = self._variables[variable_name]
-            if variable['where'] == 'querystring' and variable['name'] == key:
-                return variable_name
-        return None
+        return self._query_string_keys.get(key)
 
     def replace(self, **kwargs):
-        path_elements = self._path_elements[:]
-        query_values = {}
-        for variable_name in kwargs:
-            if variable_name in self._variables:
-                variable = self._variables[variable_name]
-                if variable['where'] == 'querystring':
-                    query_values[variable['name']] = kwargs[variable_name]
-                if variable['where'] == 'path':
-                    path_elements[variable['index']] = kwargs[variable_name]
-        result = '/' + '/'.join(path_elements)
-        if len(query_values) > 0:
-            result += '?' + \
-                '&'.join((x + '=' + query_values[x]) for x in query_values)
+        try:
+            result = self._path_format.format_map(kwargs)
+        except KeyError:
+            # path variables without values are kept as-is.
+            result = self._path_format.format_map(PlaceholderKeepingDict(kwargs))
+
+        query = '&'.join([prefix + kwargs[name] for (name, prefix) in self._query_slots if name in kwargs])
+        if query:
+            result += '?' + query
         return result
 
     def __repr__(self):
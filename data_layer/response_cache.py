@@ -0,0 +1,193 @@
+from collections import OrderedDict
+import threading
+import time
+import zlib
+
+from .tag_generations import TagGenerations
+
+class CachedResponse:
+    """
+    A response of a remote service kept in a cache.
+
+    If compressed is True, the body is kept compressed and only decompressed when it is used.
+    """
+
+    def __init__(self, status_code : int, headers : list, body : bytes, compressed : bool = False):
+        self.status_code = status_code
+        self.headers = headers
+        self.compressed = compressed
+        self._body = zlib.compress(body) if compressed else body
+        self.body_length = len(body)
+        self.expires_at = None
+        self.tags = ()
+        self.stamp = None
+
+        # the approximate amount of memory used by the response, in bytes.
+        self.size = len(self._body) + sum(len(name) + len(value) for (name, value) in headers)
+
+    @property
+    def body(self) -> bytes:
+        if self.compressed:
+            return zlib.decompress(self._body)
+        return self._body
+
+    def body_chunks(self, chunk_size : int) -> list:
+        # the body is kept in memory as a whole, so it is sent at once.
+        return [self.body]
+
+def hit_rate(statistics : dict) -> float:
+    """
+    Gets the fraction of the lookups of a cache which were hits.
+    """
+
+    lookups = statistics["hits"] + statistics["misses"]
+    return 0.0 if lookups == 0 else statistics["hits"] / lookups
+
+class ResponseCache:
+    """
+    A bounded in-memory cache of responses, which evicts the least recently used responses when it is full.
+
+    The cache holds at most max_entries responses and max_bytes bytes. Responses larger than max_entry_bytes are not cached.
+    If ttl is given, responses expire that many seconds after being stored. If compress is True, the bodies of the responses
+    are compressed, and the limits apply to the compressed bodies.
+
+    Responses may be stored with tags, so that all responses with a tag can be invalidated at once. If generations (a
+    TagGenerations object) is given, the invalidations made by any worker process which shares it also apply to this cache: the
+    stale responses are removed when they are looked up.
+    """
+
+    COUNTERS = ["hits", "misses", "stores", "evictions", "expirations", "invalidations"]
+
+    def __init__(self, max_entries : int, max_bytes : int, max_entry_bytes : int, ttl : float = None, compress : bool = False, generations : TagGenerations = None):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._max_entry_bytes = max_entry_bytes
+        self._ttl = ttl
+        self.compress = compress
+        self._generations = generations
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._size = 0
+        self._counters = dict.fromkeys(ResponseCache.COUNTERS, 0)
+
+    @property
+    def max_entry_bytes(self) -> int:
+        return self._max_entry_bytes
+
+    def get(self, key) -> CachedResponse:
+        """
+        Gets the response stored with a key, or None if there is none.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at is not None and time.monotonic() >= entry.expires_at:
+                self._remove(key)
+                self._counters["expirations"] += 1
+                entry = None
+            if entry is not None and entry.stamp is not None and not self._generations.is_current(entry.stamp):
+                self._remove(key)
+                self._counters["invalidations"] += 1
+                entry = None
+
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return entry
+
+    def stamp(self, tags : list) -> tuple:
+        """
+        Gets the stamp of the response of a request with the given tags, which must be taken before the request is sent (so
+        that the response is not stored if the tags are invalidated meanwhile), or None if the cache has no generations.
+        """
+
+        if self._generations is None:
+            return None
+        return self._generations.stamp(tags)
+
+    def put(self, key, entry : CachedResponse, tags : list = (), stamp : tuple = None):
+        """
+        Stores a response, evicting the least recently used responses if needed.
+
+        If the stamp taken before the response was requested is given, the response is only stored if its tags were not
+        invalidated since then.
+        """
+
+        size = entry.size
+        if size > self._max_entry_bytes or size > self._max_bytes:
+            return
+        if self._generations is not None:
+            if stamp is None:
+                stamp = self._generations.stamp(tags)
+            elif not self._generations.is_current(stamp):
+                return
+        entry.stamp = stamp
+
+        if self._ttl is not None:
+            entry.expires_at = time.monotonic() + self._ttl
+        entry.tags = tuple(tags)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = entry
+            self._size += size
+            for tag in entry.tags:
+                self._tags.setdefault(tag, set()).add(key)
+            self._counters["stores"] += 1
+
+            while len(self._entries) > self._max_entries or self._size > self._max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._counters["evictions"] += 1
+
+    def invalidate(self, tag):
+        """
+        Removes all responses stored with a tag (in all processes, if the cache has generations).
+        """
+
+        if self._generations is not None:
+            self._generations.advance(tag)
+        with self._lock:
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+                self._counters["invalidations"] += 1
+
+    def clear(self):
+        """
+        Removes all responses from the cache.
+        """
+
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._size = 0
+
+    def statistics(self) -> dict:
+        """
+        Gets the counters of the cache and its hit rate, along with the number of responses it holds and their size.
+        """
+
+        with self._lock:
+            result = self._counters.copy()
+            result["hit_rate"] = hit_rate(result)
+            result["entries"] = len(self._entries)
+            result["bytes"] = self._size
+            return result
+
+    def clear_statistics(self):
+        with self._lock:
+            self._counters = dict.fromkeys(ResponseCache.COUNTERS, 0)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._size -= entry.size
+        for tag in entry.tags:
+            keys = self._tags[tag]
+            keys.discard(key)
+            if len(keys) == 0:
+                del self._tags[tag]
@@ -0,0 +1,573 @@
+from array import array
+from bisect import bisect_left
+from collections import Counter
+import atexit
+import logging
+import mmap
+import multiprocessing
+import os
+import threading
+import time
+
+from .histogram import LogHistogram
+from .time_measurement import OUTCOMES, OUTCOME_INDEXES, SUCCESS, TimedGroup, Timed
+
+# the layout of the shared memory, in 8-byte words: a header, the directory of group names, the directory of blocks and the
+# blocks themselves, each one holding the measurements of a group by a worker process.
+HEADER_WORDS = 8
+GENERATION_WORD = 0
+USED_WORDS_WORD = 1
+GROUP_COUNT_WORD = 2
+BLOCK_COUNT_WORD = 3
+
+NAME_BYTES = 128
+
+# the words of the header of each block, which ends with the number of samples of each outcome.
+BLOCK_OWNER = 0
+BLOCK_GENERATION = 1
+BLOCK_GROUP = 2
+BLOCK_OUTCOMES = 4
+BLOCK_HEADER_WORDS = 8
+
+# the words of each histogram record: the number of values, their sum, minimum and maximum, and the bucket counts.
+RECORD_COUNT = 0
+RECORD_SUM = 1
+RECORD_MIN = 2
+RECORD_MAX = 3
+RECORD_HEADER_WORDS = 4
+
+logger = logging.getLogger(__name__)
+
+# the interval (in seconds) at which the samples buffered by the threads of each worker process are written to shared memory.
+SHARED_FLUSH_INTERVAL = 1.0
+
+def is_alive(pid : int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class SharedMemory:
+    """
+    A shared memory segment which holds the measurements of all worker processes of the server.
+
+    It must be created before the worker processes are forked (i.e. when the application is imported), so that all of them map
+    the same segment. Each worker process only writes to its own blocks, so recording a value takes no lock shared with other
+    processes; the lock is only taken to register groups and to allocate blocks. Readers merge the blocks of all processes.
+
+    Clearing the measurements increments a generation counter: the blocks of older generations are ignored by readers, and reset
+    by their owners before their next write.
+    """
+
+    def __init__(self, size : int, max_groups : int, block_words : int):
+        self._lock = multiprocessing.Lock()
+        self.max_groups = max_groups
+        self.block_words = block_words
+
+        self._names_offset = HEADER_WORDS * 8
+        self._blocks_word = HEADER_WORDS + max_groups * NAME_BYTES // 8
+        self._map(size)
+
+    def _map(self, size : int, previous : mmap.mmap = None):
+        self._memory = mmap.mmap(-1, size)
+        if previous is not None:
+            self._memory[:self._blocks_word * 8] = previous[:self._blocks_word * 8]
+        self._words = memoryview(self._memory).cast("Q")
+        self._floats = memoryview(self._memory).cast("d")
+        self.max_blocks = max(0, (size // 8 - self._blocks_word) // (self.block_words + 1))
+        self._first_block_word = self._blocks_word + self.max_blocks
+        self._words[USED_WORDS_WORD] = self._first_block_word
+
+    def reserve(self, block_count : int) -> bool:
+        """
+        Enlarges the segment so that it holds at least the given number of blocks. It must be called before the worker processes
+        are forked and before any block is allocated; returns whether the segment holds that many blocks.
+        """
+
+        with self._lock:
+            if block_count <= self.max_blocks:
+                return True
+            if self._words[BLOCK_COUNT_WORD] > 0:
+                return False
+            self._map((self._blocks_word + block_count * (self.block_words + 1)) * 8, self._memory)
+            return True
+
+    @property
+    def words(self) -> memoryview:
+        return self._words
+
+    @property
+    def floats(self) -> memoryview:
+        return self._floats
+
+    @property
+    def generation(self) -> int:
+        return self._words[GENERATION_WORD]
+
+    def next_generation(self):
+        with self._lock:
+            self._words[GENERATION_WORD] += 1
+
+    def group_names(self) -> list:
+        return [self._read_name(index) for index in range(self._words[GROUP_COUNT_WORD])]
+
+    def register_group(self, name : str) -> int:
+        """
+        Gets the index of a group, registering it if needed, or None if there is no room for more groups.
+        """
+
+        encoded = name.encode("utf-8")[:NAME_BYTES]
+        name = encoded.decode("utf-8", "ignore")
+        with self._lock:
+            count = self._words[GROUP_COUNT_WORD]
+            for index in range(count):
+                if self._read_name(index) == name:
+                    return index
+            if count >= self.max_groups:
+                return None
+            offset = self._names_offset + count * NAME_BYTES
+            self._memory[offset:offset + NAME_BYTES] = encoded.ljust(NAME_BYTES, b"\0")
+            self._words[GROUP_COUNT_WORD] = count + 1
+            return count
+
+    def allocate_block(self, group : int, pid : int) -> int:
+        """
+        Gets the first word of the block of a group owned by a process, or None if the memory is full.
+
+        The blocks of processes which have exited (e.g. workers restarted after max_requests) are taken over, along with their
+        measurements, so the memory used does not grow as workers are replaced.
+        """
+
+        with self._lock:
+            adoptable = None
+            for block in self.blocks():
+                if self._words[block + BLOCK_GROUP] != group:
+                    continue
+                owner = self._words[block + BLOCK_OWNER]
+                if owner == pid:
+                    return block
+                if adoptable is None and not is_alive(owner):
+                    adoptable = block
+            if adoptable is not None:
+                self._words[adoptable + BLOCK_OWNER] = pid
+                return adoptable
+
+            count = self._words[BLOCK_COUNT_WORD]
+            block = self._words[USED_WORDS_WORD]
+            if count >= self.max_blocks:
+                return None
+            self._words[block:block + self.block_words] = memoryview(bytes(self.block_words * 8)).cast("Q")
+            self._words[block + BLOCK_OWNER] = pid
+            self._words[block + BLOCK_GENERATION] = self._words[GENERATION_WORD]
+            self._words[block + BLOCK_GROUP] = group
+            self._words[self._blocks_word + count] = block
+            self._words[USED_WORDS_WORD] = block + self.block_words
+            self._words[BLOCK_COUNT_WORD] = count + 1
+            return block
+
+    def blocks(self) -> list:
+        return [self._words[self._blocks_word + index] for index in range(self._words[BLOCK_COUNT_WORD])]
+
+    def group_blocks(self, group : int) -> list:
+        """
+        Gets the blocks of a group which belong to the current generation.
+        """
+
+        generation = self._words[GENERATION_WORD]
+        return [block for block in self.blocks() if self._words[block + BLOCK_GROUP] == group and self._words[block + BLOCK_GENERATION] == generation]
+
+    def _read_name(self, index : int) -> str:
+        offset = self._names_offset + index * NAME_BYTES
+        return bytes(self._memory[offset:offset + NAME_BYTES]).rstrip(b"\0").decode("utf-8", "ignore")
+
+# the layout of the shared memory of counters, in 8-byte words: a header, the directory of names (along with whether each one is
+# a gauge), the owners of the rows and the rows of values, one for each process.
+COUNTERS_HEADER_WORDS = 8
+NAME_COUNT_WORD = 0
+ROW_COUNT_WORD = 1
+
+COUNTER_NAME_BYTES = 256
+
+class SharedCounters:
+    """
+    The values of counters and gauges shared by all worker processes of the server, identified by their names.
+
+    It must be created before the worker processes are forked. Each process adds to its own row of values, so updating a value
+    takes no lock shared with other processes; the lock is only taken to register names and rows. Readers add up the rows of all
+    processes, except the gauges of processes which have exited, which are reset when their rows are taken over.
+    """
+
+    def __init__(self, max_names : int, max_processes : int = 256):
+        self.max_names = max_names
+        self.max_processes = max_processes
+        self._names_offset = COUNTERS_HEADER_WORDS * 8
+        self._gauges_word = COUNTERS_HEADER_WORDS + max_names * COUNTER_NAME_BYTES // 8
+        self._owners_word = self._gauges_word + max_names
+        self._values_word = self._owners_word + max_processes
+        self._memory = mmap.mmap(-1, (self._values_word + max_processes * max_names) * 8)
+        self._words = memoryview(self._memory).cast("Q")
+        self._floats = memoryview(self._memory).cast("d")
+        self._lock = multiprocessing.Lock()
+        self._local_lock = threading.Lock()
+        self._pid = None
+        self._row = None
+
+    def register(self, name : str, gauge : bool = False) -> int:
+        """
+        Gets the index of a value, registering it if needed, or None if there is no room for more values.
+        """
+
+        encoded = name.encode("utf-8")[:COUNTER_NAME_BYTES]
+        with self._lock:
+            count = self._words[NAME_COUNT_WORD]
+            for index in range(count):
+                if self._read_name(index) == encoded:
+                    return index
+            if count >= self.max_names:
+                return None
+            offset = self._names_offset + count * COUNTER_NAME_BYTES
+            self._memory[offset:offset + COUNTER_NAME_BYTES] = encoded.ljust(COUNTER_NAME_BYTES, b"\0")
+            self._words[self._gauges_word + count] = 1 if gauge else 0
+            self._words[NAME_COUNT_WORD] = count + 1
+            return count
+
+    def add(self, index : int, amount : float) -> bool:
+        """
+        Adds an amount to a value in the row of this process. Returns False if there is no room for the row.
+        """
+
+        with self._local_lock:
+            row = self._own_row()
+            if row is None:
+                return False
+            self._floats[row + index] += amount
+            return True
+
+    def values(self) -> list:
+        """
+        Gets the (name, value) pairs of all values registered so far, added up for all processes.
+        """
+
+        count = self._words[NAME_COUNT_WORD]
+        gauges = self._words[self._gauges_word:self._gauges_word + count].tolist()
+        totals = [0.0] * count
+        for row_index in range(self._words[ROW_COUNT_WORD]):
+            alive = is_alive(self._words[self._owners_word + row_index])
+            row = self._values_word + row_index * self.max_names
+            for (index, value) in enumerate(self._floats[row:row + count].tolist()):
+                if alive or not gauges[index]:
+                    totals[index] += value
+        return [(self._read_name(index).decode("utf-8", "ignore"), totals[index]) for index in range(count)]
+
+    def _own_row(self) -> int:
+        """
+        Gets the first word of the row of this process (taking over the row of a process which has exited, if any), or None if
+        there is no room for it.
+        """
+
+        pid = os.getpid()
+        if self._pid == pid:
+            return self._row
+        self._pid = pid
+        self._row = None
+        with self._lock:
+            rows = self._words[ROW_COUNT_WORD]
+            chosen = None
+            for row_index in range(rows):
+                owner = self._words[self._owners_word + row_index]
+                if owner == pid:
+                    chosen = row_index
+                    break
+                if chosen is None and not is_alive(owner):
+                    chosen = row_index
+            if chosen is None:
+                if rows >= self.max_processes:
+                    return None
+                chosen = rows
+                self._words[ROW_COUNT_WORD] = rows + 1
+            self._words[self._owners_word + chosen] = pid
+            row = self._values_word + chosen * self.max_names
+            for index in range(self._words[NAME_COUNT_WORD]):
+                if self._words[self._gauges_word + index]:
+                    self._floats[row + index] = 0.0
+            self._row = row
+            return row
+
+    def _read_name(self, index : int) -> bytes:
+        offset = self._names_offset + index * COUNTER_NAME_BYTES
+        return bytes(self._memory[offset:offset + COUNTER_NAME_BYTES]).rstrip(b"\0")
+
+class SharedTimedGroup(TimedGroup):
+    """
+    A timed group whose measurements are stored in shared memory, so that they are reported for all worker processes.
+
+    Each block holds the outcome counts, a lifetime histogram, the slices of the window histogram and a ring of raw samples. If
+    the shared memory is full, the measurements of this process are kept in process-local memory instead.
+
+    Samples are recorded without locks in the buffers of the threads (as in TimedGroup), which are written to the block as
+    batches when they are full or read in this process, and every SHARED_FLUSH_INTERVAL seconds (see SharedTimed). Readers in
+    other processes thus see the samples of this process at most SHARED_FLUSH_INTERVAL seconds late.
+    """
+
+    def __init__(self, shared : SharedMemory, group : int, max_samples : int, window_seconds : float, slices : int, bucket_count : int):
+        self._shared = shared
+        self._group = group
+        self._max_samples = max_samples
+        self._window_seconds = window_seconds
+        self._slices = slices
+        self._slice_seconds = window_seconds / slices
+        self._bucket_count = bucket_count
+        self._record_words = RECORD_HEADER_WORDS + bucket_count
+        self._histogram = LogHistogram()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._buffers = []
+        self._pid = None
+        self._block = None
+        self._fallback = None
+        # the samples buffered before the worker processes are forked are only written by the process which recorded them, and
+        # the samples still buffered when a process exits are written before it does.
+        os.register_at_fork(after_in_child=self._forget_buffers)
+        atexit.register(self.flush)
+
+    @staticmethod
+    def block_words(max_samples : int, slices : int, bucket_count : int) -> int:
+        record_words = RECORD_HEADER_WORDS + bucket_count
+        return BLOCK_HEADER_WORDS + record_words + slices * (1 + record_words) + 1 + max_samples
+
+    def _add_batch(self, values : list, timestamps : list, outcomes : array):
+        block = self._own_block()
+        if block is None:
+            fallback = self._get_fallback()
+            with fallback._lock:
+                fallback._add_batch(values, timestamps, outcomes)
+            return
+
+        words = self._shared.words
+        floats = self._shared.floats
+        if words[block + BLOCK_GENERATION] != self._shared.generation:
+            self._reset(block)
+
+        for index in range(len(OUTCOMES)):
+            words[block + BLOCK_OUTCOMES + index] += outcomes.count(index)
+        buckets = self._histogram.bucket_indexes(values)
+        self._record_all(block + BLOCK_HEADER_WORDS, values, buckets)
+
+        # the samples are added to the slices of their epochs (which start at 1, as empty slices have an epoch of 0); samples
+        # older than their slice are dropped, as in WindowedHistogram.
+        start = 0
+        while start < len(values):
+            epoch = int(timestamps[start] / self._slice_seconds) + 1
+            end = bisect_left(timestamps, epoch * self._slice_seconds, start)
+            position = block + BLOCK_HEADER_WORDS + self._record_words + (epoch % self._slices) * (1 + self._record_words)
+            if words[position] <= epoch:
+                if words[position] != epoch:
+                    words[position:position + 1 + self._record_words] = memoryview(bytes((1 + self._record_words) * 8)).cast("Q")
+                    words[position] = epoch
+                self._record_all(position + 1, values[start:end], buckets[start:end])
+            start = end
+
+        if self._max_samples > 0:
+            ring = block + BLOCK_HEADER_WORDS + self._record_words + self._slices * (1 + self._record_words)
+            written = words[ring]
+            for value in values[-self._max_samples:]:
+                floats[ring + 1 + written % self._max_samples] = value
+                written += 1
+            words[ring] = written
+
+    def get_samples(self) -> list:
+        self.flush()
+        words = self._shared.words
+        floats = self._shared.floats
+        result = []
+        if self._max_samples > 0:
+            for block in self._shared.group_blocks(self._group):
+                ring = block + BLOCK_HEADER_WORDS + self._record_words + self._slices * (1 + self._record_words)
+                written = words[ring]
+                if written <= self._max_samples:
+                    result.extend(floats[ring + 1:ring + 1 + written])
+                else:
+                    start = written % self._max_samples
+                    result.extend(floats[ring + 1 + start:ring + 1 + self._max_samples])
+                    result.extend(floats[ring + 1:ring + 1 + start])
+        if self._fallback is not None:
+            result.extend(self._fallback.get_samples())
+        return result
+
+    def get_lifetime_summary(self) -> dict:
+        self.flush()
+        summary = self.get_lifetime_histogram().summary()
+        words = self._shared.words
+        outcomes = dict.fromkeys(OUTCOMES, 0)
+        for block in self._shared.group_blocks(self._group):
+            for (index, outcome) in enumerate(OUTCOMES):
+                outcomes[outcome] += words[block + BLOCK_OUTCOMES + index]
+        if self._fallback is not None:
+            for (outcome, count) in self._fallback.get_lifetime_summary()["outcomes"].items():
+                outcomes[outcome] += count
+        summary["outcomes"] = outcomes
+        return summary
+
+    def get_lifetime_histogram(self) -> LogHistogram:
+        self.flush()
+        result = LogHistogram()
+        for block in self._shared.group_blocks(self._group):
+            self._merge(result, block + BLOCK_HEADER_WORDS)
+        if self._fallback is not None:
+            result.merge(self._fallback.get_lifetime_histogram())
+        return result
+
+    def get_window_summary(self) -> dict:
+        return self.get_window_histogram().summary()
+
+    def get_window_histogram(self) -> LogHistogram:
+        self.flush()
+        epoch = int(time.monotonic() / self._slice_seconds) + 1
+        words = self._shared.words
+        result = LogHistogram()
+        for block in self._shared.group_blocks(self._group):
+            for index in range(self._slices):
+                position = block + BLOCK_HEADER_WORDS + self._record_words + index * (1 + self._record_words)
+                slice_epoch = words[position]
+                if slice_epoch != 0 and epoch - slice_epoch < self._slices:
+                    self._merge(result, position + 1)
+        if self._fallback is not None:
+            result.merge(self._fallback.get_window_histogram())
+        return result
+
+    def clear(self):
+        """
+        Clears the measurements of this process which are not stored in shared memory (the shared ones are cleared for all
+        processes by SharedTimed.clear_all).
+        """
+
+        with self._lock:
+            for buffer in self._buffers:
+                buffer.flushed = buffer.written
+            if self._fallback is not None:
+                self._fallback.clear()
+
+    def flush(self):
+        """
+        Writes the samples buffered by the threads of this process to shared memory.
+        """
+
+        with self._lock:
+            self._flush_all()
+
+    def _forget_buffers(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._buffers = []
+
+    def _own_block(self) -> int:
+        pid = os.getpid()
+        if self._pid != pid:
+            # the group may have been created before the worker processes were forked.
+            self._pid = pid
+            self._block = self._shared.allocate_block(self._group, pid)
+            self._fallback = None
+        return self._block
+
+    def _get_fallback(self) -> TimedGroup:
+        if self._fallback is None:
+            logger.warning("the shared memory of the usage statistics is full: the measurements of %s are only kept by process %d "
+                "(increase USAGE_STATISTICS_SHARED_MEMORY)", self._shared.group_names()[self._group], self._pid)
+            self._fallback = TimedGroup(self._max_samples, self._window_seconds)
+        return self._fallback
+
+    def _reset(self, block : int):
+        words = self._shared.words
+        start = block + BLOCK_OUTCOMES
+        end = block + self._shared.block_words
+        words[start:end] = memoryview(bytes((end - start) * 8)).cast("Q")
+        words[block + BLOCK_GENERATION] = self._shared.generation
+
+    def _record_all(self, record : int, values : list, buckets : list):
+        words = self._shared.words
+        floats = self._shared.floats
+        count = words[record + RECORD_COUNT]
+        minimum = min(values)
+        maximum = max(values)
+        if count == 0 or minimum < floats[record + RECORD_MIN]:
+            floats[record + RECORD_MIN] = minimum
+        if count == 0 or maximum > floats[record + RECORD_MAX]:
+            floats[record + RECORD_MAX] = maximum
+        floats[record + RECORD_SUM] += sum(values)
+        for (bucket, bucket_count) in Counter(buckets).items():
+            words[record + RECORD_HEADER_WORDS + bucket] += bucket_count
+        words[record + RECORD_COUNT] = count + len(values)
+
+    def _merge(self, histogram : LogHistogram, record : int):
+        words = self._shared.words
+        floats = self._shared.floats
+        counts = words[record + RECORD_HEADER_WORDS:record + RECORD_HEADER_WORDS + self._bucket_count]
+        histogram.merge_counts(counts, words[record + RECORD_COUNT], floats[record + RECORD_SUM], floats[record + RECORD_MIN], floats[record + RECORD_MAX])
+
+class SharedTimed(Timed):
+    """
+    Timed measurements shared by all worker processes of the server, stored in a shared memory segment of the given size.
+
+    It must be created before the worker processes are forked. Each worker process writes the samples buffered by its threads
+    every SHARED_FLUSH_INTERVAL seconds, in a thread started when it is forked.
+    """
+
+    def __init__(self, max_samples : int, window_seconds : float, size : int, max_groups : int = 1024, slices : int = 12):
+        super().__init__(max_samples, window_seconds)
+        self._slices = slices
+        self._bucket_count = LogHistogram().bucket_count
+        self._shared = SharedMemory(size, max_groups, SharedTimedGroup.block_words(max_samples, slices, self._bucket_count))
+        os.register_at_fork(after_in_child=self._start_flushing)
+
+    def _start_flushing(self):
+        threading.Thread(target=self._flush_periodically, name="shared_statistics_flush", daemon=True).start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(SHARED_FLUSH_INTERVAL)
+            for group in list(self._groups.values()):
+                if isinstance(group, SharedTimedGroup):
+                    group.flush()
+
+    def reserve(self, processes : int):
+        """
+        Enlarges the shared memory so that it holds the measurements of the groups created so far for the given number of
+        processes. It must be called before the worker processes are forked and before any sample is written.
+        """
+
+        block_count = len(self._shared.group_names()) * processes
+        if not self._shared.reserve(block_count):
+            logger.warning("the shared memory of the usage statistics holds %d of the %d blocks needed by %d processes "
+                "(increase USAGE_STATISTICS_SHARED_MEMORY)", self._shared.max_blocks, block_count, processes)
+
+    def clear_all(self):
+        """
+        Clears all measurements so far, of all worker processes.
+        """
+
+        self._shared.next_generation()
+        for group in self._groups.values():
+            group.clear()
+
+    def get_group_names(self) -> list:
+        """
+        Gets the names of all timed groups created so far, by any worker process.
+        """
+
+        names = self._shared.group_names()
+        names.extend(name for name in self._groups if name not in names)
+        return names
+
+    def get_group(self, name : str) -> TimedGroup:
+        if name not in self._groups:
+            group = self._shared.register_group(name)
+            if group is None:
+                logger.warning("the shared usage statistics hold at most %d groups: the measurements of %s are only kept by process %d",
+                    self._shared.max_groups, name, os.getpid())
+                self._groups[name] = TimedGroup(self._max_samples, self._window_seconds)
+            else:
+                self._groups[name] = SharedTimedGroup(self._shared, group, self._max_samples, self._window_seconds, self._slices, self._bucket_count)
+        return self._groups[name]
@@ -0,0 +1,73 @@
+import threading
+
+class Call:
+    """
+    A call in progress, whose result is shared by all callers with the same key.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key: only the first one is executed, and the others wait for its result.
+
+    Calls are only collapsed while they are in progress, so the results are never reused by later calls.
+    """
+
+    COUNTERS = ["calls", "collapsed"]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._counters = dict.fromkeys(SingleFlight.COUNTERS, 0)
+
+    def do(self, key, fn):
+        """
+        Calls fn, unless a call with the same key is in progress, in which case its result is returned instead (or its
+        exception raised).
+
+        Returns the result and whether it was shared with another call.
+        """
+
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self._counters["collapsed"] += 1
+                leader = False
+            else:
+                call = Call()
+                self._calls[key] = call
+                self._counters["calls"] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def statistics(self) -> dict:
+        """
+        Gets the number of calls executed and of calls which shared the result of another call.
+        """
+
+        with self._lock:
+            return self._counters.copy()
+
+    def clear_statistics(self):
+        with self._lock:
+            self._counters = dict.fromkeys(SingleFlight.COUNTERS, 0)
@@ -0,0 +1,48 @@
+import mmap
+import multiprocessing
+import zlib
+
+class TagGenerations:
+    """
+    The generations of the tags of cached responses, shared by all worker processes of the server, through which responses are
+    invalidated in all of them.
+
+    Each tag is counted by one of slot_count counters, chosen by a hash of the tag, so responses of a few other tags may be
+    invalidated along with them. Responses are stored with a stamp of the generations of their tags, taken before they are
+    requested, and they are stale once the generation of any of their tags is advanced.
+
+    It must be created before the worker processes are forked (i.e. when the application is imported), so that all of them map
+    the same counters. The lock is only taken to advance generations; stamps are read without it.
+    """
+
+    def __init__(self, slot_count : int = 4096):
+        self._slot_count = slot_count
+        self._memory = mmap.mmap(-1, slot_count * 8)
+        self._words = memoryview(self._memory).cast("Q")
+        self._lock = multiprocessing.Lock()
+
+    def stamp(self, tags : list) -> tuple:
+        """
+        Gets the current generations of some tags, as (slot, generation) pairs.
+        """
+
+        return tuple((slot, self._words[slot]) for slot in {self._slot(tag) for tag in tags})
+
+    def is_current(self, stamp : tuple) -> bool:
+        """
+        Checks whether no tag of a stamp has been invalidated since it was taken.
+        """
+
+        return all(self._words[slot] == generation for (slot, generation) in stamp)
+
+    def advance(self, tag):
+        """
+        Invalidates the responses stored with a tag (and with the tags which share its counter), in all processes.
+        """
+
+        slot = self._slot(tag)
+        with self._lock:
+            self._words[slot] += 1
+
+    def _slot(self, tag) -> int:
+        return zlib.crc32(str(tag).encode("utf-8")) % self._slot_count
@@ -1,93 +1,326 @@
+from array import array
 from functools import wraps
+import inspect
+import threading
 import time
 
-class CircularBuffer:
+from .histogram import LogHistogram, WindowedHistogram
+
+# the outcomes of measured calls: calls which returned normally, calls which returned a server error (5xx) response and calls
+# which raised an exception.
+SUCCESS = "success"
+FAILURE = "failure"
+EXCEPTION = "exception"
+OUTCOMES = [SUCCESS, FAILURE, EXCEPTION]
+OUTCOME_INDEXES = {outcome: index for (index, outcome) in enumerate(OUTCOMES)}
+
+# the number of samples a thread may record before they are added to the histograms of its group.
+THREAD_BUFFER_SIZE = 64
+
+def outcome_of(result) -> str:
     """
-    A very, very simple circular buffer.
+    Gets the outcome of a call which returned normally: a failure if it returned a response with a 5xx status code.
     """
 
-    def __init__(self, amount : int):
-        self._initial_index = 0
-        self._amount = 0
-        self._buffer = [0.0] * amount
+    status_code = getattr(result, "status_code", None)
+    if isinstance(status_code, int) and status_code >= 500:
+        return FAILURE
+    return SUCCESS
 
-    def add(self, value : float):
-        """
-        Adds a value to the circular buffer.
-        """
+def request_outcome(status) -> str:
+    """
+    Gets the outcome of a request given the status code of its response, or "error" if it raised an exception.
+    """
 
-        final_index = (self._initial_index + self._amount) % len(self._buffer)
-        self._buffer[final_index] = value
-        if self._amount < len(self._buffer):
-            self._amount += 1
-        else:
-            self._initial_index = (self._initial_index + 1) % len(self._buffer)
+    if status == "error":
+        return EXCEPTION
+    if isinstance(status, int) and status >= 500:
+        return FAILURE
+    return SUCCESS
 
-    def clear(self):
-        """
-        Clears the circular buffer.
-        """
+class SampleRing:
+    """
+    The last samples of a timed group, stored in a typed array.
 
-        self._initial_index = 0
-        self._amount = 0
+    It is not thread-safe: it is used under the lock of its group.
+    """
+
+    __slots__ = ("_values", "_written")
+
+    def __init__(self, capacity : int):
+        self._values = array('d', bytes(8 * capacity))
+        self._written = 0
+
+    def extend(self, values : list):
+        capacity = len(self._values)
+        if capacity == 0:
+            return
+        # only the last values fit in the ring.
+        values = values[-capacity:]
+        start = self._written % capacity
+        head = min(len(values), capacity - start)
+        self._values[start:start + head] = array('d', values[:head])
+        self._values[:len(values) - head] = array('d', values[head:])
+        self._written += len(values)
+
+    def clear(self):
+        self._written = 0
 
     def to_list(self) -> list:
         """
-        Converts the contents of the buffer to a list.
+        Gets the samples, from the oldest to the newest.
         """
 
-        if self._amount == 0:
-            return []
+        capacity = len(self._values)
+        if self._written <= capacity:
+            return self._values[:self._written].tolist()
+        start = self._written % capacity
+        return self._values[start:].tolist() + self._values[:start].tolist()
+
+class ThreadBuffer:
+    """
+    The samples recorded by a thread which were not yet added to the histograms of its group, along with their timestamps and
+    outcomes.
+
+    Only the owner thread writes samples, and written is only increased once the sample is stored; samples up to written are
+    added to the group (under its lock) by the owner when the buffer is full, or by readers, which then increase flushed.
+    """
+
+    __slots__ = ("thread", "values", "timestamps", "outcomes", "written", "flushed")
 
-        final_index = (self._initial_index + self._amount) % len(self._buffer)
-        if final_index > self._initial_index:
-            return self._buffer[self._initial_index:final_index]
-        else:
-            return self._buffer[self._initial_index:]+self._buffer[:final_index]
+    def __init__(self, thread : threading.Thread, size : int):
+        self.thread = thread
+        self.values = array('d', bytes(8 * size))
+        self.timestamps = array('d', bytes(8 * size))
+        self.outcomes = array('B', bytes(size))
+        self.written = 0
+        self.flushed = 0
 
 class TimedGroup:
     """
     A group of functions timed as a group.
+
+    Samples are recorded without locks: each thread writes them to its own buffer, and they are added to the histograms (under the
+    lock of the group) when the buffer is full or when the measurements are read, so readers always see all samples recorded so
+    far.
     """
 
-    def __init__(self, max_samples : int):
-        self._samples = CircularBuffer(max_samples)
+    def __init__(self, max_samples : int, window_seconds : float):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._buffers = []
+        self._samples = SampleRing(max_samples)
+        self._lifetime = LogHistogram()
+        self._window = WindowedHistogram(window_seconds)
+        self._outcomes = array('Q', bytes(8 * len(OUTCOMES)))
 
     def get_samples(self) -> list:
-        return self._samples.to_list()
+        with self._lock:
+            self._flush_all()
+            return self._samples.to_list()
+
+    def get_lifetime_summary(self) -> dict:
+        """
+        Summarizes all samples since the process started (or the group was cleared), along with the number of samples of each
+        outcome.
+        """
+
+        with self._lock:
+            self._flush_all()
+            summary = self._lifetime.summary()
+            summary["outcomes"] = dict(zip(OUTCOMES, self._outcomes.tolist()))
+            return summary
+
+    def get_lifetime_histogram(self) -> LogHistogram:
+        with self._lock:
+            self._flush_all()
+            return self._lifetime.copy()
+
+    def get_window_summary(self) -> dict:
+        """
+        Summarizes the samples of the sliding window.
+        """
+
+        return self.get_window_histogram().summary()
 
-    def add_sample(self, value : float):
-        self._samples.add(value)
+    def get_window_histogram(self) -> LogHistogram:
+        with self._lock:
+            self._flush_all()
+            return self._window.snapshot()
+
+    def add_sample(self, value : float, outcome : str = SUCCESS):
+        try:
+            buffer = self._local.buffer
+        except AttributeError:
+            buffer = ThreadBuffer(threading.current_thread(), THREAD_BUFFER_SIZE)
+            self._local.buffer = buffer
+            with self._lock:
+                self._buffers.append(buffer)
+
+        position = buffer.written
+        if position - buffer.flushed >= THREAD_BUFFER_SIZE:
+            with self._lock:
+                self._flush(buffer)
+        index = position % THREAD_BUFFER_SIZE
+        buffer.values[index] = value
+        buffer.timestamps[index] = time.monotonic()
+        buffer.outcomes[index] = OUTCOME_INDEXES[outcome]
+        buffer.written = position + 1
 
     def clear(self):
-        self._samples.clear()
+        with self._lock:
+            for buffer in self._buffers:
+                buffer.flushed = buffer.written
+            self._samples.clear()
+            self._lifetime.clear()
+            self._window.clear()
+            self._outcomes = array('Q', bytes(8 * len(OUTCOMES)))
+
+    def _flush(self, buffer : ThreadBuffer):
+        written = buffer.written
+        if written == buffer.flushed:
+            return
+        # the samples are added as a batch, from the oldest to the newest.
+        start = buffer.flushed % THREAD_BUFFER_SIZE
+        end = start + written - buffer.flushed
+        values = buffer.values[start:end].tolist() + buffer.values[:max(0, end - THREAD_BUFFER_SIZE)].tolist()
+        timestamps = buffer.timestamps[start:end].tolist() + buffer.timestamps[:max(0, end - THREAD_BUFFER_SIZE)].tolist()
+        outcomes = buffer.outcomes[start:end] + buffer.outcomes[:max(0, end - THREAD_BUFFER_SIZE)]
+        buffer.flushed = written
+        self._add_batch(values, timestamps, outcomes)
+
+    def _add_batch(self, values : list, timestamps : list, outcomes : array):
+        """
+        Adds the samples flushed from a buffer, with their timestamps and outcome indexes, under the lock of the group.
+        """
+
+        buckets = self._lifetime.bucket_indexes(values)
+        self._samples.extend(values)
+        self._lifetime.record_all(values, buckets)
+        self._window.record_all(values, timestamps, buckets)
+        for index in range(len(OUTCOMES)):
+            self._outcomes[index] += outcomes.count(index)
+
+    def _flush_all(self):
+        for buffer in self._buffers:
+            self._flush(buffer)
+        # the buffers of threads which have exited are dropped once they are empty.
+        self._buffers = [buffer for buffer in self._buffers if buffer.thread.is_alive() or buffer.written != buffer.flushed]
 
     def wrap(self, fn):
         """
         Wraps a function to be measured.
+
+        Coroutine functions are also supported, in which case the time until the coroutine finishes is measured. Calls which
+        raise an exception are measured as well, with the exception outcome.
         """
 
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def wrapped_coroutine_function(*args, **kwargs):
+                start_time = time.perf_counter()
+                try:
+                    result = await fn(*args, **kwargs)
+                except BaseException:
+                    self.add_sample(time.perf_counter() - start_time, EXCEPTION)
+                    raise
+                self.add_sample(time.perf_counter() - start_time, outcome_of(result))
+                return result
+            return wrapped_coroutine_function
+
         # inspired by <https://dev.to/kcdchennai/python-decorator-to-measure-execution-time-54hk>
         @wraps(fn)
         def wrapped_function(*args, **kwargs):
             start_time = time.perf_counter()
-            result = fn(*args, **kwargs)
-            end_time = time.perf_counter()
-            total_time = end_time - start_time
-
-            self.add_sample(total_time)
-
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException:
+                self.add_sample(time.perf_counter() - start_time, EXCEPTION)
+                raise
+            self.add_sample(time.perf_counter() - start_time, outcome_of(result))
             return result
         return wrapped_function
 
+class RequestTiming:
+    """
+    The durations of the phases of a single request, measured while it is handled.
+
+    Consecutive phases may be measured by calling start_phase once and then end_phase at the end of each phase.
+    """
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.phases = {}
+        self._phase_start_time = self.start_time
+
+    def add(self, phase : str, duration : float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + duration
+
+    def start_phase(self):
+        self._phase_start_time = time.perf_counter()
+
+    def end_phase(self, phase : str):
+        now = time.perf_counter()
+        self.add(phase, now - self._phase_start_time)
+        self._phase_start_time = now
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start_time
+
+class RouteMeasurement:
+    """
+    The measurements of the requests handled by a route: one for whole requests, and one for each of their phases.
+
+    The measurement of a phase is named after the measurement of the route, followed by a dot and the name of the phase.
+    """
+
+    def __init__(self, timed : "Timed", name : str, phases : list):
+        self._total = timed.get_group(name)
+        self._phases = {phase: timed.get_group(name + "." + phase) for phase in phases}
+
+    def record(self, total_time : float, timing : RequestTiming, outcome : str = SUCCESS):
+        """
+        Records the time taken by a request and by the phases measured so far, with the outcome of the request.
+        """
+
+        self._total.add_sample(total_time, outcome)
+        for (phase, group) in self._phases.items():
+            if phase in timing.phases:
+                group.add_sample(timing.phases[phase], outcome)
+
+    def get_phase_group(self, phase : str) -> TimedGroup:
+        return self._phases[phase]
+
+    def record_phase(self, timing : RequestTiming, phase : str):
+        """
+        Records a phase which ended after the rest of the request was recorded.
+        """
+
+        if phase in timing.phases:
+            self._phases[phase].add_sample(timing.phases[phase])
+
+_current = threading.local()
+
+def set_current_timing(timing : RequestTiming):
+    """
+    Sets the timing of the request being handled by the current thread, so that code which does not receive it as an argument
+    (e.g. connection pools) can measure its phases.
+    """
+
+    _current.timing = timing
+
+def get_current_timing() -> RequestTiming:
+    return getattr(_current, "timing", None)
+
 class Timed:
     """
     A class which holds timed measurements.
     """
 
-    def __init__(self, max_samples : int):
+    def __init__(self, max_samples : int, window_seconds : float):
         self._groups = {}
         self._max_samples = max_samples
+        self._window_seconds = window_seconds
 
     def measure(self, name : str):
         """
@@ -98,6 +331,13 @@ class Timed:
             return self.get_group(name).wrap(fn)
         return wrapper
 
+    def measure_route(self, name : str, phases : list) -> RouteMeasurement:
+        """
+        Creates the measurements of the requests handled by a route, with a given name and phases.
+        """
+
+        return RouteMeasurement(self, name, phases)
+
     def clear_all(self):
         """
         Clears all measurements so far.
@@ -106,13 +346,20 @@ class Timed:
         for name in self._groups:
             self._groups[name].clear()
 
+    def get_group_names(self) -> list:
+        """
+        Gets the names of all timed groups created so far.
+        """
+
+        return list(self._groups)
+
     def get_group(self, name : str) -> TimedGroup:
         """
         Gets the timed group with a given name.
         """
 
         if name not in self._groups:
-            self._groups[name] = TimedGroup(self._max_samples)
+            self._groups[name] = TimedGroup(self._max_samples, self._window_seconds)
         return self._groups[name]
 
 class NotTimed:
@@ -125,8 +372,14 @@ class NotTimed:
             return fn
         return wrapper
 
+    def measure_route(self, name : str, phases : list) -> RouteMeasurement:
+        return None
+
     def clear_all(self):
         pass
 
+    def get_group_names(self) -> list:
+        return []
+
     def get_group(self, name : str) -> TimedGroup:
         return None
@@ -0,0 +1,267 @@
+import ssl
+import threading
+import time
+
+import requests
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from requests.packages.urllib3.poolmanager import PoolManager
+
+from . import path_utils
+from .backend_guard import NotGuarded
+from .flask_proxy import FAILURE_STATUS_CODES, UpstreamPermit
+from .load_balancer import LoadBalancer, SingleEndpoint
+from .time_measurement import get_current_timing
+
+class PoolStatistics:
+    """
+    Counters which describe how the connection pools of a session are used.
+    """
+
+    COUNTERS = ["connections_reused", "connections_opened", "idle_connections_closed", "connections_discarded", "tls_sessions_resumed"]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(PoolStatistics.COUNTERS, 0)
+
+    def increment(self, name : str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def to_dict(self) -> dict:
+        """
+        Gets a copy of all counters.
+
+        Connections are reused when a request finds an open connection in the pool (a pool hit) and opened otherwise (a pool miss).
+        Connections are discarded when they are returned to a pool which is already full.
+        """
+
+        with self._lock:
+            return self._counters.copy()
+
+    def clear(self):
+        with self._lock:
+            self._counters = dict.fromkeys(PoolStatistics.COUNTERS, 0)
+
+class SessionResumingSSLContext(ssl.SSLContext):
+    """
+    An SSL context which resumes the last TLS session established with each server, skipping the full handshake.
+    """
+
+    def __new__(cls, statistics : PoolStatistics):
+        return super().__new__(cls, ssl.PROTOCOL_TLS_CLIENT)
+
+    def __init__(self, statistics : PoolStatistics):
+        super().__init__()
+
+        # hostnames are checked by urllib3 (unless they are ignored) and certificates are verified according to the session.
+        self.check_hostname = False
+        self._statistics = statistics
+        self._sessions = {}
+
+    def wrap_socket(self, sock, *args, server_hostname=None, **kwargs):
+        kwargs.setdefault("session", self._sessions.get(self._session_key(sock, server_hostname)))
+        ssl_sock = super().wrap_socket(sock, *args, server_hostname=server_hostname, **kwargs)
+        if ssl_sock.session_reused:
+            self._statistics.increment("tls_sessions_resumed")
+        return ssl_sock
+
+    def remember_session(self, ssl_sock):
+        """
+        Stores the session of a socket so that the next connection to the same server resumes it.
+
+        With TLS 1.3 the session is only known after data has been received, so this is done when the connection returns to the pool.
+        """
+
+        if ssl_sock.session is not None:
+            self._sessions[self._session_key(ssl_sock, ssl_sock.server_hostname)] = ssl_sock.session
+
+    def _session_key(self, sock, server_hostname):
+        # servers accessed by IP address are not sent a hostname.
+        if server_hostname is not None:
+            return server_hostname
+        return sock.getpeername()
+
+class TrackedConnectionPoolMixin:
+    """
+    Tracks the connections of a pool and closes the connections which have been idle for too long.
+
+    The time taken to acquire a connection from the pool (and to open it, if needed) is measured as the "connect" phase of the
+    timing of the current request, if any.
+    """
+
+    statistics = None
+    idle_timeout = None
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+
+        last_used = getattr(conn, "last_used", None)
+        if conn.sock is not None and self.idle_timeout and last_used is not None and time.monotonic() - last_used > self.idle_timeout:
+            conn.close()
+            self.statistics.increment("idle_connections_closed")
+
+        if conn.sock is None:
+            self.statistics.increment("connections_opened")
+        else:
+            self.statistics.increment("connections_reused")
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn.last_used = time.monotonic()
+            context = getattr(conn, "ssl_context", None)
+            if isinstance(context, SessionResumingSSLContext) and isinstance(conn.sock, ssl.SSLSocket):
+                context.remember_session(conn.sock)
+
+        if self.pool is not None and self.pool.full():
+            self.statistics.increment("connections_discarded")
+        super()._put_conn(conn)
+
+    def _validate_conn(self, conn):
+        # called right before the request is sent; HTTPS connections are opened here, HTTP ones are opened now as well so that
+        # opening them is measured.
+        if conn.sock is None:
+            conn.connect()
+        super()._validate_conn(conn)
+
+        timing = get_current_timing()
+        if timing is not None:
+            timing.end_phase("connect")
+
+class TrackedHTTPConnectionPool(TrackedConnectionPoolMixin, HTTPConnectionPool):
+    pass
+
+class TrackedHTTPSConnectionPool(TrackedConnectionPoolMixin, HTTPSConnectionPool):
+    pass
+
+class UpstreamPoolManager(PoolManager):
+    """
+    A pool manager whose connection pools are tracked.
+    """
+
+    def __init__(self, statistics : PoolStatistics, idle_timeout : float, **kwargs):
+        super().__init__(**kwargs)
+        self.pool_classes_by_scheme = {
+            "http": TrackedHTTPConnectionPool,
+            "https": TrackedHTTPSConnectionPool
+        }
+        self._statistics = statistics
+        self._idle_timeout = idle_timeout
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        pool = super()._new_pool(scheme, host, port, request_context=request_context)
+        pool.statistics = self._statistics
+        pool.idle_timeout = self._idle_timeout
+        return pool
+
+# based on <https://stackoverflow.com/a/22794281/6242158>
+class UpstreamAdapter(HTTPAdapter):
+    """
+    A transport adapter with tunable and tracked connection pools.
+
+    If ignore_hostname is True, hostnames are never checked.
+    """
+
+    def __init__(self, statistics : PoolStatistics, pool_connections : int, pool_maxsize : int, pool_block : bool, idle_timeout : float, tls_session_resumption : bool, ignore_hostname : bool = False):
+        self._statistics = statistics
+        self._idle_timeout = idle_timeout
+        self._tls_session_resumption = tls_session_resumption
+        self._ignore_hostname = ignore_hostname
+        super().__init__(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        if self._ignore_hostname:
+            pool_kwargs["assert_hostname"] = False
+        if self._tls_session_resumption:
+            pool_kwargs["ssl_context"] = SessionResumingSSLContext(self._statistics)
+
+        self.poolmanager = UpstreamPoolManager(
+            self._statistics,
+            self._idle_timeout,
+            num_pools = connections,
+            maxsize = maxsize,
+            block = block,
+            **pool_kwargs
+        )
+
+class UpstreamSession(Session):
+    """
+    A session used to access a remote service, with tunable and tracked connection pools.
+    """
+
+    def __init__(self, pool_connections : int, pool_maxsize : int, pool_block : bool, idle_timeout : float, tls_session_resumption : bool, ignore_hostname : bool = False):
+        super().__init__()
+        self.statistics = PoolStatistics()
+        self.pool_maxsize = pool_maxsize
+        self.idle_timeout = idle_timeout
+        self.ignore_hostname = ignore_hostname
+
+        adapter = UpstreamAdapter(self.statistics, pool_connections, pool_maxsize, pool_block, idle_timeout, tls_session_resumption, ignore_hostname=ignore_hostname)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+class UpstreamClient:
+    """
+    Sends requests to a remote service with its session, outside of the proxied routes (e.g. from worker threads).
+
+    If a load balancer is given, each request is sent to one of its endpoints instead of the base URI. If a guard is given, the
+    requests are sent with its permission, as those of the proxied routes, and BackendUnavailable is raised when it refuses them.
+    """
+
+    def __init__(self, base_uri : str, session : Session, extra_params : dict, load_balancer : LoadBalancer = None, guard=None):
+        self.base_uri = base_uri
+        self.session = session
+        self.extra_params = extra_params
+        self.load_balancer = SingleEndpoint(base_uri) if load_balancer is None else load_balancer
+        self.guard = NotGuarded() if guard is None else guard
+
+    def request(self, method : str, relative_url : str, headers : dict = None, data : bytes = None, timeout : float = None, stream : bool = False) -> requests.Response:
+        """
+        Sends a request to the remote service. If no timeout is given, the timeouts of the extra parameters (if any) are used.
+        """
+
+        extra_params = dict(self.extra_params)
+        if timeout is not None:
+            extra_params["timeout"] = timeout
+        permit = UpstreamPermit(self.guard.acquire(), self.load_balancer.acquire())
+        try:
+            resp = self.session.request(
+                method=method,
+                url=permit.base_url + relative_url,
+                headers=headers,
+                data=data,
+                allow_redirects=False,
+                stream=stream,
+                **extra_params)
+        except requests.RequestException:
+            permit.release(False)
+            raise
+        # the latency of the remote service is the time taken to receive the status and headers of its response.
+        permit.release(resp.status_code not in FAILURE_STATUS_CODES, resp.elapsed.total_seconds())
+        return resp
+
+def create_session(base_uri : str, validate_certificate : bool, use_custom_certificate : bool, certificate_file_name : str, pool_connections : int, pool_maxsize : int, pool_block : bool, idle_timeout : float, tls_session_resumption : bool, connect_timeout : float = None, read_timeout : float = None):
+    """
+    Creates the session used to access a remote service, along with the extra parameters of its requests.
+
+    If the custom CA certificate is used, it is read from the given file of the other_certificates folder and hostnames are not checked.
+    The connect and read timeouts (in seconds) are None if the requests may wait forever.
+    """
+
+    ignore_hostname = False
+    extra_params = {}
+    if connect_timeout is not None or read_timeout is not None:
+        extra_params["timeout"] = (connect_timeout, read_timeout)
+    if base_uri.startswith("https"):
+        if validate_certificate:
+            if use_custom_certificate:
+                ignore_hostname = True
+                certificate_path = path_utils.relative_path("other_certificates", certificate_file_name)
+                extra_params["verify"] = certificate_path
+        else:
+            extra_params["verify"] = False
+
+    session = UpstreamSession(pool_connections, pool_maxsize, pool_block, idle_timeout, tls_session_resumption, ignore_hostname=ignore_hostname)
+    return session, extra_params
@@ -130,10 +130,11 @@ docker build "$SCRIPT_FOLDER" \
 cat > "$SCRIPT_FOLDER/run-sim.sh" <<EOF
 #!/usr/bin/env bash
 
-# Run the container
+# Run the container (without the encrypted volume of the CAS session, so the disk cache is disabled)
 docker run -it --rm \
     --name "openehr-proxy-service" \
     --env-file "$SOURCE_FOLDER/.env" \
+    -e "DISK_CACHE=no" \
     -e "SCONE_MODE=sim" \
     -e "SCONE_FSPF=/fspf/fspf.pb" \
     -e "SCONE_FSPF_KEY=$SCONE_FSPF_KEY" \
@@ -39,5 +39,6 @@ docker run -it --rm \
     -e "SCONE_LAS_ADDR=$LAS_ADDR" \
     -e "SCONE_CAS_ADDR=$CAS_ADDR" \
     -e "SCONE_CONFIG_ID=$CAS_CONFIG_ID/api_service" \
+    -v "openehr-proxy-service-disk-cache:/disk_cache" \
     --network host \
     "openehr-proxy-service-scone"
@@ -35,17 +35,128 @@ export MRENCLAVE=$(SCONE_HASH=1 python)
 # Load variable defaults.
 [ -z "${PLAIN_HTTP}" ] && PLAIN_HTTP=no
 [ -z "${SERVER_PORT}" ] && SERVER_PORT=12001
+[ -z "${SERVER_MODE}" ] && SERVER_MODE=production
+[ -z "${SERVER_WORKERS}" ] && SERVER_WORKERS=4
+[ -z "${SERVER_THREADS}" ] && SERVER_THREADS=8
+[ -z "${SERVER_KEEPALIVE}" ] && SERVER_KEEPALIVE=5
+[ -z "${SERVER_BACKLOG}" ] && SERVER_BACKLOG=2048
+[ -z "${SERVER_GRACEFUL_TIMEOUT}" ] && SERVER_GRACEFUL_TIMEOUT=30
+[ -z "${SERVER_MAX_REQUESTS}" ] && SERVER_MAX_REQUESTS=0
+[ -z "${SERVER_MAX_REQUESTS_JITTER}" ] && SERVER_MAX_REQUESTS_JITTER=0
+[ -z "${PROXY_ENGINE}" ] && PROXY_ENGINE=flask
+[ -z "${ASGI_MAX_UPSTREAM_CONNECTIONS}" ] && ASGI_MAX_UPSTREAM_CONNECTIONS=1000
 [ -z "${INCLUDE_USAGE_STATISTICS}" ] && INCLUDE_USAGE_STATISTICS=yes
+[ -z "${INCLUDE_METRICS}" ] && INCLUDE_METRICS=no
+[ -z "${SHARE_METRICS}" ] && SHARE_METRICS=yes
+[ -z "${METRICS_MAX_SERIES}" ] && METRICS_MAX_SERIES=4096
 [ -z "${USAGE_STATISTICS_MAX_SAMPLES}" ] && USAGE_STATISTICS_MAX_SAMPLES=1000
+[ -z "${USAGE_STATISTICS_WINDOW}" ] && USAGE_STATISTICS_WINDOW=60
+[ -z "${SHARE_USAGE_STATISTICS}" ] && SHARE_USAGE_STATISTICS=yes
+[ -z "${USAGE_STATISTICS_SHARED_MEMORY}" ] && USAGE_STATISTICS_SHARED_MEMORY=134217728
+[ -z "${STREAMING_CHUNK_SIZE}" ] && STREAMING_CHUNK_SIZE=65536
+[ -z "${COMPRESS_RESPONSES}" ] && COMPRESS_RESPONSES=no
+[ -z "${COMPRESSION_ENCODINGS}" ] && COMPRESSION_ENCODINGS=gzip
+[ -z "${COMPRESSION_MIN_SIZE}" ] && COMPRESSION_MIN_SIZE=1024
+[ -z "${REQUEST_COMPRESSED_UPSTREAM_BODIES}" ] && REQUEST_COMPRESSED_UPSTREAM_BODIES=yes
+[ -z "${PASS_THROUGH_COMPRESSED_BODIES}" ] && PASS_THROUGH_COMPRESSED_BODIES=no
+[ -z "${GUARD_UPSTREAMS}" ] && GUARD_UPSTREAMS=no
+[ -z "${UPSTREAM_CONCURRENCY_LIMIT}" ] && UPSTREAM_CONCURRENCY_LIMIT=20
+[ -z "${UPSTREAM_MIN_CONCURRENCY_LIMIT}" ] && UPSTREAM_MIN_CONCURRENCY_LIMIT=2
+[ -z "${UPSTREAM_MAX_CONCURRENCY_LIMIT}" ] && UPSTREAM_MAX_CONCURRENCY_LIMIT=200
+[ -z "${UPSTREAM_LATENCY_TOLERANCE}" ] && UPSTREAM_LATENCY_TOLERANCE=3
+[ -z "${CIRCUIT_BREAKER_FAILURE_THRESHOLD}" ] && CIRCUIT_BREAKER_FAILURE_THRESHOLD=5
+[ -z "${CIRCUIT_BREAKER_RESET_TIMEOUT}" ] && CIRCUIT_BREAKER_RESET_TIMEOUT=30
+[ -z "${HEDGE_REQUESTS}" ] && HEDGE_REQUESTS=no
+[ -z "${HEDGE_PERCENTILE}" ] && HEDGE_PERCENTILE=95
+[ -z "${HEDGE_MIN_DELAY}" ] && HEDGE_MIN_DELAY=0.05
+[ -z "${HEDGE_MAX_WORKERS}" ] && HEDGE_MAX_WORKERS=64
+[ -z "${UPSTREAM_MAX_RETRIES}" ] && UPSTREAM_MAX_RETRIES=0
+[ -z "${RETRY_BACKOFF}" ] && RETRY_BACKOFF=0.05
+[ -z "${RETRY_BUDGET_RATIO}" ] && RETRY_BUDGET_RATIO=0.1
+[ -z "${RETRY_BUDGET_MIN_PER_SECOND}" ] && RETRY_BUDGET_MIN_PER_SECOND=1
+[ -z "${LOAD_BALANCING}" ] && LOAD_BALANCING=least_outstanding
+[ -z "${ENDPOINT_EJECTION_FAILURES}" ] && ENDPOINT_EJECTION_FAILURES=5
+[ -z "${ENDPOINT_EJECTION_TIME}" ] && ENDPOINT_EJECTION_TIME=30
+[ -z "${CACHE_VERSIONED_RESOURCES}" ] && CACHE_VERSIONED_RESOURCES=no
+[ -z "${VERSIONED_RESOURCE_CACHE_MAX_ENTRIES}" ] && VERSIONED_RESOURCE_CACHE_MAX_ENTRIES=10000
+[ -z "${VERSIONED_RESOURCE_CACHE_MAX_BYTES}" ] && VERSIONED_RESOURCE_CACHE_MAX_BYTES=67108864
+[ -z "${VERSIONED_RESOURCE_CACHE_MAX_ENTRY_BYTES}" ] && VERSIONED_RESOURCE_CACHE_MAX_ENTRY_BYTES=1048576
+[ -z "${PATIENT_RECORD_TIMEOUT}" ] && PATIENT_RECORD_TIMEOUT=10
+[ -z "${PATIENT_RECORD_MAX_WORKERS}" ] && PATIENT_RECORD_MAX_WORKERS=16
+[ -z "${BATCH_MAX_REQUESTS}" ] && BATCH_MAX_REQUESTS=10000
+[ -z "${BATCH_CONCURRENCY}" ] && BATCH_CONCURRENCY=16
+[ -z "${BATCH_MAX_WORKERS}" ] && BATCH_MAX_WORKERS=32
+[ -z "${AQL_EXPORT_PAGE_SIZE}" ] && AQL_EXPORT_PAGE_SIZE=1000
+[ -z "${AQL_EXPORT_MAX_WORKERS}" ] && AQL_EXPORT_MAX_WORKERS=8
+[ -z "${CACHE_DEFINITIONS}" ] && CACHE_DEFINITIONS=no
+[ -z "${COALESCE_REQUESTS}" ] && COALESCE_REQUESTS=no
+[ -z "${DEFINITION_CACHE_MAX_ENTRIES}" ] && DEFINITION_CACHE_MAX_ENTRIES=1000
+[ -z "${DEFINITION_CACHE_MAX_BYTES}" ] && DEFINITION_CACHE_MAX_BYTES=67108864
+[ -z "${DEFINITION_CACHE_MAX_ENTRY_BYTES}" ] && DEFINITION_CACHE_MAX_ENTRY_BYTES=8388608
+[ -z "${DEFINITION_CACHE_TTL}" ] && DEFINITION_CACHE_TTL=300
+[ -z "${DISK_CACHE}" ] && DISK_CACHE=no
+[ -z "${DISK_CACHE_PATH}" ] && DISK_CACHE_PATH=/disk_cache
+[ -z "${DISK_CACHE_MAX_ENTRIES}" ] && DISK_CACHE_MAX_ENTRIES=100000
+[ -z "${DISK_CACHE_MAX_BYTES}" ] && DISK_CACHE_MAX_BYTES=1073741824
+[ -z "${DISK_CACHE_SEGMENT_BYTES}" ] && DISK_CACHE_SEGMENT_BYTES=67108864
+[ -z "${CACHE_EHR_IDS}" ] && CACHE_EHR_IDS=no
+[ -z "${EHR_ID_CACHE_MAX_ENTRIES}" ] && EHR_ID_CACHE_MAX_ENTRIES=100000
+[ -z "${EHR_ID_CACHE_MAX_BYTES}" ] && EHR_ID_CACHE_MAX_BYTES=67108864
+[ -z "${EHR_ID_CACHE_MAX_ENTRY_BYTES}" ] && EHR_ID_CACHE_MAX_ENTRY_BYTES=65536
+[ -z "${EHR_ID_CACHE_TTL}" ] && EHR_ID_CACHE_TTL=300
+[ -z "${EHR_ID_CACHE_WARM_UP}" ] && EHR_ID_CACHE_WARM_UP=no
+[ -z "${EHR_ID_CACHE_WARM_UP_MAX_PATIENTS}" ] && EHR_ID_CACHE_WARM_UP_MAX_PATIENTS=10000
+[ -z "${EHR_ID_CACHE_WARM_UP_HEADERS}" ] && EHR_ID_CACHE_WARM_UP_HEADERS='{}'
+[ -z "${CACHE_QUERY_RESULTS}" ] && CACHE_QUERY_RESULTS=no
+[ -z "${QUERY_RESULT_CACHE_MAX_ENTRIES}" ] && QUERY_RESULT_CACHE_MAX_ENTRIES=1000
+[ -z "${QUERY_RESULT_CACHE_MAX_BYTES}" ] && QUERY_RESULT_CACHE_MAX_BYTES=268435456
+[ -z "${QUERY_RESULT_CACHE_MAX_ENTRY_BYTES}" ] && QUERY_RESULT_CACHE_MAX_ENTRY_BYTES=16777216
+[ -z "${QUERY_RESULT_CACHE_TTL}" ] && QUERY_RESULT_CACHE_TTL=30
 [ -z "${OPENEHR_API_BASE_URI}" ] && OPENEHR_API_BASE_URI=http://127.0.0.1:12003/ehrbase/rest/openehr
 [ -z "${VALIDATE_OPENEHR_API_CERTIFICATE}" ] && VALIDATE_OPENEHR_API_CERTIFICATE=no
 [ -z "${USE_CUSTOM_OPENEHR_API_CA_CERTIFICATE}" ] && USE_CUSTOM_OPENEHR_API_CA_CERTIFICATE=no
+[ -z "${STREAM_OPENEHR_API_BODIES}" ] && STREAM_OPENEHR_API_BODIES=no
+[ -z "${OPENEHR_API_POOL_CONNECTIONS}" ] && OPENEHR_API_POOL_CONNECTIONS=10
+[ -z "${OPENEHR_API_POOL_MAXSIZE}" ] && OPENEHR_API_POOL_MAXSIZE=32
+[ -z "${OPENEHR_API_POOL_BLOCK}" ] && OPENEHR_API_POOL_BLOCK=no
+[ -z "${OPENEHR_API_POOL_IDLE_TIMEOUT}" ] && OPENEHR_API_POOL_IDLE_TIMEOUT=15
+[ -z "${OPENEHR_API_TLS_SESSION_RESUMPTION}" ] && OPENEHR_API_TLS_SESSION_RESUMPTION=yes
+[ -z "${OPENEHR_API_CONNECT_TIMEOUT}" ] && OPENEHR_API_CONNECT_TIMEOUT=5
+[ -z "${OPENEHR_API_READ_TIMEOUT}" ] && OPENEHR_API_READ_TIMEOUT=60
 [ -z "${DEMOGRAPHIC_API_BASE_URI}" ] && DEMOGRAPHIC_API_BASE_URI=https://127.0.0.1:12002
 [ -z "${VALIDATE_DEMOGRAPHIC_API_CERTIFICATE}" ] && VALIDATE_DEMOGRAPHIC_API_CERTIFICATE=yes
 [ -z "${USE_CUSTOM_DEMOGRAPHIC_API_CA_CERTIFICATE}" ] && USE_CUSTOM_DEMOGRAPHIC_API_CA_CERTIFICATE=yes
+[ -z "${STREAM_DEMOGRAPHIC_API_BODIES}" ] && STREAM_DEMOGRAPHIC_API_BODIES=no
+[ -z "${DEMOGRAPHIC_API_POOL_CONNECTIONS}" ] && DEMOGRAPHIC_API_POOL_CONNECTIONS=10
+[ -z "${DEMOGRAPHIC_API_POOL_MAXSIZE}" ] && DEMOGRAPHIC_API_POOL_MAXSIZE=32
+[ -z "${DEMOGRAPHIC_API_POOL_BLOCK}" ] && DEMOGRAPHIC_API_POOL_BLOCK=no
+[ -z "${DEMOGRAPHIC_API_POOL_IDLE_TIMEOUT}" ] && DEMOGRAPHIC_API_POOL_IDLE_TIMEOUT=15
+[ -z "${DEMOGRAPHIC_API_TLS_SESSION_RESUMPTION}" ] && DEMOGRAPHIC_API_TLS_SESSION_RESUMPTION=yes
+[ -z "${DEMOGRAPHIC_API_CONNECT_TIMEOUT}" ] && DEMOGRAPHIC_API_CONNECT_TIMEOUT=5
+[ -z "${DEMOGRAPHIC_API_READ_TIMEOUT}" ] && DEMOGRAPHIC_API_READ_TIMEOUT=60
 [ -z "${PROV_API_BASE_URI}" ] && PROV_API_BASE_URI=https://127.0.0.1:12001
 [ -z "${VALIDATE_PROV_API_CERTIFICATE}" ] && VALIDATE_PROV_API_CERTIFICATE=yes
 [ -z "${USE_CUSTOM_PROV_API_CA_CERTIFICATE}" ] && USE_CUSTOM_PROV_API_CA_CERTIFICATE=yes
+[ -z "${STREAM_PROV_API_BODIES}" ] && STREAM_PROV_API_BODIES=no
+[ -z "${PROV_API_POOL_CONNECTIONS}" ] && PROV_API_POOL_CONNECTIONS=10
+[ -z "${PROV_API_POOL_MAXSIZE}" ] && PROV_API_POOL_MAXSIZE=32
+[ -z "${PROV_API_POOL_BLOCK}" ] && PROV_API_POOL_BLOCK=no
+[ -z "${PROV_API_POOL_IDLE_TIMEOUT}" ] && PROV_API_POOL_IDLE_TIMEOUT=15
+[ -z "${PROV_API_TLS_SESSION_RESUMPTION}" ] && PROV_API_TLS_SESSION_RESUMPTION=yes
+[ -z "${PROV_API_CONNECT_TIMEOUT}" ] && PROV_API_CONNECT_TIMEOUT=5
+[ -z "${PROV_API_READ_TIMEOUT}" ] && PROV_API_READ_TIMEOUT=60
+
+# The disk cache holds the bodies of clinical responses, so it may only be kept in the encrypted volume of the session.
+export DISK_CACHE_VOLUME=/disk_cache
+if [ "${DISK_CACHE}" = "yes" ]; then
+    case "${DISK_CACHE_PATH}" in
+        "$DISK_CACHE_VOLUME" | "$DISK_CACHE_VOLUME"/*) ;;
+        *)
+            echo "Error: DISK_CACHE_PATH must be inside the encrypted volume $DISK_CACHE_VOLUME when DISK_CACHE is yes." > /dev/stderr
+            exit 1
+            ;;
+    esac
+fi
 
 # Generate the session file.
 envsubst < "$CAS_SESSION_FOLDER/cas-session-template.yml" > "$CAS_SESSION_FOLDER/cas-session.yml"
@@ -0,0 +1,33 @@
+from flask import Blueprint, Response, request, current_app
+import json
+
+from business_layer import batch_controller
+from app_settings import BATCH_MAX_REQUESTS
+
+blueprint = Blueprint("Batch routes", __name__)
+
+@blueprint.route(batch_controller.BATCH_PATH, methods=["POST"])
+def execute_batch():
+    """
+    Executes a list of requests to other routes of the gateway, streaming their results as newline-delimited JSON, in the order
+    they are completed.
+    """
+
+    try:
+        batch = batch_controller.parse_batch(request.get_json(force=True, silent=True))
+        if len(batch) > BATCH_MAX_REQUESTS:
+            raise batch_controller.InvalidBatch("the batch has more than {} requests".format(BATCH_MAX_REQUESTS))
+    except batch_controller.InvalidBatch as e:
+        return Response(
+            status = 400,
+            response=json.dumps({"error": str(e)}),
+            mimetype="application/json"
+        )
+
+    results = batch_controller.execute_batch(current_app._get_current_object(), batch, request.headers, request.host_url)
+
+    return Response(
+        status = 200,
+        response=results,
+        mimetype="application/x-ndjson"
+    )
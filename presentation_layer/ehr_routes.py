@@ -1,34 +1,22 @@
-from requests import Session
 from flask import Blueprint
 
-from data_layer import path_utils
 from data_layer.flask_proxy import FlaskProxy
-from data_layer.ssl_extension import HostNameIgnoringAdapter
-from app_settings import OPENEHR_API_BASE_URI, VALIDATE_OPENEHR_API_CERTIFICATE, USE_CUSTOM_OPENEHR_API_CA_CERTIFICATE
+from business_layer.upstreams import openehr_session, openehr_extra_params, openehr_guard, openehr_load_balancer, OPENEHR_BACKEND
+from business_layer.metrics import proxy_metrics
+from business_layer.coalescing import request_coalescing
+from business_layer.hedging import request_hedging
+from business_layer.caches import versioned_resource_cache, is_version_uid, definition_cache, invalidates_definitions, TEMPLATES_1_4_TAG, TEMPLATES_2_TAG, STORED_QUERIES_TAG, subject_ehr_cache, invalidates_ehr_ids, subject_tags, query_result_cache, invalidates_query_results, invalidates_ehr_query_results, ALL_EHRS_TAG, query_tags, ehr_tag
+from business_layer.query_arguments import ad_hoc_query_arguments, stored_query_arguments
+from business_layer.timing import timed
+from app_settings import OPENEHR_API_BASE_URI, STREAM_OPENEHR_API_BODIES, STREAMING_CHUNK_SIZE, REQUEST_COMPRESSED_UPSTREAM_BODIES, PASS_THROUGH_COMPRESSED_BODIES
 
 blueprint = Blueprint("OpenEHR routes", __name__)
 
-base_uri = OPENEHR_API_BASE_URI
-validate_certificate = VALIDATE_OPENEHR_API_CERTIFICATE
-use_custom_certificate = USE_CUSTOM_OPENEHR_API_CA_CERTIFICATE
-
-openehr_session = Session()
-
-extra_params = {}
-if base_uri.startswith("https"):
-    if validate_certificate:
-        if use_custom_certificate:
-            openehr_session.mount("https://", HostNameIgnoringAdapter())
-            certificate_path = path_utils.relative_path("other_certificates", "openehr_api_ca_certificate.pem")
-            extra_params["verify"] = certificate_path
-    else:
-        extra_params["verify"] = False
-
-proxy = FlaskProxy(blueprint, OPENEHR_API_BASE_URI, session=openehr_session, extra_params=extra_params)
+proxy = FlaskProxy(blueprint, OPENEHR_API_BASE_URI, session=openehr_session, extra_params=openehr_extra_params, stream=STREAM_OPENEHR_API_BODIES, chunk_size=STREAMING_CHUNK_SIZE, name=OPENEHR_BACKEND, metrics=proxy_metrics, timed=timed, upstream_compression=REQUEST_COMPRESSED_UPSTREAM_BODIES, pass_through_compression=PASS_THROUGH_COMPRESSED_BODIES, guard=openehr_guard, load_balancer=openehr_load_balancer)
 
 ################# EHR #################
 
-@proxy.redirect("/v1/ehr", methods=["POST"])
+@proxy.redirect("/v1/ehr", methods=["POST"], invalidates=invalidates_query_results(ALL_EHRS_TAG))
 def create_ehr(response):
     """
     Create a new EHR with an auto-generated identifier.
@@ -37,7 +25,7 @@ def create_ehr(response):
     """
     return response
 
-@proxy.redirect("/v1/ehr/<ehr_id>", methods=["PUT"])
+@proxy.redirect("/v1/ehr/<ehr_id>", methods=["PUT"], invalidates=invalidates_query_results(ALL_EHRS_TAG))
 def create_ehr_with_id(response):
     """
     Create a new EHR with the specified ehr_id identifier.
@@ -46,7 +34,7 @@ def create_ehr_with_id(response):
     """
     return response
 
-@proxy.redirect("/v1/ehr/<ehr_id>", methods=["GET"])
+@proxy.redirect("/v1/ehr/<ehr_id>", methods=["GET"], single_flight=request_coalescing)
 def get_ehr_summary_by_id(response):
     """
     Retrieve the EHR with the specified ehr_id.
@@ -55,7 +43,7 @@ def get_ehr_summary_by_id(response):
     """
     return response
 
-@proxy.redirect("/v1/ehr?subject_id=<subject_id>&subject_namespace=<subject_namespace>", methods=["GET"])
+@proxy.redirect("/v1/ehr?subject_id=<subject_id>&subject_namespace=<subject_namespace>", methods=["GET"], cache=subject_ehr_cache, cache_tags=subject_tags)
 def get_ehr_summary_by_subject_id(response):
     """
     Retrieve the EHR with the specified subject_id and subject_namespace.
@@ -75,7 +63,7 @@ def get_EHR_STATUS_version_by_time(response):
     """
     return response
 
-@proxy.redirect("/v1/ehr/<ehr_id>/ehr_status/<version_uid>", methods=["GET"])
+@proxy.redirect("/v1/ehr/<ehr_id>/ehr_status/<version_uid>", methods=["GET"], cache=versioned_resource_cache, cache_if=is_version_uid)
 def get_EHR_STATUS_by_version_id(response):
     """
     Retrieves a particular version of the EHR_STATUS identified by version_uid and associated with the EHR identified by ehr_id
@@ -84,7 +72,7 @@ def get_EHR_STATUS_by_version_id(response):
     """
     return response
 
-@proxy.redirect("/v1/ehr/<ehr_id>/ehr_status", methods=["PUT"])
+@proxy.redirect("/v1/ehr/<ehr_id>/ehr_status", methods=["PUT"], invalidates=invalidates_ehr_ids(ehr_tag) + invalidates_ehr_query_results(ehr_tag))
 def update_EHR_STATUS(response):
     """
     Updates EHR_STATUS associated with the EHR identified by ehr_id.
@@ -120,7 +108,7 @@ def get_versioned_EHR_STATUS_version_by_time(response):
     """
     return response
 
-@proxy.redirect("/v1/ehr/<ehr_id>/versioned_ehr_status/version/<version_uid>", methods=["GET"])
+@proxy.redirect("/v1/ehr/<ehr_id>/versioned_ehr_status/version/<version_uid>", methods=["GET"], cache=versioned_resource_cache, cache_if=is_version_uid)
 def get_versioned_EHR_STATUS_version_by_id(response):
     """
     Retrieves a VERSION identified by version_uid of an EHR_STATUS associated with the EHR identified by ehr_id.
@@ -131,7 +119,7 @@ def get_versioned_EHR_STATUS_version_by_id(response):
 
 ################# COMPOSITION #################
 
-@proxy.redirect("/v1/ehr/<ehr_id>/composition", methods=["POST"])
+@proxy.redirect("/v1/ehr/<ehr_id>/composition", methods=["POST"], invalidates=invalidates_ehr_query_results(ehr_tag))
 def create_composition(response):
     """
     Creates the first version of a new COMPOSITION in the EHR identified by ehr_id.
@@ -140,7 +128,7 @@ def create_composition(response):
     """
     return response
 
-@proxy.redirect("/v1/ehr/<ehr_id>/composition/<versioned_object_uid>", methods=["PUT"])
+@proxy.redirect("/v1/ehr/<ehr_id>/composition/<versioned_object_uid>", methods=["PUT"], invalidates=invalidates_ehr_query_results(ehr_tag))
 def update_composition(response):
     """
     Updates COMPOSITION identified by versioned_object_uid and associated with the EHR identified by ehr_id.
@@ -149,7 +137,7 @@ def update_composition(response):
     """
     return response
 
-@proxy.redirect("/v1/ehr/<ehr_id>/composition/<preceding_version_uid>", methods=["DELETE"])
+@proxy.redirect("/v1/ehr/<ehr_id>/composition/<preceding_version_uid>", methods=["DELETE"], invalidates=invalidates_ehr_query_results(ehr_tag))
 def delete_composition(response):
     """
     Deletes the COMPOSITION identified by preceding_version_uid and associated with the EHR identified by ehr_id.
@@ -158,7 +146,7 @@ def delete_composition(response):
     """
     return response
 
-@proxy.redirect("/v1/ehr/<ehr_id>/composition/<version_uid>", methods=["GET"])
+@proxy.redirect("/v1/ehr/<ehr_id>/composition/<version_uid>", methods=["GET"], cache=versioned_resource_cache, cache_if=is_version_uid)
 def get_composition_by_version_id(response):
     """
     Retrieves a particular version of the COMPOSITION identified by version_uid and associated with the EHR identified by ehr_id.
@@ -167,7 +155,7 @@ def get_composition_by_version_id(response):
     """
     return response
 
-@proxy.redirect("/v1/ehr/<ehr_id>/composition/<versioned_object_uid>?version_at_time=<version_at_time>", methods=["GET"])
+@proxy.redirect("/v1/ehr/<ehr_id>/composition/<versioned_object_uid>?version_at_time=<version_at_time>", methods=["GET"], hedging=request_hedging)
 def get_composition_at_time(response):
     """
     Retrieves a version of the COMPOSITION identified by versioned_object_uid and associated with the EHR identified by ehr_id.
@@ -196,7 +184,7 @@ def get_versioned_composition_revision_history(response):
     """
     return response
 
-@proxy.redirect("/v1/ehr/<ehr_id>/versioned_composition/<versioned_object_uid>/version/<version_uid>", methods=["GET"])
+@proxy.redirect("/v1/ehr/<ehr_id>/versioned_composition/<versioned_object_uid>/version/<version_uid>", methods=["GET"], cache=versioned_resource_cache, cache_if=is_version_uid)
 def get_versioned_composition_version_by_id(response):
     """
     Retrieves a VERSION identified by version_uid of a VERSIONED_COMPOSITION identified by versioned_object_uid and associated with the EHR identified by ehr_id.
@@ -218,7 +206,7 @@ def get_versioned_composition_version_at_time(response):
 
 ################# DIRECTORY #################
 
-@proxy.redirect("/v1/ehr/<ehr_id>/directory", methods=["POST"])
+@proxy.redirect("/v1/ehr/<ehr_id>/directory", methods=["POST"], invalidates=invalidates_ehr_query_results(ehr_tag))
 def create_directory(response):
     """
     Creates a new directory FOLDER associated with the EHR identified by ehr_id.
@@ -227,7 +215,7 @@ def create_directory(response):
     """
     return response
 
-@proxy.redirect("/v1/ehr/<ehr_id>/directory", methods=["PUT"])
+@proxy.redirect("/v1/ehr/<ehr_id>/directory", methods=["PUT"], invalidates=invalidates_ehr_query_results(ehr_tag))
 def update_directory(response):
     """
     Updates directory FOLDER associated with the EHR identified by ehr_id. The existing latest version_uid of directory FOLDER
@@ -237,7 +225,7 @@ def update_directory(response):
     """
     return response
 
-@proxy.redirect("/v1/ehr/<ehr_id>/directory", methods=["DELETE"])
+@proxy.redirect("/v1/ehr/<ehr_id>/directory", methods=["DELETE"], invalidates=invalidates_ehr_query_results(ehr_tag))
 def delete_directory(response):
     """
     Deletes directory FOLDER associated with the EHR identified by ehr_id. The existing latest version_uid of directory FOLDER
@@ -270,7 +258,7 @@ def get_folder_in_directory_version_at_time(response):
 
 ################# CONTRIBUTION #################
 
-@proxy.redirect("/v1/ehr/<ehr_id>/contribution", methods=["POST"])
+@proxy.redirect("/v1/ehr/<ehr_id>/contribution", methods=["POST"], invalidates=invalidates_ehr_query_results(ehr_tag))
 def create_contribution(response):
     """
     We will use the relaxed CONTRIBUTION XSD with the following attributes optional:
@@ -292,7 +280,7 @@ def get_contribution_by_id(response):
 
 ################# QUERY #################
 
-@proxy.redirect("/v1/query/aql?q=<q>&ehr_id=<ehr_id>&offset=<offset>&fetch=<fetch>&query_parameters=<query_parameters>", methods=["GET"])
+@proxy.redirect("/v1/query/aql?q=<q>&ehr_id=<ehr_id>&offset=<offset>&fetch=<fetch>&query_parameters=<query_parameters>", methods=["GET"], stream=True, cache=query_result_cache, cache_arguments=ad_hoc_query_arguments, cache_tags=query_tags)
 def execute_ad_hoc_AQL_query(response):
     """
     Execute ad-hoc query, supplied by q parameter, fetching fetch numbers of rows from offset and passing query_parameters to the
@@ -302,7 +290,7 @@ def execute_ad_hoc_AQL_query(response):
     """
     return response
 
-@proxy.redirect("/v1/query/aql", methods=["POST"])
+@proxy.redirect("/v1/query/aql", methods=["POST"], stream=True, cache=query_result_cache, cache_arguments=ad_hoc_query_arguments, cache_tags=query_tags)
 def execute_ad_hoc_AQL_query2(response):
     """
     Execute ad-hoc query, supplied by q parameter, fetching fetch numbers of rows from offset and passing query_parameters to the
@@ -312,7 +300,7 @@ def execute_ad_hoc_AQL_query2(response):
     """
     return response
 
-@proxy.redirect("/v1/query/<qualified_query_name>/<version>?ehr_id=<ehr_id>&offset=<offset>&fetch=<fetch>&query_parameters=<query_parameters>", methods=["GET"])
+@proxy.redirect("/v1/query/<qualified_query_name>/<version>?ehr_id=<ehr_id>&offset=<offset>&fetch=<fetch>&query_parameters=<query_parameters>", methods=["GET"], stream=True, cache=query_result_cache, cache_arguments=stored_query_arguments, cache_tags=query_tags)
 def execute_stored_query(response):
     """
     Execute a stored query, identified by the supplied qualified_query_name (at specified version), fetching fetch numbers of rows
@@ -322,7 +310,7 @@ def execute_stored_query(response):
     """
     return response
 
-@proxy.redirect("/v1/query/<qualified_query_name>/<version>", methods=["POST"])
+@proxy.redirect("/v1/query/<qualified_query_name>/<version>", methods=["POST"], stream=True, cache=query_result_cache, cache_arguments=stored_query_arguments, cache_tags=query_tags)
 def execute_stored_query2(response):
     """
     Execute a stored query identified by the supplied qualified_query_name (at specified version).
@@ -333,7 +321,7 @@ def execute_stored_query2(response):
 
 ################# ADL 1.4 TEMPLATE #################
 
-@proxy.redirect("/v1/definition/template/adl1.4/", methods=["POST"])
+@proxy.redirect("/v1/definition/template/adl1.4/", methods=["POST"], stream=True, invalidates=invalidates_definitions(TEMPLATES_1_4_TAG))
 def upload_template_1_4(response):
     """
     Upload a new ADL 1.4 operational template (OPT).
@@ -342,7 +330,7 @@ def upload_template_1_4(response):
     """
     return response
 
-@proxy.redirect("/v1/definition/template/adl1.4", methods=["GET"])
+@proxy.redirect("/v1/definition/template/adl1.4", methods=["GET"], cache=definition_cache, cache_tags=[TEMPLATES_1_4_TAG])
 def list_templates_1_4(response):
     """
     List the available ADL 1.4 operational templates (OPT) on the system.
@@ -351,7 +339,7 @@ def list_templates_1_4(response):
     """
     return response
 
-@proxy.redirect("/v1/definition/template/adl1.4/<template_id>", methods=["GET"])
+@proxy.redirect("/v1/definition/template/adl1.4/<template_id>", methods=["GET"], stream=True, cache=definition_cache, cache_tags=[TEMPLATES_1_4_TAG])
 def get_template_1_4(response):
     """
     Retrieves the ADL 1.4 operational template (OPT) identified by template_id identifier.
@@ -362,7 +350,7 @@ def get_template_1_4(response):
 
 ################# ADL 2 TEMPLATE #################
 
-@proxy.redirect("/v1/definition/template/adl2/?version=<version>", methods=["POST"])
+@proxy.redirect("/v1/definition/template/adl2/?version=<version>", methods=["POST"], stream=True, invalidates=invalidates_definitions(TEMPLATES_2_TAG))
 def upload_template_2(response):
     """
     Upload a new ADL2 operational template.
@@ -371,7 +359,7 @@ def upload_template_2(response):
     """
     return response
 
-@proxy.redirect("/v1/definition/template/adl2", methods=["GET"])
+@proxy.redirect("/v1/definition/template/adl2", methods=["GET"], cache=definition_cache, cache_tags=[TEMPLATES_2_TAG])
 def list_templates_2(response):
     """
     List the available ADL2 operational templates on the system.
@@ -380,7 +368,7 @@ def list_templates_2(response):
     """
     return response
 
-@proxy.redirect("/v1/definition/template/adl2/<template_id>/<version_pattern>", methods=["GET"])
+@proxy.redirect("/v1/definition/template/adl2/<template_id>/<version_pattern>", methods=["GET"], stream=True, cache=definition_cache, cache_tags=[TEMPLATES_2_TAG])
 def get_template_2(response):
     """
     Retrieves the ADL2 operational template identified by template_id identifier.
@@ -392,7 +380,7 @@ If version_pattern is specified then the latest template version with given pref
 
 ################# STORED QUERY #################
 
-@proxy.redirect("/v1/definition/query/<qualified_query_name>", methods=["GET"])
+@proxy.redirect("/v1/definition/query/<qualified_query_name>", methods=["GET"], cache=definition_cache, cache_tags=[STORED_QUERIES_TAG])
 def list_stored_queries(response):
     """
     Parameter qualified_query_name is optional. If omitted they are treated as “wildcards” in the search.
@@ -401,7 +389,7 @@ def list_stored_queries(response):
     """
     return response
 
-@proxy.redirect("/v1/definition/query/<qualified_query_name>/<version>?type=<type>", methods=["PUT"])
+@proxy.redirect("/v1/definition/query/<qualified_query_name>/<version>?type=<type>", methods=["PUT"], invalidates=invalidates_definitions(STORED_QUERIES_TAG) + invalidates_query_results(STORED_QUERIES_TAG))
 def store_a_query(response):
     """
     Store a new query on the system.
@@ -410,7 +398,7 @@ def store_a_query(response):
     """
     return response
 
-@proxy.redirect("/v1/definition/query/<qualified_query_name>/<version>", methods=["GET"])
+@proxy.redirect("/v1/definition/query/<qualified_query_name>/<version>", methods=["GET"], cache=definition_cache, cache_tags=[STORED_QUERIES_TAG])
 def get_stored_query_and_metadata(response):
     """
     More info at: https://specifications.openehr.org/releases/ITS-REST/latest/definitions.html#definitions-stored-query-get-1
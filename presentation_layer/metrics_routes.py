@@ -0,0 +1,13 @@
+from flask import Blueprint, Response
+
+from business_layer.metrics import registry
+
+blueprint = Blueprint("metrics routes", __name__)
+
+@blueprint.route("/metrics", methods=["GET"])
+def get_metrics():
+    return Response(
+        status = 200,
+        response=registry.render(),
+        mimetype="text/plain; version=0.0.4"
+    )
@@ -0,0 +1,23 @@
+from flask import Blueprint, Response, request
+import json
+
+from business_layer import patient_record_controller
+from business_layer.timing import timed, GET_PATIENT_RECORD_MEASUREMENT
+
+blueprint = Blueprint("Patient record routes", __name__)
+
+@blueprint.route("/v1/patient_record/<versioned_object_uid>", methods=["GET"])
+@timed.measure(GET_PATIENT_RECORD_MEASUREMENT)
+def get_patient_record(versioned_object_uid):
+    """
+    Retrieves, in a single document, the patient identified by versioned_object_uid along with its EHR, EHR_STATUS and
+    provenance. The EHR id may be given with the ehr_id query string parameter, otherwise it is obtained from the demographic API.
+    """
+
+    record = patient_record_controller.get_patient_record(versioned_object_uid, request.args.get("ehr_id"), request.headers, request.url_root.rstrip("/"))
+
+    return Response(
+        status = 200,
+        response=json.dumps(record, indent=2),
+        mimetype="application/json"
+    )
@@ -1,33 +1,18 @@
-from requests import Session
 from flask import Blueprint
 
-from data_layer import path_utils
 from data_layer.flask_proxy import FlaskProxy
-from data_layer.ssl_extension import HostNameIgnoringAdapter
+from business_layer.upstreams import prov_session, prov_extra_params, prov_guard, prov_load_balancer, PROV_BACKEND
+from business_layer.metrics import proxy_metrics
+from business_layer.coalescing import request_coalescing
+from business_layer.hedging import request_hedging
 from business_layer.timing import timed, GET_PROVENANCE_MEASUREMENT
-from app_settings import PROV_API_BASE_URI, VALIDATE_PROV_API_CERTIFICATE, USE_CUSTOM_PROV_API_CA_CERTIFICATE
+from app_settings import PROV_API_BASE_URI, STREAM_PROV_API_BODIES, STREAMING_CHUNK_SIZE, REQUEST_COMPRESSED_UPSTREAM_BODIES, PASS_THROUGH_COMPRESSED_BODIES
 
 blueprint = Blueprint("PROV routes", __name__)
 
-base_uri = PROV_API_BASE_URI
-validate_certificate = VALIDATE_PROV_API_CERTIFICATE
-use_custom_certificate = USE_CUSTOM_PROV_API_CA_CERTIFICATE
+proxy = FlaskProxy(blueprint, PROV_API_BASE_URI, session=prov_session, extra_params=prov_extra_params, stream=STREAM_PROV_API_BODIES, chunk_size=STREAMING_CHUNK_SIZE, name=PROV_BACKEND, metrics=proxy_metrics, timed=timed, upstream_compression=REQUEST_COMPRESSED_UPSTREAM_BODIES, pass_through_compression=PASS_THROUGH_COMPRESSED_BODIES, guard=prov_guard, load_balancer=prov_load_balancer)
 
-prov_session = Session()
-
-extra_params = {}
-if base_uri.startswith("https"):
-    if validate_certificate:
-        if use_custom_certificate:
-            prov_session.mount("https://", HostNameIgnoringAdapter())
-            certificate_path = path_utils.relative_path("other_certificates", "prov_api_ca_certificate.pem")
-            extra_params["verify"] = certificate_path
-    else:
-        extra_params["verify"] = False
-
-proxy = FlaskProxy(blueprint, PROV_API_BASE_URI, session=prov_session, extra_params=extra_params)
-
-@proxy.redirect("/provenance/service?target=<target>", methods=["GET"], decorators=[ timed.measure(GET_PROVENANCE_MEASUREMENT) ])
+@proxy.redirect("/provenance/service?target=<target>", methods=["GET"], measurement=GET_PROVENANCE_MEASUREMENT, single_flight=request_coalescing, hedging=request_hedging)
 def get_provenance(response):
     """
     Gets the provenance of a resource.
@@ -0,0 +1,99 @@
+from flask import Blueprint, Response, request
+import json
+
+import requests
+
+from data_layer.backend_guard import BackendUnavailable
+from data_layer.flask_proxy import gateway_error_response
+from business_layer import query_export_controller
+
+blueprint = Blueprint("Query export routes", __name__)
+
+def query_string_body() -> dict:
+    """
+    Converts the query string of an export request to the body of a query: query_parameters must be a JSON object, to which
+    ehr_id is added if given.
+    """
+
+    body = {}
+    if "q" in request.args:
+        body["q"] = request.args["q"]
+    for name in ["offset", "fetch"]:
+        if name in request.args:
+            body[name] = request.args[name]
+
+    query_parameters = json.loads(request.args.get("query_parameters", "{}"))
+    if not isinstance(query_parameters, dict):
+        raise ValueError("query_parameters must be a JSON object")
+    if "ehr_id" in request.args:
+        query_parameters["ehr_id"] = request.args["ehr_id"]
+    if len(query_parameters) > 0:
+        body["query_parameters"] = query_parameters
+    return body
+
+def request_body() -> dict:
+    body = request.get_json(force=True, silent=True)
+    if not isinstance(body, dict):
+        raise ValueError("the body must be a JSON object")
+    return body
+
+def export_response(create_export):
+    try:
+        export = create_export()
+    except ValueError as e:
+        return Response(
+            status = 400,
+            response=json.dumps({"error": str(e)}),
+            mimetype="application/json"
+        )
+
+    try:
+        status_code, content_type, body = query_export_controller.run_export(export)
+    except BackendUnavailable as e:
+        return gateway_error_response(503, e.reason, e.retry_after)
+    except requests.Timeout:
+        return gateway_error_response(504, "the remote service did not respond in time")
+    except requests.ConnectionError:
+        return gateway_error_response(502, "the remote service could not be reached")
+
+    return Response(
+        status = status_code,
+        response=body,
+        content_type=content_type
+    )
+
+@blueprint.route("/v1/query/aql/export", methods=["GET"])
+def export_ad_hoc_AQL_query():
+    """
+    Executes an ad hoc AQL query (with the same parameters of execute_ad_hoc_AQL_query) and sends all of its rows as
+    newline-delimited JSON, paging through the results.
+    """
+
+    return export_response(lambda: query_export_controller.ad_hoc_query_export(query_string_body(), request.headers))
+
+@blueprint.route("/v1/query/aql/export", methods=["POST"])
+def export_ad_hoc_AQL_query2():
+    """
+    Executes an ad hoc AQL query (with the same body of execute_ad_hoc_AQL_query2) and sends all of its rows as newline-delimited
+    JSON, paging through the results.
+    """
+
+    return export_response(lambda: query_export_controller.ad_hoc_query_export(request_body(), request.headers))
+
+@blueprint.route("/v1/query/<qualified_query_name>/<version>/export", methods=["GET"])
+def export_stored_query(qualified_query_name, version):
+    """
+    Executes a stored query (with the same parameters of execute_stored_query) and sends all of its rows as newline-delimited
+    JSON, paging through the results.
+    """
+
+    return export_response(lambda: query_export_controller.stored_query_export(qualified_query_name, version, query_string_body(), request.headers))
+
+@blueprint.route("/v1/query/<qualified_query_name>/<version>/export", methods=["POST"])
+def export_stored_query2(qualified_query_name, version):
+    """
+    Executes a stored query (with the same body of execute_stored_query2) and sends all of its rows as newline-delimited JSON,
+    paging through the results.
+    """
+
+    return export_response(lambda: query_export_controller.stored_query_export(qualified_query_name, version, request_body(), request.headers))
@@ -1,4 +1,4 @@
-from flask import Blueprint, Response
+from flask import Blueprint, Response, request
 import json
 
 from business_layer import timing_controller
@@ -7,8 +7,16 @@ blueprint = Blueprint("timing routes", __name__)
 
 @blueprint.route("/usage_statistics", methods=["GET"])
 def get_usage_statistics():
+    include_samples = (request.args.get("include_samples", "no").lower() == "yes")
+
     report = {
-        "usage_statistics": timing_controller.get_usage_statistics()
+        "usage_statistics": timing_controller.get_usage_statistics(include_samples),
+        "connection_pools": timing_controller.get_pool_statistics(),
+        "response_caches": timing_controller.get_cache_statistics(),
+        "request_coalescing": timing_controller.get_coalescing_statistics(),
+        "request_hedging": timing_controller.get_hedging_statistics(),
+        "backend_guards": timing_controller.get_guard_statistics(),
+        "load_balancers": timing_controller.get_load_balancer_statistics()
     }
 
     return Response(